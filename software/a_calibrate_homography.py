@@ -1,77 +1,224 @@
+'''Pixel -> paper homography: four clicks, or automatic from the paper / ArUco / chessboard target
+
+    python a_calibrate_homography.py                          # click the four corners
+    python a_calibrate_homography.py --auto aruco             # detect, average frames, save
+    python a_calibrate_homography.py --watch aruco --update   # background drift check while running
+    python a_calibrate_homography.py --make-target aruco target.png
+
+The matrix goes to the homography file named in settings.json; it is
+written atomically, so running control scripts swap it in on their next
+settings check without stopping.
+'''
+import argparse
+import time
+
 import cv2
 import numpy as np
-import json
 import urllib.request
 import os
 
+from frame_source import FrameSource, read_base_url
+from homography_calibration import DETECTORS, calibrate, drift_mm, load_matrix, render_target, save_matrix
+from pixel_remap import PAPER_HEIGHT, PAPER_WIDTH
+from settings import settings_file
+
 
 # Path settings
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 URL_PATH = os.path.join(BASE_DIR, 'url.txt')
 SAVE_PATH = os.path.join(BASE_DIR, 'homography_matrix.json')
 
-# Read image from URL
-with open(URL_PATH, 'r') as f:
-    url = f.read().strip().rstrip('/') + '/capture'
-
-# Download image
-print(f"Connecting to: {url}")
-with urllib.request.urlopen(url) as resp:
-    img_array = np.array(bytearray(resp.read()), dtype=np.uint8)
-    img = cv2.imdecode(img_array, -1)
-
-if img is None:
-    print("Failed to load image")
-    exit()
-
-# Mouse click settings
-points = []
-img_disp = img.copy()
-
-def on_mouse(event, x, y, flags, param):
-    if event == cv2.EVENT_LBUTTONDOWN and len(points) < 4:
-        points.append([x, y])
-        cv2.circle(img_disp, (x, y), 5, (0, 0, 255), -1)
-        cv2.putText(
-            img_disp,
-            str(len(points)),
-            (x + 5, y + 5),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.7,
-            (0, 0, 255),
-            2
-        )
-        cv2.imshow("Calibration", img_disp)
-
-cv2.namedWindow("Calibration")
-cv2.setMouseCallback("Calibration", on_mouse)
-cv2.imshow("Calibration", img_disp)
-
-print("Click four points (top-left → top-right → bottom-left → bottom-right), then press Enter.")
-
-# Wait loop
-while True:
-    key = cv2.waitKey(1) & 0xFF
-    if key == 13 and len(points) == 4:  # Enter
-        break
-    elif key == 27:  # ESC
-        exit()
-
-# Compute and save homography matrix
-real_pts = np.array([
-    [0, 0],
-    [388, 0],
-    [0, 297],
-    [388, 297]
-], dtype=np.float32)
-
-matrix, _ = cv2.findHomography(
-    np.array(points, dtype=np.float32),
-    real_pts
-)
-
-with open(SAVE_PATH, 'w') as f:
-    json.dump(matrix.tolist(), f, indent=4)  # Overwrites existing matrix file if present
-
-print(f"Saved successfully: {SAVE_PATH}")
-cv2.destroyAllWindows()
+# Automatic calibration
+AUTO_FRAMES = 10            # frames averaged per calibration
+MAX_ERROR_MM = 2.0          # fit error (Calibration.error_mm) above this is not saved
+WATCH_INTERVAL = 60.0       # s between drift checks
+DRIFT_MM = 2.0              # drift above this is flagged
+DRIFT_CONFIRM = 2           # consecutive drifted checks before --update swaps the matrix
+
+
+def matrix_path():
+    """ Homography file named in settings.json; homography_matrix.json next to this file without one. """
+    try:
+        return settings_file('homography')
+    except (OSError, KeyError, ValueError):
+        return SAVE_PATH
+
+
+def grab_frames(camera, count):
+    frames = []
+    for _ in range(count):
+        image, _ = camera.read(fresh=True)
+        if image is not None:
+            frames.append(image)
+    return frames
+
+
+def auto_calibration(base_url, path, method, args):
+    """ One calibration from args.frames fresh frames; saved when the error is small enough. """
+    with FrameSource(base_url) as camera:
+        frames = grab_frames(camera, args.frames)
+    try:
+        fit = calibrate(frames, method)
+    except ValueError as e:
+        print(f"Calibration failed: {e}")
+        return
+    print(fit.format())
+
+    if os.path.exists(path):
+        print(f"Change from the current matrix: {drift_mm(load_matrix(path), fit.matrix):.2f} mm")
+    if fit.error_mm > args.max_error:
+        print(f"Not saved: error above {args.max_error} mm (target flat and fully visible?)")
+        return
+    if args.dry_run:
+        print("Dry run, not saved.")
+        return
+    save_matrix(fit.matrix, path)
+    print(f"Saved successfully: {path}")
+
+
+def watch_calibration(base_url, path, method, args):
+    """
+    Re-fits every args.interval s during operation and reports how far the
+    view moved. Uses /capture only, so the control script keeps the stream.
+    With --update a drift seen on DRIFT_CONFIRM checks in a row is fixed by
+    swapping in the new matrix.
+    """
+    camera = FrameSource(base_url, use_stream=False)
+    drifted = 0
+    print(f"Watching {path} every {args.interval:.0f}s ({method}), drift limit {args.drift} mm")
+    try:
+        while True:
+            try:
+                fit = calibrate(grab_frames(camera, args.frames), method)
+            except ValueError as e:
+                # Arm or objects over the target: try again next time
+                print(f"[{time.strftime('%H:%M:%S')}] skipped: {e}")
+                time.sleep(args.interval)
+                continue
+
+            drift = drift_mm(load_matrix(path), fit.matrix)
+            status = 'ok'
+            if fit.error_mm > args.max_error:
+                status = 'poor fit, ignored'
+                drifted = 0
+            elif drift > args.drift:
+                drifted += 1
+                status = f'DRIFT ({drifted}/{DRIFT_CONFIRM})'
+                if args.update and drifted >= DRIFT_CONFIRM:
+                    save_matrix(fit.matrix, path)
+                    status = 'DRIFT, new matrix saved'
+                    drifted = 0
+            else:
+                drifted = 0
+            print(f"[{time.strftime('%H:%M:%S')}] drift {drift:.2f} mm, error {fit.error_mm:.2f} mm: {status}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        camera.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pixel -> paper homography calibration")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--auto', choices=sorted(DETECTORS), help='detect the target instead of clicking')
+    mode.add_argument('--watch', choices=sorted(DETECTORS), help='check for drift while the arm runs')
+    mode.add_argument('--make-target', nargs=2, metavar=('METHOD', 'PNG'),
+                      help='write a printable aruco / chessboard sheet (4 px per mm)')
+    parser.add_argument('--frames', type=int, default=AUTO_FRAMES, help='frames averaged per calibration')
+    parser.add_argument('--max-error', type=float, default=MAX_ERROR_MM, help='mm; worse fits are not saved')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='s between drift checks')
+    parser.add_argument('--drift', type=float, default=DRIFT_MM, help='mm of drift to flag')
+    parser.add_argument('--update', action='store_true', help='--watch: save the new matrix on confirmed drift')
+    parser.add_argument('--dry-run', action='store_true', help='--auto: report only')
+    args = parser.parse_args()
+
+    if args.make_target:
+        method, out = args.make_target
+        cv2.imwrite(out, render_target(method))
+        print(f"Saved {out}: print at 4 px/mm on the sheet (paper corners = image corners)")
+        return
+
+    path = matrix_path()
+    if args.auto or args.watch:
+        try:
+            base_url = read_base_url()
+        except FileNotFoundError:
+            print(f"Error: '{URL_PATH}' file not found.")
+            return
+        if args.auto:
+            auto_calibration(base_url, path, args.auto, args)
+        elif not os.path.exists(path):
+            print(f"Error: '{path}' not found, calibrate first.")
+        else:
+            watch_calibration(base_url, path, args.watch, args)
+        return
+
+    # Read image from URL
+    with open(URL_PATH, 'r') as f:
+        url = f.read().strip().rstrip('/') + '/capture'
+
+    # Download image
+    print(f"Connecting to: {url}")
+    with urllib.request.urlopen(url) as resp:
+        img_array = np.array(bytearray(resp.read()), dtype=np.uint8)
+        img = cv2.imdecode(img_array, -1)
+
+    if img is None:
+        print("Failed to load image")
+        return
+
+    # Mouse click settings
+    points = []
+    img_disp = img.copy()
+
+    def on_mouse(event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN and len(points) < 4:
+            points.append([x, y])
+            cv2.circle(img_disp, (x, y), 5, (0, 0, 255), -1)
+            cv2.putText(
+                img_disp,
+                str(len(points)),
+                (x + 5, y + 5),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.7,
+                (0, 0, 255),
+                2
+            )
+            cv2.imshow("Calibration", img_disp)
+
+    cv2.namedWindow("Calibration")
+    cv2.setMouseCallback("Calibration", on_mouse)
+    cv2.imshow("Calibration", img_disp)
+
+    print("Click four points (top-left → top-right → bottom-left → bottom-right), then press Enter.")
+
+    # Wait loop
+    while True:
+        key = cv2.waitKey(1) & 0xFF
+        if key == 13 and len(points) == 4:  # Enter
+            break
+        elif key == 27:  # ESC
+            return
+
+    # Compute and save homography matrix
+    real_pts = np.array([
+        [0, 0],
+        [PAPER_WIDTH, 0],
+        [0, PAPER_HEIGHT],
+        [PAPER_WIDTH, PAPER_HEIGHT]
+    ], dtype=np.float32)
+
+    matrix, _ = cv2.findHomography(
+        np.array(points, dtype=np.float32),
+        real_pts
+    )
+
+    save_matrix(matrix, path)  # Overwrites existing matrix file if present
+
+    print(f"Saved successfully: {path}")
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,113 +1,332 @@
-'''Find a mask for a specific colored object (HSV Tuner)'''
+'''Find a mask for a specific colored object (HSV Tuner)
+
+    python a_hsv_tuner.py            # asks for the class name
+    python a_hsv_tuner.py Green
+
+Frames come from a background reader (the stream, or /capture fetches when
+the stream is down); each new frame is converted to HSV once and the mask is
+only recomputed when the frame or a trackbar changed.
+Clicking the camera image sets the range from the pixels around the click.
+'s' saves the class straight into the colours file named in settings.json,
+where running control scripts pick it up.
+'''
+import argparse
+import threading
+
 import cv2
 import numpy as np
-import requests
-import os
-
-
-# --- 1. Path and URL setup ---
-# Based on current file location
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-URL_FILE_PATH = os.path.join(BASE_DIR, 'url.txt')
-
-# Read url.txt
-try:
-    with open(URL_FILE_PATH, 'r') as f:
-        base_url = f.read().strip().rstrip('/')
-        ESP32_URL = base_url + '/capture'
-    print(f"URL setup completed: {ESP32_URL}")
-except FileNotFoundError:
-    print(f"Error: '{URL_FILE_PATH}' file not found.")
-    print("Please create url.txt in the same folder.")
-    exit()
+
+from color_registry import COLOR_FILE_PATH, ColorClass, ColorRegistry
+from frame_source import CONNECT_TIMEOUT, FrameSource, read_base_url
+from settings import settings_file
+
+
+# --- 1. Windows and click sampling ---
+WINDOW = "HSV Tuner"
+MASK_WINDOW = "Mask (White=Select, Black=Ignore)"
+RESULT_WINDOW = "Result (Preview)"
+
+TRACKBARS = (("H_min", 179), ("H_max", 179), ("S_min", 255), ("S_max", 255), ("V_min", 255), ("V_max", 255))
+HUE_BINS = 180
+
+READ_RETRY_DELAY = 1.0         # s between reads after a failed one (camera unreachable)
+
+SAMPLE_RADIUS = 6              # px around the click (13x13 patch)
+SAMPLE_COVERAGE = 0.95         # fraction of the sampled pixels the range keeps
+SAMPLE_MARGIN = (4, 25, 25)    # H, S, V widened on each side of the sampled range
 
 # --- 2. Trackbar initialization ---
 def nothing(x):
     pass
 
-# Color select
+# Starting ranges for classes not yet in the colours file
 COLOR_PRESET = {
     "green":      (35, 85, 50, 255, 50, 255),
     "dark grey":  (0, 179, 0, 255, 0, 60),
 }
 
-mode_select = input("Choose color (green / dark grey): ").strip().lower()
-if mode_select in COLOR_PRESET:
-    color_H_min, color_H_max, color_S_min, color_S_max, color_V_min, color_V_max = COLOR_PRESET[mode_select]
-else:
-    print("Undefined color.")
-
-cv2.namedWindow("HSV Tuner")
-cv2.createTrackbar("H_min", "HSV Tuner", color_H_min, 179, nothing)
-cv2.createTrackbar("H_max", "HSV Tuner", color_H_max, 179, nothing)
-cv2.createTrackbar("S_min", "HSV Tuner", color_S_min, 255, nothing)
-cv2.createTrackbar("S_max", "HSV Tuner", color_S_max, 255, nothing)
-cv2.createTrackbar("V_min", "HSV Tuner", color_V_min, 255, nothing)
-cv2.createTrackbar("V_max", "HSV Tuner", color_V_max, 255, nothing)
-
-print("--- HSV Tuner Started ---")
-print("1. Adjust so that the object becomes 'white' in the Mask window.")
-print("2. Adjust so that the background and noise become 'black'.")
-print("3. Press 'q' to quit when finished.")
-
-# Variable initialization
-color_h_min, s_min, v_min = 0, 0, 0
-h_max, s_max, v_max = 179, 255, 255
-
-while True:
+
+# --- 3. Frames ---
+class FramePoller:
+    """
+    Reads frames on a background thread so the UI loop never waits on HTTP:
+    the next stream frame, or one /capture fetch (normal timeout) per read
+    while the stream is down. latest only changes when a new frame arrived.
+    """
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.latest = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.camera.start()
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.is_set():
+            frame = self.camera.read_frame(fresh=True, timeout=CONNECT_TIMEOUT)
+            if frame is not None:
+                self.latest = frame
+            elif not self.camera.streaming:
+                self._stop.wait(READ_RETRY_DELAY)
+
+    def stop(self):
+        # Let the read in progress finish first: a read on a stopped FrameSource restarts it
+        self._stop.set()
+        self._thread.join(timeout=CONNECT_TIMEOUT)
+        self.camera.stop()
+
+
+# --- 4. Thresholding ---
+def channel_table(lo, hi):
+    """ 256-entry 0/255 table for one channel; lo > hi wraps around (hue of reds), like ColorClass. """
+    table = np.zeros(256, dtype=np.uint8)
+    if lo <= hi:
+        table[lo:hi + 1] = 255
+    else:
+        table[lo:] = 255
+        table[:hi + 1] = 255
+    return table
+
+
+class Thresholder:
+    """
+    Mask of one HSV box over the current frame. The H, S, V planes are
+    split once per frame and each channel keeps its own mask, so moving one
+    trackbar re-runs only that channel's table lookup.
+    """
+
+    def __init__(self):
+        self.planes = None
+        self.bounds = [None] * 3
+        self.masks = [None] * 3
+        self.mask = None
+
+    def set_frame(self, hsv):
+        self.planes = cv2.split(hsv)
+        self.bounds = [None] * 3
+
+    def update(self, lower, upper):
+        """ Recomputes what changed; True when the mask is new. """
+        changed = False
+        for ch in range(3):
+            bounds = (lower[ch], upper[ch])
+            if bounds == self.bounds[ch]:
+                continue
+            self.bounds[ch] = bounds
+            self.masks[ch] = cv2.LUT(self.planes[ch], channel_table(*bounds))
+            changed = True
+        if changed:
+            self.mask = cv2.bitwise_and(cv2.bitwise_and(self.masks[0], self.masks[1]), self.masks[2])
+        return changed
+
+
+# --- 5. Click-to-sample ---
+def sample_histograms(hsv, x, y, radius=SAMPLE_RADIUS):
+    """ Per-channel histograms (H: 180 bins, S/V: 256) of the patch around (x, y). """
+    patch = hsv[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1].reshape(-1, 3)
+    return [np.bincount(patch[:, 0], minlength=HUE_BINS)[:HUE_BINS],
+            np.bincount(patch[:, 1], minlength=256),
+            np.bincount(patch[:, 2], minlength=256)]
+
+
+def linear_range(hist, coverage, margin, top):
+    """ Central coverage fraction of the histogram, widened by margin and clipped to 0..top. """
+    cum = np.cumsum(hist)
+    tail = (1.0 - coverage) / 2.0 * cum[-1]
+    lo = int(np.searchsorted(cum, tail, side='right'))
+    hi = int(np.searchsorted(cum, cum[-1] - tail, side='left'))
+    return max(lo - margin, 0), min(hi + margin, top)
+
+
+def hue_range(hist, coverage, margin):
+    """
+    Shortest arc of the hue circle holding coverage of the samples, so reds
+    sampled on both sides of 0/179 give a wrapping range (lo > hi).
+    """
+    n = len(hist)
+    cum = np.concatenate(([0], np.cumsum(np.concatenate((hist, hist)))))
+    need = coverage * cum[n]
+    starts = np.arange(n)
+    ends = np.searchsorted(cum, cum[starts] + need, side='left')
+    lengths = ends - starts
+    start = int(np.argmin(lengths))
+    length = int(lengths[start]) + 2 * margin
+    if length >= n:
+        return 0, n - 1
+    lo = (start - margin) % n
+    return lo, (lo + length - 1) % n
+
+
+def range_from_histograms(hists, coverage=SAMPLE_COVERAGE, margin=SAMPLE_MARGIN):
+    """ (lower, upper) HSV bounds covering the sampled pixels. """
+    h = hue_range(hists[0], coverage, margin[0])
+    s = linear_range(hists[1], coverage, margin[1], 255)
+    v = linear_range(hists[2], coverage, margin[2], 255)
+    return (h[0], s[0], v[0]), (h[1], s[1], v[1])
+
+
+def set_trackbars(lower, upper):
+    values = (lower[0], upper[0], lower[1], upper[1], lower[2], upper[2])
+    for (name, _), value in zip(TRACKBARS, values):
+        cv2.setTrackbarPos(name, WINDOW, int(value))
+
+
+def read_trackbars():
+    h_min, h_max, s_min, s_max, v_min, v_max = (cv2.getTrackbarPos(name, WINDOW) for name, _ in TRACKBARS)
+    return (h_min, s_min, v_min), (h_max, s_max, v_max)
+
+
+# --- 6. Colours file ---
+def colors_path():
+    """ Colours file named in settings.json; colors.json next to this file without one. """
+    try:
+        return settings_file('colors')
+    except (OSError, KeyError, ValueError):
+        return COLOR_FILE_PATH
+
+
+def load_registry(path):
+    try:
+        return ColorRegistry.load(path)
+    except FileNotFoundError:
+        return ColorRegistry()
+
+
+def save_color(path, name, lower, upper):
+    registry = load_registry(path)
+    previous = registry.get(name)
+    if previous:
+        # Keep the tuned area / circularity limits of an existing class
+        color = ColorClass(name, lower, upper, previous.min_area, previous.min_circularity)
+    else:
+        color = ColorClass(name, lower, upper)
+    registry.update(color)
+    registry.save(path)
+    print(f"Saved '{name}' {color.lower} - {color.upper} to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HSV tuner: saves colour classes for the detection scripts")
+    parser.add_argument('name', nargs='?', help='colour class to tune (e.g. Green / Black)')
+    parser.add_argument('--colors', help='colours file (default: files.colors in settings.json)')
+    args = parser.parse_args()
+
+    # Read url.txt
     try:
-        # --- Fetch image ---
-        response = requests.get(ESP32_URL, timeout=5)
-        if response.status_code != 200:
-            print("Waiting for ESP32 communication...")
-            continue
-            
-        img_array = np.frombuffer(response.content, dtype=np.uint8)
-        image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            continue
-
-        # --- Image processing ---
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-        # Read trackbar values
-        color_h_min = cv2.getTrackbarPos("H_min", "HSV Tuner")
-        h_max = cv2.getTrackbarPos("H_max", "HSV Tuner")
-        s_min = cv2.getTrackbarPos("S_min", "HSV Tuner")
-        s_max = cv2.getTrackbarPos("S_max", "HSV Tuner")
-        v_min = cv2.getTrackbarPos("V_min", "HSV Tuner")
-        v_max = cv2.getTrackbarPos("V_max", "HSV Tuner")
-
-        # Create mask
-        lower_range = np.array([color_h_min, s_min, v_min])
-        upper_range = np.array([h_max, s_max, v_max])
-        mask = cv2.inRange(hsv, lower_range, upper_range)
-        
-        # Combine result
-        result = cv2.bitwise_and(image, image, mask=mask)
-
-        # --- Display ---
-        cv2.imshow("Mask (White=Select, Black=Ignore)", mask)
-        cv2.imshow("Result (Preview)", result)
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-
-    except requests.exceptions.RequestException:
-        # Ignore connection errors and retry (prevent terminal spam)
-        break
+        base_url = read_base_url()
+        print(f"URL setup completed: {base_url}")
+    except FileNotFoundError as e:
+        print(f"Error: '{e.filename}' file not found.")
+        print("Please create url.txt in the same folder.")
+        return
+
+    path = args.colors or colors_path()
+    name = args.name or input("Color class to tune (e.g. Green / Black): ").strip()
+    if not name:
+        print("Undefined color.")
+        return
+
+    # Start from the saved class, then a preset, then the full range
+    previous = load_registry(path).get(name)
+    if previous:
+        lower, upper = previous.lower, previous.upper
+    elif name.lower() in COLOR_PRESET:
+        h_min, h_max, s_min, s_max, v_min, v_max = COLOR_PRESET[name.lower()]
+        lower, upper = (h_min, s_min, v_min), (h_max, s_max, v_max)
+    else:
+        lower, upper = (0, 0, 0), (179, 255, 255)
+
+    cv2.namedWindow(WINDOW)
+    for trackbar, top in TRACKBARS:
+        cv2.createTrackbar(trackbar, WINDOW, 0, top, nothing)
+    set_trackbars(lower, upper)
+
+    clicks = []
+
+    def on_mouse(event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            clicks.append((x, y, bool(flags & cv2.EVENT_FLAG_SHIFTKEY)))
+
+    cv2.setMouseCallback(WINDOW, on_mouse)
+
+    print(f"--- HSV Tuner Started: '{name}' -> {path} ---")
+    print("1. Adjust so that the object becomes 'white' in the Mask window.")
+    print("2. Or click the object in the camera image to set the range (Shift+click adds to it).")
+    print("3. H_min > H_max wraps around 0 (reds).")
+    print("4. 's' save, 'space' freeze / unfreeze the frame, 'q' quit.")
+
+    # Background reader keeps the latest frame; the UI loop never waits on the network
+    poller = FramePoller(FrameSource(base_url)).start()
+    thresholder = Thresholder()
+    frame = image = hsv = None
+    hists = None
+    sample_box = None
+    frozen = False
+    saved = current = previous and (previous.lower, previous.upper)
+    print("Waiting for ESP32 communication...")
+
+    try:
+        while True:
+            redraw = False
+
+            # --- New frame: one decode and HSV conversion ---
+            latest = None if frozen else poller.latest
+            if latest is not None and latest is not frame:
+                frame = latest
+                image = frame.image
+                hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+                thresholder.set_frame(hsv)
+                redraw = True
+
+            if hsv is not None:
+                # --- Click: range from the patch histogram ---
+                while clicks:
+                    x, y, add = clicks.pop(0)
+                    patch = sample_histograms(hsv, x, y)
+                    hists = [a + b for a, b in zip(hists, patch)] if add and hists else patch
+                    lower, upper = range_from_histograms(hists)
+                    set_trackbars(lower, upper)
+                    sample_box = (x, y)
+                    redraw = True
+
+                # --- Trackbars: only the moved channel is re-thresholded ---
+                current = read_trackbars()
+                if thresholder.update(*current):
+                    redraw = True
+
+                if redraw:
+                    view = image
+                    if sample_box is not None:
+                        view = image.copy()
+                        x, y = sample_box
+                        cv2.rectangle(view, (x - SAMPLE_RADIUS, y - SAMPLE_RADIUS),
+                                      (x + SAMPLE_RADIUS, y + SAMPLE_RADIUS), (0, 0, 255), 1)
+                    cv2.imshow(WINDOW, view)
+                    cv2.imshow(MASK_WINDOW, thresholder.mask)
+                    cv2.imshow(RESULT_WINDOW, cv2.bitwise_and(image, image, mask=thresholder.mask))
+
+            key = cv2.waitKey(15) & 0xFF
+            if key == ord('q') or key == 27:
+                break
+            if key == ord(' '):
+                frozen = not frozen
+                print("Frame frozen." if frozen else "Live.")
+            if key == ord('s') and hsv is not None:
+                save_color(path, name, *current)
+                saved = current
     except KeyboardInterrupt:
-        break
-
-cv2.destroyAllWindows()
-
-# --- Final values output ---
-print("\n" + "="*30)
-print(" [Final Tuning Result] ")
-print(" Copy and use the code below:")
-print("="*30)
-print(f"lower_color = np.array([{color_h_min}, {s_min}, {v_min}])")
-print(f"upper_color = np.array([{h_max}, {s_max}, {v_max}])")
-print("="*30)
+        pass
+    finally:
+        poller.stop()
+        cv2.destroyAllWindows()
+
+    if hsv is not None and current != saved:
+        print(f"Not saved: '{name}' {current[0]} - {current[1]} (press 's' before quitting to save).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+'''Arm motion and the slide-in pick sequence, shared by final_com_with_P.py and cell.py
+
+One ArmMotion per arm. Geometry (link lengths, motor offsets and limits,
+home) and motion settings (profile, dt, gains, path tolerance) come from the
+settings.Settings snapshot passed in; update() swaps in a new one between
+moves. Drop zones are passed per pick, since cells have their own.
+
+    motion = ArmMotion(transport, load_settings())
+    motion.pick_and_place('Green', (x, y, z), settings.drop_zones['Green'])
+'''
+import time
+from collections import deque
+
+import numpy as np
+
+import ik_batch
+import trajectory
+from cartesian_path import linear_motor_path
+from metrics import metrics
+
+
+# --- Pick sequence ---
+CLAW_OPEN = 30
+CLAW_CLOSED = 0
+APPROACH_DIST = 50.0       # mm left of the object where the slide starts
+LIFT_HEIGHT = 40.0         # mm lifted straight up after the grip
+LIFT_FALLBACK_DEG = 25     # shoulder raise when no lift pose is solvable
+
+MOTION_LOG_SIZE = 1000
+
+
+def pid_setpoints(current, targets, kp, max_speed, threshold):
+    """
+    P-control profile: each step moves every joint by kp * error, capped at
+    max_speed, until all joints are within threshold. Returns (setpoints, end).
+    """
+    current = list(current)
+    setpoints = []
+    while True:
+        all_arrived = True
+        for i in range(4):
+            error = targets[i] - current[i]
+            if abs(error) > threshold:
+                all_arrived = False
+                current[i] += max(-max_speed, min(max_speed, error * kp))
+            else:
+                current[i] = targets[i]
+        setpoints.append(tuple(int(a) for a in current))
+        if all_arrived:
+            break
+    return setpoints, current
+
+
+class ArmMotion:
+    """
+    Joint-space and straight-line moves plus pick_and_place() for one arm.
+    Not thread-safe: one caller at a time.
+
+    on_phase(phase, color_name) is called as each pick phase starts (for
+    progress output); labels are added to every metric (e.g. cell=...).
+    """
+
+    def __init__(self, transport, settings, on_phase=None, labels=None):
+        self.arm = transport
+        self.settings = settings
+        self.on_phase = on_phase
+        self.labels = labels or {}
+        self.angles = [float(a) for a in settings.home]
+        self.planned_time = 0.0        # s of planned motion, summed
+        self.idle_time = 0.0           # s spent in settle delays, summed
+        self.motion_log = deque(maxlen=MOTION_LOG_SIZE)   # (commands, planned s, actual s) per move
+
+    def update(self, settings):
+        self.settings = settings
+
+    # --- moves ---
+    def settle(self, seconds):
+        """ Fixed wait after a move; skipped for a simulated sink without real time. """
+        if seconds <= 0 or not self.arm.realtime:
+            return
+        time.sleep(seconds)
+        self.idle_time += seconds
+        metrics.count('settle_seconds_total', seconds, **self.labels)
+
+    def plan(self, waypoints):
+        """ Setpoints every dt from the current angles through waypoints (profile from settings). """
+        s = self.settings
+        if s.profile == 'trapezoid':
+            plan = trajectory.plan([self.angles] + [list(w) for w in waypoints], s.max_vel, s.max_acc, s.dt)
+            self.angles = [float(a) for a in plan.setpoints[-1]]
+            return plan.as_commands()
+        setpoints = []
+        for w in waypoints:
+            points, self.angles = pid_setpoints(self.angles, list(w), s.kp, s.max_speed, s.threshold)
+            setpoints += points
+        return setpoints
+
+    def move_through(self, waypoints, arrival_delay=0.5):
+        """ Passes through every waypoint without stopping, then waits arrival_delay. """
+        started = time.time()
+        dt = self.settings.dt
+        setpoints = self.plan(waypoints)
+        self.planned_time += len(setpoints) * dt
+
+        # Binary: the whole trajectory in one burst, played back by the UNO every dt
+        # Text: the host paces one line per dt
+        self.arm.send_trajectory(setpoints, int(dt * 1000))
+        self.arm.wait_idle()
+        self.motion_log.append((len(setpoints), len(setpoints) * dt, time.time() - started))
+        self.settle(arrival_delay)
+
+    def move_to(self, angles, arrival_delay=0.5):
+        self.move_through([angles], arrival_delay)
+
+    def send_raw(self, angles, delay=1.0):
+        """ One immediate command (start-up / emergency), no trajectory. """
+        self.angles = [float(a) for a in angles]
+        cmd = self.arm.send(*angles, wait=True)
+        if not self.arm.is_loopback:
+            # the time until the ack counts towards the delay
+            self.settle(delay - (time.time() - cmd.sent_at))
+
+    def home(self, arrival_delay=0.5):
+        self.move_to(self.settings.home, arrival_delay)
+
+    # --- Cartesian ---
+    def motor_angles(self, points):
+        s = self.settings
+        return ik_batch.solve_motor_angles(points, s.l1, s.l2, s.motor_offsets, s.motor_min, s.motor_max)
+
+    def to_xyz(self, motor):
+        s = self.settings
+        return tuple(ik_batch.motor_to_cartesian(motor[:3], s.l1, s.l2, s.motor_offsets)[0])
+
+    def current_xyz(self):
+        return self.to_xyz(self.angles)
+
+    def move_linear(self, p0, p1, claw, arrival_delay=0.5):
+        """ Straight line p0 -> p1 (robot mm); False without moving when part of it is unreachable. """
+        s = self.settings
+        motor, codes = linear_motor_path(p0, p1, s.path_tolerance, s.l1, s.l2, offsets=s.motor_offsets,
+                                         motor_min=s.motor_min, motor_max=s.motor_max)
+        if np.any(codes != ik_batch.IK_OK):
+            return False
+        self.move_through([(*m_vals, claw) for m_vals in motor[1:].tolist()], arrival_delay)
+        return True
+
+    # --- pick ---
+    def _phase(self, phase, color_name):
+        if self.on_phase is not None:
+            self.on_phase(phase, color_name)
+        return metrics.span('pick_phase_seconds', phase=phase, **self.labels)
+
+    def pick_and_place(self, color_name, target_coords, drop, on_release=None, via_home=True):
+        """
+        Slide in from APPROACH_DIST mm to the left, grip, lift, carry to the
+        drop motor angles and release. via_home=False starts from wherever the
+        arm is (batch / pipeline). Returns True when the object was placed.
+        """
+        tx, ty, tz = target_coords
+        start = (tx - APPROACH_DIST, ty, tz)
+        lift = (tx, ty, tz + LIFT_HEIGHT)
+        motor, codes = self.motor_angles([start, (tx, ty, tz), lift])
+        if drop is None or codes[0] != ik_batch.IK_OK or codes[1] != ik_batch.IK_OK:
+            metrics.count('picks_total', color=color_name, result='unreachable', **self.labels)
+            return False
+        motor_start, motor_target, motor_lift = motor.tolist()
+        started = time.perf_counter()
+
+        # 1. Home (batch / pipeline picks start from the previous drop zone)
+        if via_home:
+            with self._phase('home', color_name):
+                self.home(arrival_delay=0.2)
+
+        # 2. Left of the object (straight line, joint space if not possible)
+        with self._phase('approach', color_name):
+            if not self.move_linear(self.current_xyz(), start, CLAW_OPEN):
+                self.move_to((*motor_start, CLAW_OPEN))
+
+        # 3. Slide in without stopping
+        with self._phase('slide', color_name):
+            if not self.move_linear(start, (tx, ty, tz), CLAW_OPEN, arrival_delay=0.0):
+                self.move_to((*motor_target, CLAW_OPEN), arrival_delay=0.0)
+
+        # 4. Grip
+        with self._phase('grip', color_name):
+            self.move_to((*motor_target, CLAW_CLOSED))
+
+        # 5. Lift (straight up, else the lift pose or a shoulder raise)
+        with self._phase('lift', color_name):
+            if not self.move_linear((tx, ty, tz), lift, CLAW_CLOSED, arrival_delay=0.3):
+                if codes[2] == ik_batch.IK_OK:
+                    self.move_to((*motor_lift, CLAW_CLOSED), arrival_delay=0.3)
+                else:
+                    mb, ms, me = motor_target
+                    self.move_to((mb, ms - LIFT_FALLBACK_DEG, me, CLAW_CLOSED), arrival_delay=0.3)
+
+        # 6. Drop zone, finishing on its exact angles
+        with self._phase('drop', color_name):
+            self.move_linear(self.current_xyz(), self.to_xyz(drop), CLAW_CLOSED, arrival_delay=0.0)
+            self.move_to((*drop, CLAW_CLOSED))
+
+        with self._phase('release', color_name):
+            self.move_to((*drop, CLAW_OPEN))
+        if on_release:
+            on_release()
+
+        if via_home:
+            with self._phase('return', color_name):
+                self.home()
+        metrics.observe('pick_seconds', time.perf_counter() - started, color=color_name, **self.labels)
+        metrics.count('picks_total', color=color_name, result='done', **self.labels)
+        return True
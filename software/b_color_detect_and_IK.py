@@ -1,47 +1,33 @@
 import cv2
 import numpy as np
-import requests
-import json
 import time
-import os
 import math
 
-# --- [설정] 로봇 링크 길이 ---
-L1 = 82.0
-L2 = 81.0
-
-# --- [설정] 로봇 오프셋 ---
-ROBOT_OFFSET_X = -50.0
-ROBOT_OFFSET_Y = -190.0
-catch_z_axis = -30.0
-
-# --- 파일 경로 설정 ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-URL_FILE_PATH = os.path.join(BASE_DIR, 'url.txt')
-MATRIX_FILE_PATH = os.path.join(BASE_DIR, 'homography_matrix.json')
-
-# --- 파일 로드 ---
-try:
-    with open(URL_FILE_PATH, 'r') as f:
-        base_url = f.read().strip().rstrip('/')
-        ESP32_URL = base_url + '/capture'
-except FileNotFoundError:
-    print(f"[에러] '{URL_FILE_PATH}' 파일을 찾을 수 없습니다.")
-    exit()
-
-try:
-    with open(MATRIX_FILE_PATH, 'r') as f:
-        matrix_list = json.load(f)
-        homography_matrix = np.array(matrix_list)
-except FileNotFoundError:
-    print(f"[에러] '{MATRIX_FILE_PATH}' 파일을 찾을 수 없습니다.")
-    exit()
+from detection import StageTimer, detect_blobs, get_roi
+from frame_source import FrameSource, read_base_url
+from ik_batch import IK_OK, STATUS_TEXT
+from ik_grid import IKGrid
+from pixel_remap import get_remap
+from settings import load_settings
+
+
+# --- [설정] 링크 길이, 모터 보정값, 로봇 오프셋: settings.json ---
+# import 시에는 읽지 않음, main() 또는 load_calibration() 에서 설정
+settings = None   # settings.Settings (색상 목록, 호모그래피 포함)
+ik_grid = None
+
+def load_calibration():
+    global settings, ik_grid
+    settings = load_settings()
+    # 작업 영역 IK 테이블 (링크 길이 / 보정값 / 오프셋 변경 시 자동 재생성)
+    ik_grid = IKGrid.load_or_build(**settings.ik_params())
 
 # --- 역운동학 함수 ---
 def inverse_kinematics(x, y, z):
     r_dist = math.sqrt(x**2 + y**2)
     dist = math.sqrt(r_dist**2 + z**2)
     
+    L1, L2 = settings.l1, settings.l2
     if dist > (L1 + L2): return None, "거리 초과"
     
     theta_base = math.degrees(math.atan2(y, x))
@@ -67,78 +53,70 @@ def calculate_motor_angles(angles):
     if not angles: return None
     b, s, e = angles
     
-    # 수정된 보정값
-    # Base: 70 + 4 = 74
-    final_base = int(b + 74) 
-    
-    # Shoulder: 107 - 2 = 105
-    final_shoulder = int(s + 105)
-    
-    # Elbow: -49 + 7 = -42
-    final_elbow = int(e - 42)
+    # 보정값 / 제한 범위 (settings.json robot.motor_offsets / motor_min / motor_max)
+    (ob, os_, oe), lo, hi = settings.motor_offsets, settings.motor_min, settings.motor_max
+    final_base = int(b + ob)
+    final_shoulder = int(s + os_)
+    final_elbow = int(e + oe)
     
-    final_base = max(29, min(160, final_base))
-    final_shoulder = max(10, min(160, final_shoulder))
-    final_elbow = max(10, min(120, final_elbow))
+    final_base = max(lo[0], min(hi[0], final_base))
+    final_shoulder = max(lo[1], min(hi[1], final_shoulder))
+    final_elbow = max(lo[2], min(hi[2], final_elbow))
     
     return (final_base, final_shoulder, final_elbow)
 
 # --- 객체 감지 함수 ---
-def find_objects(image, mask, color_name, matrix, min_area, min_circularity):
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+# blobs: detect_blobs()가 찾은 레코드 배열 (모든 색상)
+def find_objects(image, blobs, matrix):
+    if len(blobs) == 0:
+        return []
+
+    # 모든 중심점을 픽셀→로봇 좌표 테이블에서 한 번에 조회, 도달 불가 물체는 IK 테이블로 제외
+    remap = get_remap(matrix, image.shape, settings.offset_x, settings.offset_y)
+
+    robot_pts = np.empty((len(blobs), 3))
+    robot_pts[:, :2] = remap.to_robot(blobs.x, blobs.y)
+    robot_pts[:, 2] = settings.catch_z
+
+    motor, codes = ik_grid.solve_motor_angles(robot_pts)
+
     results = []
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > min_area:
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0: continue
-            circularity = (4 * np.pi * area) / (perimeter * perimeter)
-            
-            if circularity > min_circularity:
-                M = cv2.moments(cnt)
-                if M["m00"] != 0:
-                    cX = int(M["m10"] / M["m00"])
-                    cY = int(M["m01"] / M["m00"])
-                    
-                    pixel_point = np.array([[[cX, cY]]], dtype=np.float32)
-                    real_point = cv2.perspectiveTransform(pixel_point, matrix)
-                    paper_x = float(real_point[0][0][0])
-                    paper_y = float(real_point[0][0][1])
-                    
-                    robot_x = paper_x + ROBOT_OFFSET_X
-                    robot_y = -(paper_y + ROBOT_OFFSET_Y)
-                    robot_z = catch_z_axis
-                    
-                    angles, status = inverse_kinematics(robot_x, robot_y, robot_z)
-                    motor_vals = calculate_motor_angles(angles)
-                    
-                    results.append({
-                        "color": color_name,
-                        "motor_vals": motor_vals,
-                        "robot_coords": (robot_x, robot_y, robot_z),
-                        "status": status,
-                        "pixel_coords": (cX, cY),
-                        "contour": cnt
-                    })
+    for blob, (robot_x, robot_y, robot_z), m_vals, code in zip(
+            blobs, robot_pts.tolist(), motor.tolist(), codes.tolist()):
+        results.append({
+            "color": settings.colors.names[blob.label - 1],
+            "motor_vals": tuple(m_vals) if code == IK_OK else None,
+            "robot_coords": (robot_x, robot_y, robot_z),
+            "status": STATUS_TEXT[code],
+            "pixel_coords": (int(blob.x), int(blob.y)),
+            "bbox": (int(blob.left), int(blob.top), int(blob.width), int(blob.height))
+        })
     return results
 
 # --- 메인 실행 루프 ---
 def main():
+    try:
+        base_url = read_base_url()
+        load_calibration()
+    except FileNotFoundError as e:
+        print(f"[에러] '{e.filename}' 파일을 찾을 수 없습니다.")
+        return
+    except (KeyError, ValueError) as e:
+        print(f"[에러] 설정 파일 오류: {e}")
+        return
+
     print("\n--- 물체 감지 및 시각화 ---")
-    print("ESP32 URL:", ESP32_URL)
+    print("ESP32 URL:", base_url)
     
     image = None
     
     # 1. 이미지 가져오기
     try:
         print(f" >> 이미지 요청 중...")
-        response = requests.get(ESP32_URL, timeout=5)
-        if response.status_code == 200:
-            img_array = np.frombuffer(response.content, dtype=np.uint8)
-            image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            if image is not None:
-                print(" >> 이미지 수신 성공!\n")
+        with FrameSource(base_url) as camera:
+            image, _ = camera.read()
+        if image is not None:
+            print(" >> 이미지 수신 성공!\n")
     except Exception as e:
         print(f"    연결 에러: {e}")
     
@@ -146,23 +124,16 @@ def main():
         print("[실패] 이미지를 가져오지 못했습니다. 카메라 연결을 확인하세요.")
         return
 
-    # 2. 이미지 처리
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    lower_green = np.array([49, 101, 35])
-    upper_green = np.array([85, 255, 255])
-    green_mask = cv2.inRange(hsv, lower_green, upper_green)
-    
-    lower_black = np.array([0, 0, 0])
-    upper_black = np.array([180, 255, 50])
-    black_mask = cv2.inRange(hsv, lower_black, upper_black)
-    
-    green_objs = find_objects(image, green_mask, "Green", homography_matrix, 300, 0.7)
-    black_objs = find_objects(image, black_mask, "Black", homography_matrix, 200, 0.6)
+    # 2. 이미지 처리 (캘리브레이션한 종이 영역만 검사)
+    roi = get_roi(settings.homography, image.shape)
+    timer = StageTimer()
+    blobs = detect_blobs(image, settings.colors, roi, timer=timer)
     
-    all_objs = green_objs + black_objs
+    all_objs = find_objects(image, blobs, settings.homography)
+    print(f" >> 감지 시간: {timer.format()}")
     
     result_image = image.copy()
+    cv2.polylines(result_image, [np.round(roi.polygon).astype(np.int32)], True, (255, 255, 0), 1)
 
     # 3. 결과 시각화
     print("       [분석 결과]")
@@ -173,7 +144,7 @@ def main():
             status = obj['status']
             rx, ry, rz = obj['robot_coords']
             cx, cy = obj['pixel_coords']
-            cnt = obj['contour']
+            x, y, w, h = obj['bbox']
             
             print(f"{i+1}. 발견된 물체: [{color}]")
             if status == "성공":
@@ -194,7 +165,7 @@ def main():
                 text_line3 = f"Status: {status}"
                 box_color = (0, 0, 255)
 
-            cv2.drawContours(result_image, [cnt], -1, box_color, 2)
+            cv2.rectangle(result_image, (x, y), (x + w, y + h), box_color, 2)
             cv2.circle(result_image, (cx, cy), 5, (255, 0, 0), -1)
 
             font = cv2.FONT_HERSHEY_SIMPLEX
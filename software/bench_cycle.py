@@ -0,0 +1,166 @@
+'''End-to-end pick cycle benchmark: where the seconds of a cycle go
+
+One cycle = fresh frame -> decode -> detection -> IK -> pick_and_place() of
+the first reachable object, exactly as final_com_with_P.py runs it.
+
+    python bench_cycle.py --cycles 20                       # stand-in camera + simulated arm
+    python bench_cycle.py --cycles 20 --replay session.rec  # recorded frames, no sleeps
+    python bench_cycle.py --cycles 5 --hardware --json cycle.json
+'''
+import argparse
+import json
+import time
+
+import numpy as np
+
+import final_com_with_P as app
+from frame_source import FrameSource, decode_jpeg
+from serial_transport import LoopbackTransport
+from settings import load_settings
+
+
+PERCENTILES = (50, 95, 99)
+# Stages of one cycle in report order (detection stages come from detect_timer)
+STAGE_ORDER = ('fetch', 'decode', 'crop', 'hsv', 'classify', 'components', 'refine', 'ik',
+               'detect', 'motion', 'pacing', 'idle', 'cycle')
+
+
+def summarize(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    row = {'count': int(values.size), 'mean': float(values.mean()), 'max': float(values.max())}
+    for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        row[f'p{p}'] = float(v)
+    return row
+
+
+def open_devices(config, args):
+    """ (camera, server) for the chosen mode; attaches the Arduino (--hardware) or a simulated arm to app. """
+    server = None
+    if args.hardware:
+        app.attach_arm(app.connect_arm(config))
+        return FrameSource(config.camera_url, decode=False).start(), None
+
+    if args.replay:
+        from recording import ReplaySource
+        app.attach_arm(LoopbackTransport(realtime=False))
+        return ReplaySource(args.replay, loop=True, decode=False).start(), None
+
+    from fake_camera import FakeCamera, FakeCameraServer, synthetic_frames
+    app.attach_arm(LoopbackTransport(latency=args.serial_latency))
+    server = FakeCameraServer(FakeCamera(synthetic_frames(10), fps=args.fps, latency=args.http_latency),
+                              port=args.port).start()
+    return FrameSource(server.base_url, decode=False).start(), server
+
+
+def run(app, camera, cycles):
+    """ Returns ({stage: [ms per cycle]}, [commands per move], picks). """
+    samples = {name: [] for name in STAGE_ORDER}
+    commands = []
+    picks = 0
+
+    for _ in range(cycles):
+        started = time.perf_counter()
+        idle_before = app.robot.idle_time
+        paced_before = app.arm.paced_time
+        app.robot.motion_log.clear()
+
+        jpeg, _ = camera.read_jpeg(fresh=True)
+        fetched = time.perf_counter()
+        if jpeg is None:
+            continue
+        image = decode_jpeg(jpeg)
+        decoded = time.perf_counter()
+
+        objs = app.detect_objects(image)
+        detected = time.perf_counter()
+        for name, ms in app.detect_timer.last.items():
+            samples.setdefault(name, []).append(ms)
+
+        obj = app.first_reachable(objs)
+        if obj:
+            app.pick_and_place(obj['color'], obj['robot_coords'])
+            picks += 1
+        finished = time.perf_counter()
+
+        idle = app.robot.idle_time - idle_before
+        # text protocol: the host sleeps hold_ms between trajectory lines
+        pacing = app.arm.paced_time - paced_before
+        commands += [n for n, _, _ in app.robot.motion_log]
+        samples['fetch'].append((fetched - started) * 1000.0)
+        samples['decode'].append((decoded - fetched) * 1000.0)
+        samples['detect'].append((detected - decoded) * 1000.0)
+        samples['motion'].append((finished - detected - idle - pacing) * 1000.0)
+        samples['pacing'].append(pacing * 1000.0)
+        samples['idle'].append(idle * 1000.0)
+        samples['cycle'].append((finished - started) * 1000.0)
+    return samples, commands, picks
+
+
+def format_report(report):
+    header = f"{'stage':<12} {'n':>5} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    lines = [header, '-' * len(header)]
+    for name, row in report['stages'].items():
+        lines.append(f"{name:<12} {row['count']:>5} {row['mean']:>9.2f} {row['p50']:>9.2f} "
+                     f"{row['p95']:>9.2f} {row['p99']:>9.2f} {row['max']:>9.2f}")
+    lines.append('(ms)')
+    moves = report['commands_per_move']
+    if moves:
+        lines.append(f"commands/move: mean {moves['mean']:.1f}, p50 {moves['p50']:.0f}, "
+                     f"p95 {moves['p95']:.0f}, max {moves['max']:.0f} ({moves['count']} moves)")
+    total = max(report['total_s'], 1e-9)
+    lines.append(f"cycles {report['cycles']}, picks {report['picks']}, "
+                 f"idle {report['idle_s']:.2f}s ({100.0 * report['idle_s'] / total:.0f}%), "
+                 f"pacing {report['pacing_s']:.2f}s ({100.0 * report['pacing_s'] / total:.0f}%) "
+                 f"of {report['total_s']:.2f}s")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--hardware', action='store_true', help='camera from url.txt and the Arduino on serial.port (settings.json)')
+    mode.add_argument('--replay', help='recorded frames, simulated arm without sleeps')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8080, help='stand-in camera port')
+    parser.add_argument('--fps', type=float, default=20.0, help='stand-in camera frame rate')
+    parser.add_argument('--http-latency', type=float, default=0.0, help='s added to stand-in camera responses')
+    parser.add_argument('--serial-latency', type=float, default=0.002, help='s per simulated serial ack')
+    parser.add_argument('--json', help='also write the report here')
+    args = parser.parse_args()
+
+    app.apply_settings(load_settings())
+    config = app.make_config(camera=args.hardware)
+    camera, server = open_devices(config, args)
+    try:
+        app.send_raw(*app.settings.home, delay=1.0)
+        started = time.time()
+        samples, commands, picks = run(app, camera, args.cycles)
+        total = time.time() - started
+    finally:
+        camera.stop()
+        if server is not None:
+            server.stop()
+        app.arm.close()
+
+    stages = [name for name in STAGE_ORDER if samples.get(name)]
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': 'hardware' if args.hardware else 'replay' if args.replay else 'stand-in',
+        'profile': app.settings.profile,
+        'protocol': 'binary' if app.arm.binary else 'text',
+        'cycles': len(samples['cycle']),
+        'picks': picks,
+        'total_s': total,
+        'idle_s': float(np.sum(samples['idle'])) / 1000.0 if samples['idle'] else 0.0,
+        'pacing_s': float(np.sum(samples['pacing'])) / 1000.0 if samples['pacing'] else 0.0,
+        'stages': {name: summarize(samples[name]) for name in stages},
+        'commands_per_move': summarize(commands) if commands else {},
+    }
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
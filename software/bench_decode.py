@@ -0,0 +1,104 @@
+'''Decode-stage benchmark: full JPEG decode vs DCT-scaled decode (1/2, 1/4, 1/8) and what it saves in detection
+
+    python bench_decode.py                          # VGA/SVGA/UXGA, camera JPEG quality
+    python bench_decode.py --framesize 8 --objects 0 6 --repeat 50
+'''
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bench_detection import score
+from color_registry import ColorRegistry
+from detection import StageTimer, detect_frame, get_roi
+from fake_camera import DEFAULT_QUALITY, cv2_quality
+from frame_source import JpegDecoder, JpegFrame, decode_jpeg
+from pixel_remap import get_remap
+from synthetic_scene import FRAMESIZES, load_matrix, make_scene, scale_homography, workspace_offsets
+
+
+SCALES = (1, 2, 4, 8)
+
+
+def time_ms(fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000.0 * (time.perf_counter() - started) / repeat
+
+
+def robot_objects(frame, blobs, matrix, registry, offsets):
+    """ find_objects() without the IK: robot (x, y) per blob, for scoring. """
+    remap = get_remap(matrix, frame.shape, *offsets)
+    xy = remap.to_robot(blobs.x, blobs.y)
+    return [{'color': registry.names[b.label - 1], 'robot_coords': tuple(p)} for b, p in zip(blobs, xy.tolist())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--framesize', type=int, nargs='+', default=[8, 9, 13], choices=sorted(FRAMESIZES))
+    parser.add_argument('--objects', type=int, nargs='+', default=[0, 6], help='0 = empty workspace')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY, help='esp32 JPEG quality 0..63')
+    parser.add_argument('--scenes', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    matrix = load_matrix()
+    registry = ColorRegistry.load()
+    decoder = JpegDecoder()
+    offsets = workspace_offsets()
+    rng = np.random.default_rng(args.seed)
+    print(f"backend: {decoder.backend}")
+
+    # --- raw decode ---
+    print(f"\n{'size':>10} " + ' '.join(f"{'1/' + str(s):>8}" for s in SCALES) + "   (decode ms)")
+    for key in args.framesize:
+        size = FRAMESIZES[key]
+        image, _ = make_scene(rng, matrix, size, 6, offsets=offsets)
+        jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, cv2_quality(args.quality)])[1].tobytes()
+        row = [time_ms(lambda: decode_jpeg(jpeg), args.repeat)]
+        row += [time_ms(lambda s=s: decoder.decode(jpeg, s), args.repeat) for s in SCALES[1:]]
+        print(f"{size[0]:>5}x{size[1]:<4} " + ' '.join(f"{ms:>8.2f}" for ms in row))
+
+    # --- decode + detection per frame, fresh JpegFrame each time (as from the camera) ---
+    header = f"{'size':>10} {'obj':>4} {'scale':>5} {'ms':>8} {'saved':>8} {'recall':>6} {'err':>6}"
+    print(f"\n{header}\n{'-' * len(header)}")
+    for key in args.framesize:
+        size = FRAMESIZES[key]
+        scaled = scale_homography(matrix, size)
+        for count in args.objects:
+            scenes = []
+            for _ in range(args.scenes):
+                image, truth = make_scene(rng, matrix, size, count, offsets=offsets)
+                jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, cv2_quality(args.quality)])[1]
+                scenes.append((jpeg.tobytes(), truth))
+            roi = get_roi(scaled, (size[1], size[0]))
+
+            baseline = None
+            for scale in SCALES:
+                timer = StageTimer()
+
+                def run():
+                    return [detect_frame(JpegFrame(jpeg), registry, roi, scale, timer=timer, decoder=decoder)
+                            for jpeg, _ in scenes]
+
+                ms = time_ms(run, max(1, args.repeat // 4)) / len(scenes)
+                baseline = ms if baseline is None else baseline
+                found = total = 0
+                errors = []
+                for (jpeg, truth), blobs in zip(scenes, run()):
+                    e, missed, _ = score(truth, robot_objects(JpegFrame(jpeg), blobs, scaled, registry, offsets))
+                    errors += e
+                    total += len(truth['objects'])
+                    found += len(truth['objects']) - missed
+                recall = found / total if total else 1.0
+                err = float(np.mean(errors)) if errors else 0.0
+                print(f"{size[0]:>5}x{size[1]:<4} {count:>4} {'1/' + str(scale):>5} {ms:>8.2f} "
+                      f"{baseline - ms:>8.2f} {recall:>6.3f} {err:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
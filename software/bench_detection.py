@@ -0,0 +1,136 @@
+'''Detection benchmark on labelled synthetic scenes: find_objects throughput and centroid error in mm
+
+    python bench_detection.py                                  # VGA/SVGA/XGA x 2/6/12 objects
+    python bench_detection.py --framesize 5 8 --objects 6 --levels 0 1 --json bench.json
+    python bench_detection.py --dataset scenes/                # scenes written by synthetic_scene.py
+'''
+import argparse
+import json
+import time
+
+import numpy as np
+
+import final_com_with_P as app
+from detection import StageTimer, detect_blobs, get_roi
+from settings import load_settings
+from synthetic_scene import FRAMESIZES, load_dataset, load_matrix, make_scene, scale_homography
+from tracker import associate
+
+
+MATCH_DIST_MM = 15.0      # detection further than this from every true object is a false positive
+WARMUP_FRAMES = 2         # remap / ROI tables are built on the first frame of each size
+
+
+def score(truth, objs, max_dist=MATCH_DIST_MM):
+    """ (errors mm of matched objects, missed count, false positive count), matched per colour. """
+    errors, missed, false_pos = [], 0, 0
+    colors = {o['color'] for o in truth['objects']} | {o['color'] for o in objs}
+    for color in colors:
+        true_xy = [o['robot_mm'] for o in truth['objects'] if o['color'] == color]
+        det_xy = [o['robot_coords'][:2] for o in objs if o['color'] == color]
+        pairs = associate(true_xy, det_xy, max_dist)
+        for t, d in pairs:
+            errors.append(float(np.hypot(*(np.asarray(true_xy[t]) - np.asarray(det_xy[d])))))
+        missed += len(true_xy) - len(pairs)
+        false_pos += len(det_xy) - len(pairs)
+    return errors, missed, false_pos
+
+
+def run_case(app, scenes, matrix, use_roi=True, levels=0):
+    """ scenes: [(image, truth)] of one frame size. Returns one result row. """
+    size = tuple(scenes[0][1]['size'])
+    scaled = scale_homography(matrix, size)
+    timer = StageTimer()
+
+    def detect(image):
+        roi = get_roi(scaled, image.shape) if use_roi else None
+        blobs = detect_blobs(image, app.settings.colors, roi, levels, timer)
+        with timer.stage("find_objects"):
+            return app.find_objects(image, blobs, scaled)
+
+    for image, _ in scenes[:WARMUP_FRAMES]:
+        detect(image)
+    timer = StageTimer()
+
+    errors, missed, false_pos, total, elapsed = [], 0, 0, 0, 0.0
+    for image, truth in scenes:
+        started = time.perf_counter()
+        objs = detect(image)
+        elapsed += time.perf_counter() - started
+        e, m, f = score(truth, objs)
+        errors += e
+        missed += m
+        false_pos += f
+        total += len(truth['objects'])
+
+    errors = np.array(errors) if errors else np.full(1, np.nan)
+    return {
+        'size': f"{size[0]}x{size[1]}",
+        'objects': round(total / len(scenes), 1),
+        'levels': levels,
+        'roi': use_roi,
+        'frames': len(scenes),
+        'fps': len(scenes) / elapsed,
+        'ms': 1000.0 * elapsed / len(scenes),
+        'recall': 1.0 - missed / max(total, 1),
+        'false_pos': false_pos,
+        'err_mean_mm': float(np.mean(errors)),
+        'err_p95_mm': float(np.percentile(errors, 95)),
+        'err_max_mm': float(np.max(errors)),
+        'stages_ms': {k: round(v, 3) for k, v in timer.means().items()},
+    }
+
+
+def format_table(rows):
+    header = f"{'size':>10} {'obj':>5} {'lvl':>3} {'roi':>3} {'fps':>8} {'ms':>7} " \
+             f"{'recall':>6} {'fp':>4} {'err':>6} {'p95':>6} {'max':>6}"
+    lines = [header, '-' * len(header)]
+    for r in rows:
+        lines.append(f"{r['size']:>10} {r['objects']:>5} {r['levels']:>3} {'y' if r['roi'] else 'n':>3} "
+                     f"{r['fps']:>8.1f} {r['ms']:>7.2f} {r['recall']:>6.3f} {r['false_pos']:>4} "
+                     f"{r['err_mean_mm']:>6.2f} {r['err_p95_mm']:>6.2f} {r['err_max_mm']:>6.2f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataset', help='directory written by synthetic_scene.py (default: render in memory)')
+    parser.add_argument('--framesize', type=int, nargs='+', default=[8, 9, 10], choices=sorted(FRAMESIZES))
+    parser.add_argument('--objects', type=int, nargs='+', default=[2, 6, 12])
+    parser.add_argument('--scenes', type=int, default=20, help='scenes per case')
+    parser.add_argument('--levels', type=int, nargs='+', default=[0], help='pyramid levels to compare')
+    parser.add_argument('--no-roi', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args()
+
+    # find_objects and the colour table exactly as the pick script uses them
+    app.apply_settings(load_settings())
+
+    matrix = load_matrix()
+    cases = {}
+    if args.dataset:
+        for image, truth in load_dataset(args.dataset):
+            cases.setdefault((tuple(truth['size']), len(truth['objects'])), []).append((image, truth))
+    else:
+        rng = np.random.default_rng(args.seed)
+        offsets = (app.settings.offset_x, app.settings.offset_y)
+        for key in args.framesize:
+            for count in args.objects:
+                size = FRAMESIZES[key]
+                cases[(size, count)] = [make_scene(rng, matrix, size, count, offsets=offsets)
+                                        for _ in range(args.scenes)]
+
+    rows = []
+    for (size, count), scenes in sorted(cases.items()):
+        for levels in args.levels:
+            rows.append(run_case(app, scenes, matrix, not args.no_roi, levels))
+
+    print(format_table(rows))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''Straight-line Cartesian paths sampled adaptively and solved with batched IK'''
+import numpy as np
+
+import ik_batch
+
+
+# --- Sampling (the tolerance is motion.path_tolerance in settings.json) ---
+MAX_REFINE = 8           # bisection rounds (at most 2^8 segments)
+
+
+def linear_joint_path(p0, p1, tol, l1, l2, max_joint_step=None):
+    """
+    Samples the segment p0 -> p1 densely enough that moving linearly in joint
+    space between consecutive samples stays within `tol` mm of the line.
+    Starts with the two end points and bisects only the segments whose
+    joint-space midpoint (checked with forward kinematics) is off the line.
+    max_joint_step (deg) additionally caps the joint change between samples,
+    for senders without a trajectory executor (final_com_no_PID.py).
+    Returns (params t in [0, 1], IK angles (N, 3), status (N,)).
+    """
+    p0 = np.asarray(p0, dtype=np.float64)
+    p1 = np.asarray(p1, dtype=np.float64)
+
+    t = np.array([0.0, 1.0])
+    for _ in range(MAX_REFINE):
+        angles, status = ik_batch.inverse_kinematics_batch(p0 + t[:, None] * (p1 - p0), l1, l2)
+        if np.any(status != ik_batch.IK_OK):
+            return t, angles, status
+
+        mid_t = (t[:-1] + t[1:]) / 2.0
+        mid_angles = (angles[:-1] + angles[1:]) / 2.0
+        # Base angle wraps at +-180 deg; paths here never cross it
+        actual = ik_batch.forward_kinematics_batch(mid_angles, l1, l2)
+        wanted = p0 + mid_t[:, None] * (p1 - p0)
+        off_line = np.linalg.norm(actual - wanted, axis=1) > tol
+        if not off_line.any():
+            break
+        t = np.sort(np.concatenate([t, mid_t[off_line]]))
+    else:
+        angles, status = ik_batch.inverse_kinematics_batch(p0 + t[:, None] * (p1 - p0), l1, l2)
+        if np.any(status != ik_batch.IK_OK):
+            return t, angles, status
+
+    if max_joint_step:
+        pieces = np.ceil(np.max(np.abs(np.diff(angles, axis=0)), axis=1) / max_joint_step)
+        pieces = np.maximum(pieces, 1).astype(int)
+        if np.any(pieces > 1):
+            t = np.concatenate([np.linspace(a, b, n, endpoint=False) for a, b, n in zip(t[:-1], t[1:], pieces)]
+                               + [t[-1:]])
+            angles, status = ik_batch.inverse_kinematics_batch(p0 + t[:, None] * (p1 - p0), l1, l2)
+    return t, angles, status
+
+
+def linear_motor_path(p0, p1, tol, l1, l2, offsets, motor_min, motor_max, max_joint_step=None):
+    """
+    Same as linear_joint_path but returns ((N, 3) int motor angles, status),
+    including the start point as the first row.
+    """
+    _, angles, status = linear_joint_path(p0, p1, tol, l1, l2, max_joint_step)
+    motor = ik_batch.calculate_motor_angles_batch(angles, offsets, motor_min, motor_max)
+    motor[status != ik_batch.IK_OK] = 0
+    return motor, status
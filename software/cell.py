@@ -0,0 +1,150 @@
+'''One arm cell (camera, arm, calibration, drop zones) as objects instead of module globals
+
+Perception turns a camera frame into find_objects()-style dicts and CellArm
+runs the pick sequence shared with final_com_with_P.py (arm_motion.py), both
+parameterised by a CellConfig, so several cells can run from one host
+(supervisor.py).
+'''
+import json
+import os
+
+import numpy as np
+
+import ik_batch
+from arm_motion import ArmMotion
+from color_registry import ColorRegistry
+from detection import StageTimer, detect_blobs, detect_frame, get_roi
+from frame_source import JpegFrame
+from ik_grid import IKGrid
+from metrics import metrics
+from pixel_remap import CACHE_DIR, get_remap
+from serial_transport import LoopbackTransport, SerialTransport
+from settings import load_settings
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class CellConfig:
+    """
+    Everything that differs between cells. Paths are resolved against
+    base_dir (the directory of the config file). settings (default:
+    settings.json) supplies the arm geometry, home and motion settings, and
+    every argument left as None.
+    """
+
+    def __init__(self, name, camera_url, serial_port=None, baud=None, protocol=None,
+                 homography=None, colors=None, drop_zones=None, offset_x=None, offset_y=None,
+                 catch_z=None, decode_scale=None, detect_roi=None, settings=None, base_dir=BASE_DIR):
+        s = self.settings = settings or load_settings()
+        self.name = name
+        self.camera_url = camera_url.strip().rstrip('/') if camera_url else None   # None: no live camera
+        self.serial_port = serial_port          # None: simulated arm (LoopbackTransport)
+        self.baud = int(s.baud if baud is None else baud)
+        self.protocol = s.protocol if protocol is None else protocol
+        homography = s.homography_path if homography is None else homography
+        self.homography = os.path.join(base_dir, homography) if isinstance(homography, str) else homography
+        self.colors = os.path.join(base_dir, s.colors_path if colors is None else colors)
+        drop_zones = s.drop_zones if drop_zones is None else drop_zones
+        self.drop_zones = {color: tuple(int(a) for a in angles) for color, angles in drop_zones.items()}
+        self.offset_x = float(s.offset_x if offset_x is None else offset_x)
+        self.offset_y = float(s.offset_y if offset_y is None else offset_y)
+        self.catch_z = float(s.catch_z if catch_z is None else catch_z)
+        self.decode_scale = int(s.decode_scale if decode_scale is None else decode_scale)
+        self.detect_roi = bool(s.detect_roi if detect_roi is None else detect_roi)
+
+    def ik_params(self):
+        """ settings.ik_params() with this cell's catch height and robot offsets. """
+        return {**self.settings.ik_params(), 'z_levels': (self.catch_z,),
+                'offset_x': self.offset_x, 'offset_y': self.offset_y}
+
+    def load_matrix(self):
+        """ homography: path to a homography_matrix.json or the 3x3 list itself. """
+        if isinstance(self.homography, str):
+            with open(self.homography, 'r') as f:
+                return np.array(json.load(f), dtype=np.float64)
+        return np.array(self.homography, dtype=np.float64)
+
+
+def load_cells(path, settings=None):
+    """
+    {"cells": [{...CellConfig arguments...}, ...]}. Arguments a cell leaves
+    out come from settings (default: settings.json).
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    s = settings or load_settings()
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [CellConfig(base_dir=base_dir, settings=s, **entry) for entry in data['cells']]
+
+
+class Perception:
+    """ Frame -> [{color, motor_vals, robot_coords, status, center}] for one cell. """
+
+    def __init__(self, config):
+        self.config = config
+        self.matrix = config.load_matrix()
+        self.registry = ColorRegistry.load(config.colors)
+        params = config.ik_params()
+        # One cache file per geometry: cells with different offsets do not evict each other
+        self.ik_grid = IKGrid.load_or_build(
+            os.path.join(CACHE_DIR, f"ik_grid_{IKGrid.params_hash(IKGrid.make_params(**params))[:16]}.npz"),
+            **params)
+        self.timer = StageTimer()
+
+    def detect(self, frame):
+        """ frame: JpegFrame (decode_scale applies) or a decoded image. """
+        roi = get_roi(self.matrix, frame.shape) if self.config.detect_roi else None
+        if isinstance(frame, JpegFrame):
+            blobs = detect_frame(frame, self.registry, roi, self.config.decode_scale, timer=self.timer)
+        else:
+            blobs = detect_blobs(frame, self.registry, roi, timer=self.timer)
+        if len(blobs) == 0:
+            return []
+
+        with self.timer.stage("ik"):
+            remap = get_remap(self.matrix, frame.shape, self.config.offset_x, self.config.offset_y)
+            robot_pts = np.empty((len(blobs), 3))
+            robot_pts[:, :2] = remap.to_robot(blobs.x, blobs.y)
+            robot_pts[:, 2] = self.config.catch_z
+            motor, codes = self.ik_grid.solve_motor_angles(robot_pts)
+
+        results = []
+        for blob, coords, m_vals, code in zip(blobs, robot_pts.tolist(), motor.tolist(), codes.tolist()):
+            metrics.count('ik_results_total', status=ik_batch.STATUS_LABEL[code], cell=self.config.name)
+            results.append({
+                "color": self.registry.names[blob.label - 1],
+                "motor_vals": tuple(m_vals) if code == ik_batch.IK_OK else None,
+                "robot_coords": tuple(coords),
+                "status": ik_batch.STATUS_TEXT[code],
+                "center": (int(blob.x), int(blob.y)),
+            })
+        return results
+
+
+class CellArm(ArmMotion):
+    """
+    The arm of one cell: arm_motion.ArmMotion (the pick sequence of
+    final_com_with_P.py) on the cell's transport, geometry and motion
+    settings, with the cell's drop zones and metric label.
+    """
+
+    def __init__(self, config, transport=None):
+        self.config = config
+        if transport is None:
+            if config.serial_port:
+                transport = SerialTransport.open(config.serial_port, config.baud, protocol=config.protocol)
+            else:
+                transport = LoopbackTransport()
+        super().__init__(transport, config.settings, labels={'cell': config.name})
+
+    def log(self, text):
+        print(f"[{self.config.name}] {text}")
+
+    def pick_and_place(self, color_name, target_coords, via_home=True):
+        """ Returns True when the object was carried to its drop zone. """
+        return super().pick_and_place(color_name, target_coords, self.config.drop_zones.get(color_name),
+                                      via_home=via_home)
+
+    def close(self):
+        self.arm.close()
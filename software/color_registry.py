@@ -0,0 +1,130 @@
+'''HSV colour classes loaded from colors.json and compiled into lookup tables'''
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COLOR_FILE_PATH = os.path.join(BASE_DIR, 'colors.json')
+
+# --- Defaults for classes saved without detection limits ---
+DEFAULT_MIN_AREA = 200
+DEFAULT_MIN_CIRCULARITY = 0.6
+
+# One bit per class in the per-channel tables
+MAX_CLASSES = 8
+
+
+class ColorClass:
+    """
+    One HSV box. lower/upper are (H, S, V) like cv2.inRange; a hue range with
+    lower H > upper H wraps around 180 (reds).
+    """
+
+    def __init__(self, name, lower, upper, min_area=DEFAULT_MIN_AREA,
+                 min_circularity=DEFAULT_MIN_CIRCULARITY):
+        self.name = name
+        self.lower = tuple(int(v) for v in lower)
+        self.upper = tuple(int(v) for v in upper)
+        self.min_area = float(min_area)
+        self.min_circularity = float(min_circularity)
+
+    def to_dict(self):
+        return {
+            'lower': list(self.lower),
+            'upper': list(self.upper),
+            'min_area': self.min_area,
+            'min_circularity': self.min_circularity,
+        }
+
+
+class ColorRegistry:
+    """
+    Ordered colour classes (order = priority when ranges overlap).
+    Labels are 1-based in registry order, 0 is background.
+
+    The HSV -> label table is a 3D box lookup; because every class is an
+    axis-aligned HSV box it factors into one 256-entry bitmask table per
+    channel: AND of the three bitmasks gives the classes containing the
+    pixel, and a last table picks the first set bit as the label.
+    All four lookups are single cv2.LUT passes over 8-bit planes.
+    """
+
+    def __init__(self, classes=()):
+        self.classes = list(classes)
+        self.compile()
+
+    # --- file ---
+    @classmethod
+    def load(cls, path=COLOR_FILE_PATH):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(ColorClass(name, **entry) for name, entry in data.items())
+
+    def save(self, path=COLOR_FILE_PATH):
+        data = {c.name: c.to_dict() for c in self.classes}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp, path)
+
+    # --- classes ---
+    @property
+    def names(self):
+        return [c.name for c in self.classes]
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def get(self, name):
+        for c in self.classes:
+            if c.name == name:
+                return c
+        return None
+
+    def label_of(self, name):
+        return self.names.index(name) + 1
+
+    def update(self, color):
+        """ Replaces the class with the same name (keeps its priority) or appends it. """
+        for i, c in enumerate(self.classes):
+            if c.name == color.name:
+                self.classes[i] = color
+                break
+        else:
+            self.classes.append(color)
+        self.compile()
+
+    # --- lookup tables ---
+    def compile(self):
+        if len(self.classes) > MAX_CLASSES:
+            raise ValueError(f"최대 {MAX_CLASSES}개 색상까지 지원합니다 ({len(self.classes)}개)")
+
+        self.tables = [np.zeros(256, dtype=np.uint8) for _ in range(3)]
+        for k, c in enumerate(self.classes):
+            bit = np.uint8(1 << k)
+            for ch in range(3):
+                lo, hi = c.lower[ch], c.upper[ch]
+                if lo <= hi:
+                    self.tables[ch][lo:hi + 1] |= bit
+                else:
+                    self.tables[ch][lo:] |= bit
+                    self.tables[ch][:hi + 1] |= bit
+
+        # first set bit -> 1-based label
+        bits = np.arange(256)
+        lowest = bits & -bits
+        self.priority = np.zeros(256, dtype=np.uint8)
+        self.priority[1:] = np.log2(lowest[1:]).astype(np.uint8) + 1
+
+    def classify(self, hsv):
+        """ HSV image -> uint8 label image (0 = no class). """
+        h, s, v = cv2.split(hsv)
+        bits = cv2.bitwise_and(cv2.LUT(h, self.tables[0]), cv2.LUT(s, self.tables[1]))
+        bits = cv2.bitwise_and(bits, cv2.LUT(v, self.tables[2]))
+        return cv2.LUT(bits, self.priority)
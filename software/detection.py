@@ -0,0 +1,368 @@
+'''Colour blob detection restricted to the calibrated paper area'''
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from frame_source import JpegDecoder
+from metrics import metrics
+from pixel_remap import PAPER_HEIGHT, PAPER_WIDTH, matrix_key
+
+
+# --- ROI / pyramid settings ---
+ROI_MARGIN = 10          # px kept around the paper quad (objects on the edge)
+REFINE_PAD = 4           # px added around each coarse blob before the full-res refine
+ROI_ALIGN = 8            # crop box on multiples of the largest JPEG decode scale (1/8)
+
+# One row per detected blob (label: 1-based ColorRegistry index, x/y: centre px,
+# area: contour area px^2, left/top/width/height: bounding box px)
+BLOB_DTYPE = np.dtype([
+    ('label', np.uint8), ('x', np.int32), ('y', np.int32),
+    ('area', np.float32), ('circularity', np.float32),
+    ('left', np.int32), ('top', np.int32), ('width', np.int32), ('height', np.int32),
+])
+
+
+def workspace_polygon(matrix, paper_width=PAPER_WIDTH, paper_height=PAPER_HEIGHT):
+    """ Paper corners (mm) mapped back to pixels: the four clicked calibration points. """
+    corners = np.array([[[0, 0], [paper_width, 0], [paper_width, paper_height], [0, paper_height]]],
+                       dtype=np.float64)
+    inverse = np.linalg.inv(np.asarray(matrix, dtype=np.float64))
+    return cv2.perspectiveTransform(corners, inverse)[0].astype(np.float32)
+
+
+class StageTimer:
+    """ Per-stage wall time (ms) of the last frame plus running means. """
+
+    def __init__(self):
+        self.last = {}
+        self.totals = {}
+        self.frames = 0
+
+    def begin(self):
+        self.last = {}
+        self.frames += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000.0
+            self.last[name] = self.last.get(name, 0.0) + ms
+            self.totals[name] = self.totals.get(name, 0.0) + ms
+            metrics.observe('detect_stage_seconds', ms / 1000.0, stage=name)
+
+    def means(self):
+        return {name: total / max(self.frames, 1) for name, total in self.totals.items()}
+
+    def format(self, values=None):
+        values = self.last if values is None else values
+        parts = [f"{name} {ms:.1f}" for name, ms in values.items()]
+        return ", ".join(parts) + f" (합계 {sum(values.values()):.1f} ms)"
+
+
+class WorkspaceROI:
+    """
+    Bounding box of the paper quad (clipped to the frame) plus a mask of the
+    quad inside that box, so detection never looks at pixels off the sheet.
+    """
+
+    def __init__(self, matrix, shape, margin=ROI_MARGIN):
+        height, width = shape[:2]
+        self.polygon = workspace_polygon(matrix)
+
+        x0, y0 = np.floor(self.polygon.min(axis=0)).astype(int) - margin
+        x1, y1 = np.ceil(self.polygon.max(axis=0)).astype(int) + margin + 1
+        # Aligned so a reduced decode crops to exactly the same area (crop_reduced)
+        self.x0, self.y0 = max(int(x0) // ROI_ALIGN * ROI_ALIGN, 0), max(int(y0) // ROI_ALIGN * ROI_ALIGN, 0)
+        self.x1 = min(-(-int(x1) // ROI_ALIGN) * ROI_ALIGN, width)
+        self.y1 = min(-(-int(y1) // ROI_ALIGN) * ROI_ALIGN, height)
+        if self.x1 <= self.x0 or self.y1 <= self.y0:
+            # Homography does not match this camera: fall back to the full frame
+            self.x0, self.y0, self.x1, self.y1 = 0, 0, width, height
+            self.mask = np.full((height, width), 255, dtype=np.uint8)
+            self._levels = {}
+            return
+
+        self.mask = np.zeros((self.y1 - self.y0, self.x1 - self.x0), dtype=np.uint8)
+        local = self.polygon - np.array([self.x0, self.y0], dtype=np.float32)
+        # Grow the quad by the margin from its centre
+        centre = local.mean(axis=0)
+        direction = local - centre
+        scale = 1.0 + margin / np.maximum(np.linalg.norm(direction, axis=1, keepdims=True), 1.0)
+        cv2.fillConvexPoly(self.mask, np.round(centre + direction * scale).astype(np.int32), 255)
+        self._levels = {}
+
+    @property
+    def offset(self):
+        return self.x0, self.y0
+
+    def crop(self, image):
+        return image[self.y0:self.y1, self.x0:self.x1]
+
+    def crop_reduced(self, image, scale):
+        """ Same area cut from a 1/scale decode of the frame. """
+        return image[self.y0 // scale:-(-self.y1 // scale), self.x0 // scale:-(-self.x1 // scale)]
+
+    def mask_at(self, shape):
+        """ ROI mask resized to a pyramid level of the crop. """
+        key = shape[:2]
+        if key == self.mask.shape:
+            return self.mask
+        mask = self._levels.get(key)
+        if mask is None:
+            mask = cv2.resize(self.mask, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+            self._levels[key] = mask
+        return mask
+
+
+_rois = {}
+
+
+def get_roi(matrix, shape, margin=ROI_MARGIN):
+    """ One WorkspaceROI per (matrix, frame size) for the life of the process. """
+    height, width = shape[:2]
+    key = matrix_key(matrix, width, height, margin)
+    roi = _rois.get(key)
+    if roi is None:
+        roi = WorkspaceROI(matrix, shape, margin)
+        _rois[key] = roi
+    return roi
+
+
+def _survivors(mask, min_area):
+    """
+    Connected components of mask whose bounding box is larger than min_area
+    (array filter, no per-blob Python). The box bounds the outer contour
+    area from above; the pixel count does not, since it leaves out holes.
+    Returns (component image, kept ids, their stats, their centroids, all stats).
+    """
+    n, comp, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    keep = np.nonzero(stats[1:, cv2.CC_STAT_WIDTH] * stats[1:, cv2.CC_STAT_HEIGHT] > min_area)[0] + 1
+    return comp, keep, stats[keep], centroids[keep], stats
+
+
+def _shape(inside):
+    """ (contour area, 4*pi*A/P^2) of the outer contour of a boolean blob mask. """
+    contours, _ = cv2.findContours(inside.view(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return 0.0, 0.0
+    cnt = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(cnt)
+    perimeter = cv2.arcLength(cnt, True)
+    if perimeter == 0:
+        return area, 0.0
+    return area, 4 * np.pi * area / (perimeter * perimeter)
+
+
+def _in_hole(comp, labels, all_stats, own, k, part, bx, by, bw, bh):
+    """
+    True when the part (boolean mask at bx, by) lies inside the outer contour
+    of other class-k pixels: a blob in another blob's hole, which the outer
+    contours of a per-class mask never reported. Only components whose box
+    contains the part's box are traced.
+    """
+    px, py = np.argwhere(part)[0][::-1] + (bx, by)
+    x0, y0 = all_stats[:, cv2.CC_STAT_LEFT], all_stats[:, cv2.CC_STAT_TOP]
+    x1 = x0 + all_stats[:, cv2.CC_STAT_WIDTH]
+    y1 = y0 + all_stats[:, cv2.CC_STAT_HEIGHT]
+    around = np.nonzero((x0 <= bx) & (y0 <= by) & (x1 >= bx + bw) & (y1 >= by + bh))[0]
+    for j in around[around > 0]:
+        cx, cy, cw, ch = all_stats[j, :4]
+        other = (comp[cy:cy + ch, cx:cx + cw] == j) & (labels[cy:cy + ch, cx:cx + cw] == k)
+        if j == own:
+            # Same component (split per class): the part's own pixels do not count
+            other[by - cy:by - cy + bh, bx - cx:bx - cx + bw] &= ~part
+        contours, _ = cv2.findContours(other.view(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE,
+                                       offset=(int(cx), int(cy)))
+        if any(cv2.pointPolygonTest(cnt, (float(px), float(py)), False) > 0 for cnt in contours):
+            return True
+    return False
+
+
+def extract_blobs(labels, registry, offset=(0, 0)):
+    """
+    labels: uint8 label image from ColorRegistry.classify().
+    One connected-components pass gives box and centroid of every blob as
+    arrays; a box-area filter runs on those arrays (the box is never smaller
+    than the contour area, holes included) and the contour is traced only
+    for the few blobs that survive it. min_area / min_circularity then apply
+    to the outer contour exactly as in the old per-contour loop, and a blob
+    lying in a hole of a same-class blob is skipped, as the old outer-contour
+    pass never saw it. x/y is the centroid of the blob's pixels.
+    Returns a BLOB_DTYPE record array in frame pixels (labels + offset).
+    """
+    min_area = np.array([0.0] + [c.min_area for c in registry])
+    min_circularity = np.array([0.0] + [c.min_circularity for c in registry])
+
+    rows = []
+    comp, ids, stats, centroids, all_stats = _survivors(labels, min_area[1:].min())
+    for i, (x, y, w, h, _), (cx, cy) in zip(ids, stats, centroids):
+        inside = comp[y:y + h, x:x + w] == i
+        window = labels[y:y + h, x:x + w]
+        present = np.unique(window[inside])
+
+        if len(present) == 1:
+            parts = [(int(present[0]), inside, x, y, w, h, cx, cy)]
+        else:
+            # Touching blobs of different colours form one component: split per class
+            parts = []
+            for k in present:
+                sub = (inside & (window == k)).view(np.uint8)
+                sub_comp, sub_ids, sub_stats, sub_cents, _ = _survivors(sub, min_area[k])
+                for j, (sx, sy, sw, sh, _), (scx, scy) in zip(sub_ids, sub_stats, sub_cents):
+                    parts.append((int(k), sub_comp[sy:sy + sh, sx:sx + sw] == j,
+                                  x + sx, y + sy, sw, sh, x + scx, y + scy))
+
+        for k, mask, bx, by, bw, bh, cx, cy in parts:
+            if bw * bh <= min_area[k]: continue
+            area, circularity = _shape(mask)
+            if area <= min_area[k] or circularity <= min_circularity[k]: continue
+            if _in_hole(comp, labels, all_stats, i, k, mask, bx, by, bw, bh): continue
+            rows.append((k, int(cx) + offset[0], int(cy) + offset[1], area, circularity,
+                         bx + offset[0], by + offset[1], bw, bh))
+    return np.rec.array(rows, dtype=BLOB_DTYPE) if rows else np.recarray(0, dtype=BLOB_DTYPE)
+
+
+def _coarse_stats(labels, registry, scale):
+    """ Blob boxes at 1/scale resolution, with a lenient area check (the real filter runs per window). """
+    _, _, stats, _, _ = _survivors(labels, min(c.min_area for c in registry) * 0.5 / (scale * scale))
+    return stats
+
+
+def _refine(stats, scale, crop, roi, offset, registry):
+    """ Re-extracts every coarse blob from full-resolution labels inside its own window. """
+    roi_mask = roi.mask_at(crop.shape) if roi is not None else None
+    # A blob whose box lies inside another's is refined in the enclosing box,
+    # so extract_blobs sees the hole it may sit in
+    left, top = stats[:, 0], stats[:, 1]
+    right, bottom = left + stats[:, 2], top + stats[:, 3]
+    within = ((left[:, None] >= left) & (top[:, None] >= top) & (right[:, None] <= right) & (bottom[:, None] <= bottom))
+    boxes = dict.fromkeys((int(left[row].min()), int(top[row].min()),
+                           int(right[row].max() - left[row].min()), int(bottom[row].max() - top[row].min()))
+                          for row in within)
+    found, seen = [], set()
+    for x, y, w, h in boxes:
+        # Full-resolution labels inside the blob's window only
+        pad = scale + REFINE_PAD
+        x0, y0 = max(x * scale - pad, 0), max(y * scale - pad, 0)
+        x1 = min((x + w) * scale + pad, crop.shape[1])
+        y1 = min((y + h) * scale + pad, crop.shape[0])
+        window = registry.classify(cv2.cvtColor(crop[y0:y1, x0:x1], cv2.COLOR_BGR2HSV))
+        if roi_mask is not None:
+            window = cv2.bitwise_and(window, roi_mask[y0:y1, x0:x1])
+        origin_x, origin_y = offset[0] + x0, offset[1] + y0
+        for blob in extract_blobs(window, registry, (origin_x, origin_y)):
+            # Cut by the window edge: a neighbouring blob, found whole in its own window
+            if ((x0 > 0 and blob.left == origin_x) or (y0 > 0 and blob.top == origin_y)
+                    or (x1 < crop.shape[1] and blob.left + blob.width == origin_x + x1 - x0)
+                    or (y1 < crop.shape[0] and blob.top + blob.height == origin_y + y1 - y0)):
+                continue
+            # Neighbouring windows can overlap and return the same blob
+            key = (blob.label, blob.x, blob.y)
+            if key not in seen:
+                seen.add(key)
+                found.append(tuple(blob))
+    return np.rec.array(found, dtype=BLOB_DTYPE) if found else np.recarray(0, dtype=BLOB_DTYPE)
+
+
+def detect_blobs(image, registry, roi=None, levels=0, timer=None):
+    """
+    registry: ColorRegistry (one lookup pass gives the label image for all classes)
+    roi: WorkspaceROI (None = full frame)
+    levels: pyramid levels to go down before searching; blobs found there are
+    re-extracted at full resolution inside small windows, so centres keep
+    full-resolution accuracy.
+    Returns a BLOB_DTYPE record array in frame pixel coordinates, ordered by
+    class (registry order).
+    """
+    timer = timer or StageTimer()
+    timer.begin()
+    if not len(registry):
+        return np.recarray(0, dtype=BLOB_DTYPE)
+
+    with timer.stage("crop"):
+        if roi is not None:
+            crop, offset = roi.crop(image), roi.offset
+        else:
+            crop, offset = image, (0, 0)
+        small = crop
+        for _ in range(levels):
+            small = cv2.pyrDown(small)
+
+    with timer.stage("hsv"):
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+
+    with timer.stage("classify"):
+        labels = registry.classify(hsv)
+        if roi is not None:
+            labels = cv2.bitwise_and(labels, roi.mask_at(small.shape))
+
+    if levels == 0:
+        with timer.stage("components"):
+            blobs = extract_blobs(labels, registry, offset)
+        return blobs[np.argsort(blobs.label, kind='stable')]
+
+    scale = 2 ** levels
+    with timer.stage("components"):
+        stats = _coarse_stats(labels, registry, scale)
+
+    with timer.stage("refine"):
+        blobs = _refine(stats, scale, crop, roi, offset, registry)
+    return blobs[np.argsort(blobs.label, kind='stable')]
+
+
+_decoder = JpegDecoder()
+
+
+def detect_frame(frame, registry, roi=None, scale=1, levels=0, timer=None, decoder=None):
+    """
+    frame: frame_source.JpegFrame.
+    scale 2/4/8: the blob search runs on a DCT-scaled decode of the JPEG and
+    the full-resolution decode happens only when there is a blob to refine
+    (an empty workspace never pays for it). scale 1 is detect_blobs() on
+    frame.image with the given pyramid levels.
+    Not thread-safe with the shared decoder (pass one per thread).
+    """
+    if scale == 1:
+        return detect_blobs(frame.image, registry, roi, levels, timer)
+
+    timer = timer or StageTimer()
+    timer.begin()
+    if not len(registry):
+        return np.recarray(0, dtype=BLOB_DTYPE)
+
+    with timer.stage("decode"):
+        small = (decoder or _decoder).decode(frame.jpeg, scale)
+        if small is None:
+            return np.recarray(0, dtype=BLOB_DTYPE)
+
+    with timer.stage("crop"):
+        if roi is not None:
+            small, offset = roi.crop_reduced(small, scale), roi.offset
+        else:
+            offset = (0, 0)
+
+    with timer.stage("hsv"):
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+
+    with timer.stage("classify"):
+        labels = registry.classify(hsv)
+        if roi is not None:
+            labels = cv2.bitwise_and(labels, roi.mask_at(small.shape))
+
+    with timer.stage("components"):
+        stats = _coarse_stats(labels, registry, scale)
+    if len(stats) == 0:
+        return np.recarray(0, dtype=BLOB_DTYPE)
+
+    with timer.stage("decode_full"):
+        image = frame.image
+        crop = roi.crop(image) if roi is not None else image
+
+    with timer.stage("refine"):
+        blobs = _refine(stats, scale, crop, roi, offset, registry)
+    return blobs[np.argsort(blobs.label, kind='stable')]
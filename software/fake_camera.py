@@ -0,0 +1,422 @@
+'''Local stand-in for the ESP32 CameraWebServer (/capture, /stream, /status, /control)
+
+Serves frames from a folder, a session recording or synthetic scenes, with
+adjustable frame size, JPEG quality, frame rate, latency and dropped
+connections, so FrameSource can be load- and reconnect-tested without the
+camera:
+
+    python fake_camera.py --synthetic 30 --fps 25 --port 8080
+    (url.txt: http://127.0.0.1:8080 -> stream on :8081 like the real board)
+
+    python fake_camera.py --folder shots/ --latency 0.05 --drop-rate 0.02 --bench 20
+'''
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+from synthetic_scene import FRAMESIZES, load_matrix, make_scene, workspace_offsets
+
+
+# --- CameraWebServer protocol (app_httpd.cpp) ---
+PART_BOUNDARY = '123456789000000000000987654321'
+STREAM_CONTENT_TYPE = 'multipart/x-mixed-replace;boundary=' + PART_BOUNDARY
+STREAM_BOUNDARY = b'\r\n--' + PART_BOUNDARY.encode() + b'\r\n'
+STREAM_PART = 'Content-Type: image/jpeg\r\nContent-Length: %u\r\nX-Timestamp: %d.%06d\r\n\r\n'
+
+# Board defaults after esp_camera_init() in CameraWebServer.ino
+DEFAULT_FRAMESIZE = 8      # VGA
+DEFAULT_QUALITY = 12       # esp32 scale: 0 (best) .. 63 (worst)
+DEFAULT_FPS = 20.0
+PORT_TRIES = 20            # port=0: attempts to find a free (http, http + 1) pair
+
+# /control variables accepted by cmd_handler (value only stored here)
+CONTROL_VARS = (
+    'framesize', 'quality', 'contrast', 'brightness', 'saturation', 'gainceiling',
+    'colorbar', 'awb', 'agc', 'aec', 'hmirror', 'vflip', 'awb_gain', 'agc_gain',
+    'aec_value', 'aec2', 'dcw', 'bpc', 'wpc', 'raw_gma', 'lenc', 'special_effect',
+    'wb_mode', 'ae_level', 'led_intensity',
+)
+
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+
+
+def cv2_quality(esp_quality):
+    """ esp32 JPEG quality (lower = better) -> cv2 IMWRITE_JPEG_QUALITY. """
+    return int(np.clip(100 - 1.5 * esp_quality, 5, 100))
+
+
+# --- Frame providers: list of BGR images the server cycles through ---
+def load_folder(path):
+    files = sorted(f for ext in IMAGE_EXTENSIONS for f in glob.glob(os.path.join(path, ext)))
+    frames = [img for img in (cv2.imread(f, cv2.IMREAD_COLOR) for f in files) if img is not None]
+    if not frames:
+        raise ValueError(f"{path}: 이미지가 없습니다")
+    return frames
+
+
+def load_recording(path):
+    from recording import Recording
+    from frame_source import decode_jpeg
+    recording = Recording(path)
+    try:
+        frames = [decode_jpeg(recording.read_jpeg(i)) for i in range(len(recording))]
+    finally:
+        recording.close()
+    return [f for f in frames if f is not None]
+
+
+def synthetic_frames(count, objects=6, seed=0):
+    """ count labelled scenes (synthetic_scene.make_scene) at the default frame size. """
+    matrix = load_matrix()
+    rng = np.random.default_rng(seed)
+    size = FRAMESIZES[DEFAULT_FRAMESIZE]
+    offsets = workspace_offsets()
+    return [make_scene(rng, matrix, size, objects, offsets=offsets)[0] for _ in range(count)]
+
+
+class FakeCamera:
+    """
+    Sensor state shared by both servers. Frames are resized to the current
+    framesize and JPEG-encoded once per (frame, size, quality), so the server
+    itself does not limit throughput.
+    """
+
+    def __init__(self, frames, fps=DEFAULT_FPS, framesize=DEFAULT_FRAMESIZE,
+                 quality=DEFAULT_QUALITY, latency=0.0, jitter=0.0, drop_rate=0.0,
+                 drop_after=0, max_streams=1, seed=None):
+        self.frames = list(frames)
+        self.fps = fps
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.drop_after = drop_after
+        self.max_streams = max_streams
+        self.settings = {name: 0 for name in CONTROL_VARS}
+        self.settings.update(framesize=framesize, quality=quality, awb=1, aec=1, agc=1)
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._streams = 0
+        self.started = time.time()
+        self.stats = {'captures': 0, 'stream_frames': 0, 'streams': 0, 'drops': 0, 'rejected': 0}
+
+    # --- frames ---
+    def frame_index(self, now=None):
+        """ Frames advance with wall time at fps, like a sensor running freely. """
+        now = time.time() if now is None else now
+        return int((now - self.started) * self.fps) % len(self.frames)
+
+    def jpeg(self, index=None):
+        index = self.frame_index() if index is None else index
+        with self._lock:
+            size = FRAMESIZES.get(self.settings['framesize'], FRAMESIZES[DEFAULT_FRAMESIZE])
+            key = (index, size, self.settings['quality'])
+            data = self._cache.get(key)
+        if data is None:
+            image = self.frames[index]
+            if image.shape[1::-1] != size:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, cv2_quality(key[2])])
+            data = buf.tobytes()
+            with self._lock:
+                self._cache[key] = data
+        return data
+
+    # --- fault injection ---
+    def delay(self):
+        wait = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def should_drop(self):
+        with self._lock:
+            drop = self.drop_rate > 0 and self.random.random() < self.drop_rate
+            if drop:
+                self.stats['drops'] += 1
+            return drop
+
+    # --- /control, /status ---
+    def control(self, var, val):
+        if var not in self.settings:
+            return False
+        with self._lock:
+            if var == 'framesize' and val not in FRAMESIZES:
+                return False
+            self.settings[var] = val
+        return True
+
+    def status(self):
+        with self._lock:
+            status = dict(self.settings)
+        status.update(xclk=20, pixformat=4, sharpness=0)
+        return status
+
+    # --- stream slots (the board serves one stream client at a time) ---
+    def open_stream(self):
+        with self._lock:
+            if self.max_streams and self._streams >= self.max_streams:
+                self.stats['rejected'] += 1
+                return False
+            self._streams += 1
+            self.stats['streams'] += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._streams -= 1
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def make_handler(camera):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'     # keep-alive: FrameSource pools /capture connections
+        disable_nagle_algorithm = True    # header and body go out as separate writes
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, body=b'', content_type='text/plain', headers=()):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _drop(self):
+            # Connection reset without a response, like a board brown-out / Wi-Fi drop
+            self.close_connection = True
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if self.server.is_stream:
+                routes = {'/stream': self.route_stream}
+            else:
+                routes = {'/': self.route_index, '/status': self.route_status,
+                          '/control': self.route_control, '/capture': self.route_capture}
+            route = routes.get(url.path)
+            if route is None:
+                self._send(404, b'Not Found')
+                return
+            route(parse_qs(url.query))
+
+        def route_index(self, query):
+            self._send(200, b'<html><body><img src="/capture"></body></html>', 'text/html')
+
+        def route_status(self, query):
+            self._send(200, json.dumps(camera.status()).encode(), 'application/json')
+
+        def route_control(self, query):
+            if 'var' not in query or 'val' not in query:
+                self._send(404, b'Not Found')
+                return
+            try:
+                ok = camera.control(query['var'][0], int(query['val'][0]))
+            except ValueError:
+                ok = False
+            self._send(200 if ok else 500)
+
+        def route_capture(self, query):
+            camera.delay()
+            if camera.should_drop():
+                self._drop()
+                return
+            now = time.time()
+            camera.count('captures')
+            self._send(200, camera.jpeg(), 'image/jpeg', (
+                ('Content-Disposition', 'inline; filename=capture.jpg'),
+                ('X-Timestamp', f"{int(now)}.{int(now % 1 * 1e6):06d}"),
+            ))
+
+        def route_stream(self, query):
+            if not camera.open_stream():
+                self._send(503, b'Stream busy')
+                return
+            try:
+                camera.delay()
+                self.send_response(200)
+                self.send_header('Content-Type', STREAM_CONTENT_TYPE)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('X-Framerate', str(int(camera.fps)))
+                self.end_headers()
+                self.close_connection = True
+
+                # Like the board: the current frame is sent every interval, repeated
+                # when the sensor has not produced a new one
+                sent = 0
+                interval = 1.0 / camera.fps
+                next_at = time.time()
+                while not self.server.stopping:
+                    index = camera.frame_index()
+                    jpeg = camera.jpeg(index)
+                    now = time.time()
+                    part = (STREAM_BOUNDARY
+                            + (STREAM_PART % (len(jpeg), int(now), int(now % 1 * 1e6))).encode())
+                    if camera.should_drop() or (camera.drop_after and sent >= camera.drop_after):
+                        # Cut off mid-frame: the client sees a truncated part, then EOF
+                        self.wfile.write(part + jpeg[:len(jpeg) // 2])
+                        return
+                    self.wfile.write(part + jpeg)
+                    sent += 1
+                    camera.count('stream_frames')
+                    next_at = max(next_at + interval, time.time())
+                    time.sleep(max(0.0, next_at - time.time()))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                camera.close_stream()
+
+    return Handler
+
+
+class FakeCameraServer:
+    """ HTTP server on port, stream server on port + 1 (same layout as the board). """
+
+    def __init__(self, camera, host='127.0.0.1', port=8080):
+        self.camera = camera
+        handler = make_handler(camera)
+        # port=0: the stream server goes on the bound port + 1, retried until both are free
+        for _ in range(PORT_TRIES if port == 0 else 1):
+            http = self._make_server(host, port, handler, is_stream=False)
+            try:
+                stream = self._make_server(host, http.server_address[1] + 1, handler, is_stream=True)
+            except OSError:
+                http.server_close()
+                if port:
+                    raise
+                continue
+            break
+        else:
+            raise OSError("no free port pair for the fake camera")
+        self.servers = [http, stream]
+        self.host = host
+        self.port = self.servers[0].server_address[1]
+        self._threads = []
+
+    @staticmethod
+    def _make_server(host, port, handler, is_stream):
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        server.is_stream = is_stream
+        server.stopping = False
+        return server
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.stopping = True
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def bench_frame_source(base_url, seconds, use_stream=True):
+    """ Pulls frames through FrameSource like the scripts do; returns rate / latency figures. """
+    from frame_source import FrameSource
+
+    waits, gaps, last_stamp = [], [], None
+    source = FrameSource(base_url, use_stream=use_stream).start()
+    try:
+        end = time.time() + seconds
+        while time.time() < end:
+            started = time.perf_counter()
+            image, stamp = source.read(fresh=True, timeout=2.0)
+            waits.append(time.perf_counter() - started)
+            if not stamp:
+                continue
+            if last_stamp is not None:
+                gaps.append(stamp - last_stamp)
+            last_stamp = stamp
+    finally:
+        source.stop()
+
+    waits_ms = np.array(waits) * 1000.0
+    gaps_ms = np.array(gaps) * 1000.0 if gaps else np.zeros(1)
+    return {
+        'frames': len(gaps) + (last_stamp is not None),
+        'fps': len(gaps) / max(float(np.sum(gaps)), 1e-9) if gaps else 0.0,
+        'read_ms_p50': float(np.percentile(waits_ms, 50)),
+        'read_ms_p95': float(np.percentile(waits_ms, 95)),
+        'gap_ms_max': float(gaps_ms.max()),
+        'timeouts': int(np.sum(waits_ms >= 2000.0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--folder', help='images to cycle through')
+    source.add_argument('--recording', help='session recording (recording.py) to serve')
+    source.add_argument('--synthetic', type=int, default=30, help='number of synthetic scenes (default)')
+    parser.add_argument('--objects', type=int, default=6, help='objects per synthetic scene')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='stream is served on port + 1')
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS)
+    parser.add_argument('--framesize', type=int, default=DEFAULT_FRAMESIZE, choices=sorted(FRAMESIZES))
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY, help='0 (best) .. 63')
+    parser.add_argument('--latency', type=float, default=0.0, help='s added before every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='s of random extra latency')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='chance per frame of a dropped connection')
+    parser.add_argument('--drop-after', type=int, default=0, help='close every stream after N frames')
+    parser.add_argument('--bench', type=float, default=0.0, help='run FrameSource against the server for N s')
+    parser.add_argument('--capture-only', action='store_true', help='bench the /capture fallback only')
+    args = parser.parse_args()
+
+    if args.folder:
+        frames = load_folder(args.folder)
+    elif args.recording:
+        frames = load_recording(args.recording)
+    else:
+        frames = synthetic_frames(args.synthetic, args.objects)
+
+    camera = FakeCamera(frames, fps=args.fps, framesize=args.framesize, quality=args.quality,
+                        latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+                        drop_after=args.drop_after)
+    with FakeCameraServer(camera, args.host, args.port) as server:
+        print(f"[FakeCamera] {len(frames)} frames, {args.fps:g} fps, {FRAMESIZES[args.framesize]}")
+        print(f"[FakeCamera] url.txt: {server.base_url}  (stream :{server.port + 1}/stream)")
+        if args.bench:
+            result = bench_frame_source(server.base_url, args.bench, use_stream=not args.capture_only)
+            print(json.dumps({**result, **camera.stats}, indent=2))
+            return
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        print(f"[FakeCamera] {camera.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
 /*
   Serial Robot Arm Control (Optimized)
   Python Input Format: base,shoulder,elbow,claw (e.g., 90,120,40,30)
+
+  Optional binary protocol (advertised as "READY BIN1 SEQ LAST=<seq>"):
+    [0xA5][seq][base][shoulder][elbow][claw][hold_ms][checksum]
+    checksum: all bytes after the header sum to 0 (mod 256)
+    Packets are queued in a ring buffer and executed one every hold_ms,
+    so the host can send a whole trajectory in one burst.
+    Every executed command is answered with "Moved: b,s,e,c"; binary ones
+    add " #seq". A packet that is not queued is answered instead with
+    "NAK <expected seq>" (bad checksum), "FULL <seq>" (ring buffer full)
+    or "DUP <seq>" (same seq as the previous packet, a resend).
+    LAST= is the seq of the last queued packet; the host continues after it.
+    The text line "SYNC" repeats the READY line, for a host that reconnects
+    without resetting the board.
 */
 #include <Servo.h>
 
@@ -17,6 +30,12 @@ const int ELB_MIN = 10;
 const int ELB_MAX = 120; 
 const int CLAW_CLOSE = 0;  const int CLAW_OPEN = 30; 
 
+// Binary protocol
+const uint8_t PKT_SYNC = 0xA5;
+const uint8_t PKT_SIZE = 8;
+const uint8_t RING_SIZE = 16;   // Must match the host's binary window
+const uint8_t LINE_MAX = 32;
+
 Servo base, shoulder, elbow, claw; 
 // Current angle variables 
 int cur_base = 89; 
@@ -24,6 +43,23 @@ int cur_shoulder = 134;
 int cur_elbow = 42; 
 int cur_claw = 30; 
 
+// Trajectory ring buffer (angles + hold time)
+struct Setpoint {
+  uint8_t seq, b, s, e, c, hold_ms;
+};
+Setpoint ring[RING_SIZE];
+uint8_t ring_head = 0;
+uint8_t ring_count = 0;
+unsigned long last_step = 0;
+uint8_t last_hold = 0;
+uint8_t last_seq = 0;   // seq of the last queued packet (reported in READY, the host continues after it)
+
+// Receive state (no String / heap allocation)
+uint8_t pkt[PKT_SIZE];
+uint8_t pkt_len = 0;
+char line[LINE_MAX];
+uint8_t line_len = 0;
+
 void setup() {
   Serial.begin(115200); // Must match Python's BAUD_RATE 
   Serial.setTimeout(50); 
@@ -34,45 +70,137 @@ void setup() {
   claw.attach(PIN_CLAW, 500, 2500); 
 
   moveServos(); // Move to initial position 
-  Serial.println("READY"); 
+  printReady();
 } 
 
+void printReady() {
+  Serial.print("READY BIN1 SEQ LAST=");
+  Serial.println(last_seq);
+}
+
 void loop() {
-  if (Serial.available() > 0) { 
-    // Read the entire line and parse (more stable) 
-    String data = Serial.readStringUntil('\n'); 
-
-    int firstComma = data.indexOf(','); 
-    int secondComma = data.indexOf(',', firstComma + 1); 
-    int thirdComma = data.indexOf(',', secondComma + 1); 
-
-    if (thirdComma != -1) { 
-      int t_base = data.substring(0, firstComma).toInt(); 
-      int t_shl = data.substring(firstComma + 1, secondComma).toInt(); 
-      int t_elb = data.substring(secondComma + 1, thirdComma).toInt(); 
-      int t_claw = data.substring(thirdComma + 1).toInt(); 
-
-      // Apply constraints and update 
-      cur_base = constrain(t_base, BASE_MIN, BASE_MAX); 
-      cur_shoulder = constrain(t_shl, SHL_MIN, SHL_MAX); 
-      cur_elbow = constrain(t_elb, ELB_MIN, ELB_MAX); 
-      cur_claw = constrain(t_claw, CLAW_CLOSE, CLAW_OPEN); 
-
-      moveServos(); 
-
-      // Feedback for debugging (displayed in Python terminal) 
-      Serial.print("Moved: "); 
-      Serial.print(cur_base); Serial.print(","); 
-      Serial.print(cur_shoulder); Serial.print(","); 
-      Serial.print(cur_elbow); Serial.print(","); 
-      Serial.println(cur_claw); 
+  // Drain everything received so far (text lines and binary packets)
+  while (Serial.available() > 0) {
+    uint8_t ch = Serial.read();
+
+    if (pkt_len > 0 || (line_len == 0 && ch == PKT_SYNC)) {
+      pkt[pkt_len++] = ch;
+      if (pkt_len == PKT_SIZE) {
+        handlePacket();
+        pkt_len = 0;
+      }
+      continue;
+    } 
+
+    if (ch == '\n') {
+      line[line_len] = '\0';
+      handleLine();
+      line_len = 0;
+    } else if (line_len < LINE_MAX - 1) {
+      line[line_len++] = (char)ch;
     } 
   }
-}
+
+  // Play back queued setpoints
+  if (ring_count > 0 && millis() - last_step >= last_hold) {
+    Setpoint &sp = ring[ring_head];
+    ring_head = (ring_head + 1) % RING_SIZE;
+    ring_count--;
+
+    applyTarget(sp.b, sp.s, sp.e, sp.c);
+    Serial.print(" #");
+    Serial.println(sp.seq);
+    last_hold = sp.hold_ms;
+    last_step = millis();
+  }
+} 
+
+// Text command: "b,s,e,c" (executed immediately, same as before)
+void handleLine() {
+  if (strcmp(line, "SYNC") == 0) {
+    printReady();
+    return;
+  }
+
+  int values[4];
+  int n = 0;
+  char *p = line;
+
+  while (n < 4) {
+    char *end;
+    long v = strtol(p, &end, 10);
+    if (end == p) break;
+    values[n++] = (int)v;
+    if (*end != ',') break;
+    p = end + 1;
+  }
+
+  if (n == 4) {
+    applyTarget(values[0], values[1], values[2], values[3]);
+    Serial.println();
+  }
+} 
+
+// Binary packet: verify checksum, then queue
+void handlePacket() {
+  uint8_t sum = 0;
+  for (uint8_t i = 1; i < PKT_SIZE; i++) sum += pkt[i];
+
+  if (sum != 0) {
+    // Resync: look for the next header inside the rejected bytes
+    uint8_t start = 1;
+    while (start < PKT_SIZE && pkt[start] != PKT_SYNC) start++;
+    uint8_t keep = PKT_SIZE - start;
+    for (uint8_t i = 0; i < keep; i++) pkt[i] = pkt[start + i];
+    pkt_len = keep;
+    Serial.print("NAK ");
+    Serial.println((uint8_t)(last_seq + 1));
+    return;
+  }
+
+  if (pkt[1] == last_seq) {
+    Serial.print("DUP ");
+    Serial.println(pkt[1]);
+    return;
+  }
+
+  if (ring_count == RING_SIZE) {
+    Serial.print("FULL ");
+    Serial.println(pkt[1]);
+    return;
+  }
+
+  last_seq = pkt[1];
+  uint8_t tail = (ring_head + ring_count) % RING_SIZE;
+  ring[tail].seq = pkt[1];
+  ring[tail].b = pkt[2];
+  ring[tail].s = pkt[3];
+  ring[tail].e = pkt[4];
+  ring[tail].c = pkt[5];
+  ring[tail].hold_ms = pkt[6];
+  ring_count++;
+} 
+
+void applyTarget(int t_base, int t_shl, int t_elb, int t_claw) {
+  // Apply constraints and update
+  cur_base = constrain(t_base, BASE_MIN, BASE_MAX);
+  cur_shoulder = constrain(t_shl, SHL_MIN, SHL_MAX);
+  cur_elbow = constrain(t_elb, ELB_MIN, ELB_MAX);
+  cur_claw = constrain(t_claw, CLAW_CLOSE, CLAW_OPEN);
+
+  moveServos();
+
+  // Feedback for debugging (displayed in Python terminal); the caller ends the line
+  Serial.print("Moved: ");
+  Serial.print(cur_base); Serial.print(",");
+  Serial.print(cur_shoulder); Serial.print(",");
+  Serial.print(cur_elbow); Serial.print(",");
+  Serial.print(cur_claw);
+} 
 
 void moveServos() { 
   base.write(cur_base); 
   shoulder.write(cur_shoulder); 
   elbow.write(cur_elbow); 
   claw.write(cur_claw); 
-}
+} 
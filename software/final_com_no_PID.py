@@ -1,65 +1,72 @@
-import cv2
 import numpy as np
-import requests
-import json
 import time
-import os
 import math
-import serial
+from concurrent.futures import ThreadPoolExecutor
 
+from cell import CellConfig
+from frame_source import FrameSource, read_base_url
+from ik_batch import IK_OK, STATUS_TEXT, motor_to_cartesian
+from cartesian_path import linear_motor_path
+from detection import StageTimer, detect_frame, get_roi
+from ik_grid import IKGrid
+from pixel_remap import get_remap
+from serial_transport import LoopbackTransport, SerialTransport
+from settings import SettingsStore
 
-# --- [사용자 설정] 아두이노 포트 설정 ---
-SERIAL_PORT = 'COM4' 
-BAUD_RATE = 115200
 
-# --- [설정] 로봇 링크 길이 ---
-L1 = 82.0
-L2 = 81.0
+# --- [설정] settings.json ---
+# 포트, 링크 길이, 모터 보정값, 로봇 오프셋, 분류 위치, 직선 이동, 감지 설정은
+# settings.json 한 곳에서 관리 (final_com_with_P.py 와 같은 파일, 실행 중 고치면 다음 작업부터 적용)
+#   motion.linear_step_deg   : 직선 이동 시 한 번에 보내는 최대 관절 변화량 (도)
+#   motion.linear_step_delay : 직선 경로 지점 사이 대기 (s)
 
-# --- [설정] 로봇 오프셋 ---
-ROBOT_OFFSET_X = -50.0
-ROBOT_OFFSET_Y = -190.0
-catch_z_axis = -30.0
+# --- 장치 / 설정 (import 시에는 열지 않음, main() 에서 설정) ---
+arm = None
+settings = None        # 사용 중인 설정 스냅샷 (settings.Settings: 색상 목록, 호모그래피 포함)
+settings_store = None  # 실행 중 settings.json 변경 감시
+ik_grid = None
 
-# --- [설정] 분류 위치 (Drop Zone) ---
-DROP_GREEN = (145, 139, 28)
-DROP_BLACK = (109, 146, 42)
+# 이 스크립트는 검은색도 초록색과 같은 기준(면적 300 / 원형도 0.7)으로 감지
+# (colors.json 의 Black 값 200 / 0.6 은 final_com_with_P.py 용)
+DETECTION_LIMITS = {"Black": (300, 0.7)}
 
-# --- 파일 경로 설정 ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-URL_FILE_PATH = os.path.join(BASE_DIR, 'url.txt')
-MATRIX_FILE_PATH = os.path.join(BASE_DIR, 'homography_matrix.json')
+# --- 설정 적용 (IK 테이블은 링크 길이 / 모터 보정값 / 오프셋이 바뀐 경우에만 다시 로드) ---
+def apply_settings(new):
+    global settings, ik_grid
+    if settings is None or new.ik_params() != settings.ik_params():
+        ik_grid = IKGrid.load_or_build(**new.ik_params())
+    for name, (min_area, min_circularity) in DETECTION_LIMITS.items():
+        color = new.colors.get(name)
+        if color is not None:
+            color.min_area = float(min_area)
+            color.min_circularity = float(min_circularity)
+    settings = new
+
+# --- 장치 설정 객체 ---
+def make_config(camera=True):
+    s = settings
+    # 포트 외의 값(통신 속도, 오프셋, 분류 위치 등)은 설정 스냅샷에서 가져옴
+    return CellConfig("main", read_base_url() if camera else None, s.serial_port,
+                      homography=s.homography, settings=s)
 
 # --- 시리얼 포트 연결 ---
-try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    time.sleep(2)
-    print(f"아두이노 연결 성공: {SERIAL_PORT}")
-except Exception as e:
-    print(f"아두이노 연결 실패: {e}")
-    print("가상 모드로 실행합니다.")
-    ser = None
-
-# --- 파일 로드 ---
-try:
-    with open(URL_FILE_PATH, 'r') as f:
-        base_url = f.read().strip().rstrip('/')
-        ESP32_URL = base_url + '/capture'
-except FileNotFoundError:
-    exit()
-
-try:
-    with open(MATRIX_FILE_PATH, 'r') as f:
-        matrix_list = json.load(f)
-        homography_matrix = np.array(matrix_list)
-except FileNotFoundError:
-    exit()
+# READY 응답을 기다리므로 고정 2초 대기가 필요 없음
+def connect_arm(config):
+    try:
+        transport = SerialTransport.open(config.serial_port, config.baud, protocol=config.protocol)
+        print(f"아두이노 연결 성공: {config.serial_port}")
+    except Exception as e:
+        print(f"아두이노 연결 실패: {e}")
+        print("가상 모드로 실행합니다.")
+        transport = LoopbackTransport()
+    return transport
 
 # --- 역운동학 함수 ---
 def inverse_kinematics(x, y, z):
     r_dist = math.sqrt(x**2 + y**2)
     dist = math.sqrt(r_dist**2 + z**2)
     
+    L1, L2 = settings.l1, settings.l2
     if dist > (L1 + L2): return None, "거리 초과"
     
     theta_base = math.degrees(math.atan2(y, x))
@@ -85,29 +92,39 @@ def calculate_motor_angles(angles):
     if not angles: return None
     b, s, e = angles
     
-    # 수정된 보정값
-    # Base: 70 + 4 = 74
-    final_base = int(b + 74) 
-    
-    # Shoulder: 107 - 2 = 105
-    final_shoulder = int(s + 105)
-    
-    # Elbow: -49 + 7 = -42
-    final_elbow = int(e - 42)
+    # 보정값 / 제한 범위 (settings.json robot.motor_offsets / motor_min / motor_max)
+    (ob, os_, oe), lo, hi = settings.motor_offsets, settings.motor_min, settings.motor_max
+    final_base = int(b + ob)
+    final_shoulder = int(s + os_)
+    final_elbow = int(e + oe)
     
-    final_base = max(29, min(160, final_base))
-    final_shoulder = max(10, min(160, final_shoulder))
-    final_elbow = max(10, min(120, final_elbow))
+    final_base = max(lo[0], min(hi[0], final_base))
+    final_shoulder = max(lo[1], min(hi[1], final_shoulder))
+    final_elbow = max(lo[2], min(hi[2], final_elbow))
     
     return (final_base, final_shoulder, final_elbow)
 
 # --- 로봇 제어 함수 ---
 def send_to_arduino(base, shoulder, elbow, claw, delay=1.0):
-    command = f"{base},{shoulder},{elbow},{claw}\n"
-    print(f" >> 전송: {command.strip()} (대기 {delay}s)")
-    if ser:
-        ser.write(command.encode())
+    print(f" >> 전송: {base},{shoulder},{elbow},{claw} (대기 {delay}s)")
+    cmd = arm.send(base, shoulder, elbow, claw, wait=True)
+    if not arm.is_loopback:
+        # 응답까지 걸린 시간은 대기 시간에서 제외
+        time.sleep(max(0.0, delay - (time.time() - cmd.sent_at)))
+
+# --- 직교 좌표 직선 이동 (경로 오차에 맞춰 샘플 수 자동 결정) ---
+def move_linear(p0, p1, claw, delay=0.5):
+    s = settings
+    motor, codes = linear_motor_path(p0, p1, s.path_tolerance, s.l1, s.l2, max_joint_step=s.linear_step_deg,
+                                     offsets=s.motor_offsets, motor_min=s.motor_min, motor_max=s.motor_max)
+    if np.any(codes != IK_OK):
+        return False
+    print(f" >> 직선 이동: {len(motor) - 1}개 지점 (대기 {delay}s)")
+    arm.send_trajectory([(*m_vals, claw) for m_vals in motor[1:].tolist()], int(s.linear_step_delay * 1000))
+    arm.wait_idle()
+    if not arm.is_loopback:
         time.sleep(delay)
+    return True
 
 # ---------------------------------------------------------
 # [pick_and_place: 수평 접근(왼쪽 진입) 유지]
@@ -139,133 +156,152 @@ def pick_and_place(color_name, target_coords):
     # ---------------------------------------------------------
 
     # 1. 홈 포지션
-    send_to_arduino(89, 134, 42, 30, delay=0.5)
+    send_to_arduino(*settings.home, delay=0.5)
 
     # 2. 물체 왼쪽(뒤) 5cm 위치로 이동 (높이는 물체 높이 tz 유지)
     print(f" >> {color_name} 발견! 왼쪽 측면({start_x:.1f}, {ty:.1f})으로 이동하여 조준...")
-    # Claw를 벌린 상태(30)로 이동
-    send_to_arduino(*motor_start, 30, delay=1.5)
+    # Claw를 벌린 상태(30)로 직선 이동 (불가능하면 한 번에 이동)
+    home_xyz = tuple(motor_to_cartesian(settings.home[:3], settings.l1, settings.l2, settings.motor_offsets)[0])
+    if not move_linear(home_xyz, (start_x, ty, tz), 30, delay=0.5):
+        send_to_arduino(*motor_start, 30, delay=1.5)
 
-    # 3. 천천히 수평으로 전진 (Slide)
+    # 3. 천천히 수평으로 전진 (Slide, 직선 경로)
     print(" >> 물체를 향해 수평으로 접근합니다...")
-    steps_slide = 30  # 50단계로 나누어 접근
-    
-    for i in range(1, steps_slide + 1):
-        # 현재 X 좌표 계산 (선형 보간)
-        current_x = start_x + (approach_dist * (i / steps_slide))
-        
-        # 이동할 좌표에 대한 역운동학 계산
-        ik_angles, st = inverse_kinematics(current_x, ty, tz)
-        
-        if st == "성공":
-            m_vals = calculate_motor_angles(ik_angles)
-            # 딜레이를 주어 안정적으로 연결
-            send_to_arduino(*m_vals, 30, delay=0.05)
+    if not move_linear((start_x, ty, tz), (tx, ty, tz), 30, delay=0.0):
+        send_to_arduino(*motor_target, 30, delay=0.5)
     
     # 4. 물체 잡기 (최종 위치 도달 상태)
     print(" >> 잡기 시도")
     send_to_arduino(*motor_target, 0, delay=0.8)
 
     # 5. 들어올리기 (Lift) - 수직으로 살짝 들기
-    #    현재 위치에서 Z만 30mm 높임
-    angles_lift, _ = inverse_kinematics(tx, ty, tz + 30)
-    if angles_lift:
-        motor_lift = calculate_motor_angles(angles_lift)
-        send_to_arduino(*motor_lift, 0, delay=0.5)
-    else:
-        # IK 실패시 단순히 어깨만 들어올림
-        mb, ms, me = motor_target
-        send_to_arduino(mb, ms - 20, me, 0, delay=0.5)
+    #    현재 위치에서 Z만 30mm 높임 (수직 직선)
+    lift_xyz = (tx, ty, tz + 30)
+    if not move_linear((tx, ty, tz), lift_xyz, 0, delay=0.5):
+        lift_xyz = None
+        angles_lift, _ = inverse_kinematics(tx, ty, tz + 30)
+        if angles_lift:
+            motor_lift = calculate_motor_angles(angles_lift)
+            send_to_arduino(*motor_lift, 0, delay=0.5)
+        else:
+            # IK 실패시 단순히 어깨만 들어올림
+            mb, ms, me = motor_target
+            send_to_arduino(mb, ms - 20, me, 0, delay=0.5)
 
     # ---------------------------------------------------------
     # [2단계: 물체 놓기 (기존 유지)]
     # ---------------------------------------------------------
-    if color_name == "Green":
-        drop_coords = DROP_GREEN
-    elif color_name == "Black":
-        drop_coords = DROP_BLACK
-    else:
+    drop_coords = settings.drop_zones.get(color_name)
+    if drop_coords is None:
         return
 
     db, ds, de = drop_coords
     
     print(f" >> {color_name} 분류 위치로 이동")
+    if lift_xyz:
+        drop_xyz = tuple(motor_to_cartesian(drop_coords, settings.l1, settings.l2, settings.motor_offsets)[0])
+        move_linear(lift_xyz, drop_xyz, 0, delay=0.0)
     send_to_arduino(db, ds, de, 0, delay=1.0) 
     send_to_arduino(db, ds, de, 30, delay=0.5) # 놓기
     
-    send_to_arduino(89, 134, 42, 30, delay=1.0) # 복귀
+    send_to_arduino(*settings.home, delay=1.0) # 복귀
     print(" >> 작업 완료!\n")
 
 # --- 객체 감지 함수 ---
-def find_objects(image, mask, color_name, matrix, min_area, min_circularity):
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+# blobs: detect_blobs()가 찾은 레코드 배열 (모든 색상)
+def find_objects(image, blobs, matrix):
+    if len(blobs) == 0:
+        return []
+
+    # 모든 중심점을 픽셀→로봇 좌표 테이블에서 한 번에 조회, 도달 불가 물체는 IK 테이블로 제외
+    remap = get_remap(matrix, image.shape, settings.offset_x, settings.offset_y)
+
+    robot_pts = np.empty((len(blobs), 3))
+    robot_pts[:, :2] = remap.to_robot(blobs.x, blobs.y)
+    robot_pts[:, 2] = settings.catch_z
+
+    motor, codes = ik_grid.solve_motor_angles(robot_pts)
+
     results = []
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > min_area:
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0: continue
-            circularity = (4 * np.pi * area) / (perimeter * perimeter)
-            
-            if circularity > min_circularity:
-                M = cv2.moments(cnt)
-                if M["m00"] != 0:
-                    cX = int(M["m10"] / M["m00"])
-                    cY = int(M["m01"] / M["m00"])
-                    
-                    pixel_point = np.array([[[cX, cY]]], dtype=np.float32)
-                    real_point = cv2.perspectiveTransform(pixel_point, matrix)
-                    paper_x = float(real_point[0][0][0])
-                    paper_y = float(real_point[0][0][1])
-                    
-                    robot_x = paper_x + ROBOT_OFFSET_X
-                    robot_y = -(paper_y + ROBOT_OFFSET_Y)
-                    robot_z = catch_z_axis
-                    
-                    angles, status = inverse_kinematics(robot_x, robot_y, robot_z)
-                    motor_vals = calculate_motor_angles(angles)
-                    
-                    results.append({
-                        "color": color_name,
-                        "motor_vals": motor_vals,
-                        "robot_coords": (robot_x, robot_y, robot_z),
-                        "status": status,
-                        "center": (cX, cY)
-                    })
+    for blob, (robot_x, robot_y, robot_z), m_vals, code in zip(
+            blobs, robot_pts.tolist(), motor.tolist(), codes.tolist()):
+        results.append({
+            "color": settings.colors.names[blob.label - 1],
+            "motor_vals": tuple(m_vals) if code == IK_OK else None,
+            "robot_coords": (robot_x, robot_y, robot_z),
+            "status": STATUS_TEXT[code],
+            "center": (int(blob.x), int(blob.y))
+        })
     return results
 
 
+# --- 단계별 감지 시간 (ms) ---
+detect_timer = StageTimer()
+
+# --- 종료 처리 ---
+def shutdown(camera):
+    camera.stop()
+    settings_store.stop()
+    if arm.mean_rtt is not None:
+        print(f" >> 시리얼 응답 지연 평균: {arm.mean_rtt * 1000:.1f} ms (응답 {arm.acked}/{arm.sent})")
+    arm.close()
+
 # --- 메인 실행 루프 ---
 def main():
-    send_to_arduino(89, 134, 42, 30, delay=1.0)
+    global arm, settings_store
+
+    try:
+        settings_store = SettingsStore()
+        apply_settings(settings_store.current)
+        config = make_config()
+    except FileNotFoundError as e:
+        print(f"[에러] '{e.filename}' 파일을 찾을 수 없습니다.")
+        return
+    except (KeyError, ValueError) as e:
+        print(f"[에러] 설정 파일 오류: {e}")
+        return
+    # 실행 중 settings.json / colors.json / homography_matrix.json 변경 감시
+    settings_store.start()
+
+    # 아두이노 연결(리셋 후 READY 대기)을 카메라 연결 / 첫 프레임 준비와 동시에 진행
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=1) as startup:
+        arm_ready = startup.submit(connect_arm, config)
+
+        # 카메라 스트림 시작 (백그라운드에서 최신 프레임 유지)
+        camera = FrameSource(config.camera_url, decode=settings.decode_scale == 1).start()
+
+        # 첫 프레임 해상도로 픽셀→로봇 좌표 테이블 미리 생성
+        first_frame = camera.read_frame()
+        if first_frame is not None:
+            get_remap(settings.homography, first_frame.shape, settings.offset_x, settings.offset_y)
+            get_roi(settings.homography, first_frame.shape)
+
+        arm = arm_ready.result()
+
+    send_to_arduino(*settings.home, delay=1.0)
+    print(f" >> 시작 준비 완료 ({time.time() - started:.1f}s)")
     
     while True:
         print("\n[대기 중] Enter: 작업 시작 ('q': 종료)")
         key = input()
         if key == 'q': break
+        # 바뀐 설정은 작업 사이에만 적용
+        if settings_store.current is not settings:
+            apply_settings(settings_store.current)
 
         try:
-            response = requests.get(ESP32_URL, timeout=5)
-            if response.status_code != 200: continue
-            img_array = np.frombuffer(response.content, dtype=np.uint8)
-            image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            if image is None: continue
-            
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+            # 로봇 이동 이후의 새 프레임 사용 (스트림 연결 재사용)
+            frame = camera.read_frame(fresh=True)
+            if frame is None: continue
             
-            lower_green = np.array([49, 101, 35])
-            upper_green = np.array([85, 255, 255])
-            green_mask = cv2.inRange(hsv, lower_green, upper_green)
+            # 모든 색상을 한 번의 LUT 분류 + 한 번의 연결 요소 분석으로 감지
+            s = settings
+            roi = get_roi(s.homography, frame.shape) if s.detect_roi else None
+            blobs = detect_frame(frame, s.colors, roi, s.decode_scale, s.pyramid_levels, detect_timer)
             
-            lower_black = np.array([0, 0, 0])
-            upper_black = np.array([180, 255, 50])
-            black_mask = cv2.inRange(hsv, lower_black, upper_black)
-            
-            green_objs = find_objects(image, green_mask, "Green", homography_matrix, 300, 0.7)
-            black_objs = find_objects(image, black_mask, "Black", homography_matrix, 300, 0.7)
-            
-            all_objs = green_objs + black_objs
+            all_objs = find_objects(frame, blobs, s.homography)
+            print(f" >> 감지 시간: {detect_timer.format()}")
             
             if not all_objs:
                 print(" >> 감지된 물체가 없습니다.")
@@ -273,7 +309,7 @@ def main():
             
             target_processed = False
             for obj in all_objs:
-                if obj['status'] == "성공":
+                if obj['status'] == "성공" and obj['color'] in settings.drop_zones:
                     print(f" >> 발견: {obj['color']} ({obj['robot_coords']})")
                     pick_and_place(obj['color'], obj['robot_coords'])
                     target_processed = True
@@ -285,5 +321,7 @@ def main():
         except Exception as e:
             print(f"에러 발생: {e}")
 
+    shutdown(camera)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,332 +1,467 @@
-import cv2
 import numpy as np
-import requests
-import json
 import time
-import os
-import math
-import serial
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cell import CellConfig
+from frame_source import FrameSource, JpegFrame, decode_jpeg, read_base_url
+from arm_motion import ArmMotion
+from ik_batch import IK_OK, STATUS_LABEL, STATUS_TEXT
+from detection import StageTimer, detect_blobs, detect_frame, get_roi
+from ik_grid import IKGrid
+from metrics import JsonlExporter, PrometheusExporter, metrics
+from pixel_remap import get_remap
+from serial_transport import LoopbackTransport, SerialTransport
+from pipeline import SceneGate, Stage, put_latest
+from recording import Recorder, ReplaySource
+from settings import SettingsStore
+from pick_scheduler import plan_pick_order, targets_unchanged
+from tracker import MotionGate, ObjectTracker
+
+
+# --- 설정 ---
+# 포트, 링크 길이, 모터 보정값, 로봇 오프셋, 분류 위치, P 제어 / 궤적 설정, 감지 설정은
+# settings.json 한 곳에서 관리 (실행 중 파일을 고치면 다음 작업부터 적용)
+#   motion.profile 'trapezoid': 관절별 속도/가속도 제한 사다리꼴 프로파일 (motion.max_vel / max_acc)
+#                  'p'        : 기존 P 제어 (kp / max_speed / threshold)
+#   detection.pyramid_levels 1 이상: 축소 영상에서 찾고 원본 해상도로 중심 보정
+#   detection.decode_scale 2/4/8: JPEG을 축소 디코딩해서 찾고, 물체가 있을 때만 원본 디코딩
+#   serial.protocol 'auto': 펌웨어가 지원하면 바이너리, 'text': 기존 "b,s,e,c" 형식
+
+# --- 파이프라인 모드 설정 ---
+PIPELINE_QUEUE_SIZE = 1      # 단계 사이 큐 크기 (항상 최신 결과만 유지)
+CONFIRM_DIST = 10.0          # 연속 두 프레임에서 같은 물체로 볼 거리 (mm)
+GATE_DECODE_SCALE = 4        # 장면 변화 확인용 축소 디코딩 배율 (썸네일만 비교하므로 원본 불필요)
+
+# --- 장치 / 설정 (import 시에는 열지 않음, main() 또는 apply_settings()/attach_arm() 에서 설정) ---
+arm = None
+robot = None           # 팔 동작 / 집기 순서 (arm_motion.ArmMotion, cell.py와 공유)
+settings = None        # 사용 중인 설정 스냅샷 (settings.Settings: 색상 목록, 호모그래피 포함)
+settings_store = None  # 실행 중 settings.json 변경 감시
+ik_grid = None
+
+# --- 집기 단계별 진행 메시지 ---
+PHASE_TEXT = {
+    'home': " >> 홈으로 이동",
+    'approach': " >> {color} 접근 준비...",
+    'slide': " >> 수평 접근 중...",
+    'grip': " >> 잡기",
+    'drop': " >> {color} 분류 위치로 이동",
+}
+
+
+# --- 설정 적용 (IK 테이블은 링크 길이 / 모터 보정값 / 오프셋이 바뀐 경우에만 다시 로드) ---
+def apply_settings(new):
+    global settings, ik_grid
+    if settings is None or new.ik_params() != settings.ik_params():
+        ik_grid = IKGrid.load_or_build(**new.ik_params())
+    settings = new
+    if robot is not None:
+        robot.update(new)
+
+# --- 설정 파일이 바뀌었으면 적용 (감시 스레드가 미리 읽어 둔 스냅샷이므로 파일 접근 없음) ---
+def refresh_settings():
+    if settings_store is not None and settings_store.current is not settings:
+        apply_settings(settings_store.current)
+
+# --- 장치 설정 객체 (camera=False: url.txt 없이, 재생 / 벤치마크용) ---
+def make_config(camera=True):
+    s = settings
+    # 포트 외의 값(통신 속도, 오프셋, 분류 위치 등)은 설정 스냅샷에서 가져옴
+    return CellConfig("main", read_base_url() if camera else None, s.serial_port,
+                      homography=s.homography, settings=s)
 
+# --- 시리얼 포트 연결 ---
+# READY 응답을 기다리므로 고정 2초 대기가 필요 없음
+def connect_arm(config):
+    try:
+        transport = SerialTransport.open(config.serial_port, config.baud, protocol=config.protocol)
+        print(f"아두이노 연결 성공: {config.serial_port}")
+    except Exception as e:
+        print(f"아두이노 연결 실패: {e}")
+        print("가상 모드로 실행합니다.")
+        transport = LoopbackTransport()
+    return transport
+
+# --- 집기 단계 시작 시 진행 메시지 출력 ---
+def print_phase(phase, color_name):
+    if phase in PHASE_TEXT:
+        print(PHASE_TEXT[phase].format(color=color_name))
+
+# --- 연결된 팔로 동작 객체 생성 ---
+def attach_arm(transport):
+    global arm, robot
+    arm = transport
+    robot = ArmMotion(transport, settings, on_phase=print_phase)
+
+# --- 부드러운 이동 함수 (단일 목표) ---
+def move_smoothly_pid(target_b, target_s, target_e, target_c, arrival_delay=0.5):
+    robot.move_to((target_b, target_s, target_e, target_c), arrival_delay)
 
-# --- 아두이노 포트 설정 ---
-SERIAL_PORT = 'COM4' 
-BAUD_RATE = 115200
+# --- 초기화나 급한 정지용 ---
+def send_raw(base, shoulder, elbow, claw, delay=1.0):
+    print(f" >> 즉시 이동: {base},{shoulder},{elbow},{claw}")
+    robot.send_raw((base, shoulder, elbow, claw), delay)
 
-# --- 로봇 링크 길이 ---
-L1 = 82.0
-L2 = 81.0
+# --- Pick and Place (집기 순서는 arm_motion.py, cell.py와 공유) ---
+def pick_and_place(color_name, target_coords, on_release=None, via_home=True):
+    if not target_coords: return
 
-# --- 로봇 오프셋 ---
-ROBOT_OFFSET_X = -50.0
-ROBOT_OFFSET_Y = -190.0
-catch_z_axis = -30.0
+    motion_start = robot.planned_time
+    drop = settings.drop_zones.get(color_name)
+    if drop is None:
+        print(f" >> [경고] {color_name} 분류 위치가 없습니다.")
+        return
+    if not robot.pick_and_place(color_name, target_coords, drop, on_release, via_home):
+        print(" >> [경고] 접근 위치 오류.")
+        return
+    print(f" >> 작업 완료! (계획된 이동 시간 {robot.planned_time - motion_start:.2f}s, {settings.profile})\n")
 
-# --- 분류 위치 ---
-DROP_GREEN = (144, 137, 23)
-DROP_BLACK = (108, 137, 42)
+# --- 객체 감지 함수 ---
+# blobs: detect_blobs()가 찾은 레코드 배열 (모든 색상)
+def find_objects(image, blobs, matrix):
+    if len(blobs) == 0:
+        return []
 
-# --- PID 제어 관련 상수 ---
-Kp = 0.15
-MAX_SPEED = 4.0
-DT = 0.03
-THRESHOLD = 1.0
+    # 모든 중심점을 픽셀→로봇 좌표 테이블에서 한 번에 조회, 도달 불가 물체는 IK 테이블로 제외
+    remap = get_remap(matrix, image.shape, settings.offset_x, settings.offset_y)
 
-# --- 파일 경로 설정 ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-URL_FILE_PATH = os.path.join(BASE_DIR, 'url.txt')
-MATRIX_FILE_PATH = os.path.join(BASE_DIR, 'homography_matrix.json')
+    robot_pts = np.empty((len(blobs), 3))
+    robot_pts[:, :2] = remap.to_robot(blobs.x, blobs.y)
+    robot_pts[:, 2] = settings.catch_z
 
-# --- 전역 변수: 현재 로봇 상태 저장 (Base, Shoulder, Elbow, Claw) ---
-g_current_angles = [89.0, 134.0, 42.0, 30.0]
+    motor, codes = ik_grid.solve_motor_angles(robot_pts)
 
+    results = []
+    for blob, (robot_x, robot_y, robot_z), m_vals, code in zip(
+            blobs, robot_pts.tolist(), motor.tolist(), codes.tolist()):
+        metrics.count('ik_results_total', status=STATUS_LABEL[code])
+        results.append({
+            "color": settings.colors.names[blob.label - 1],
+            "motor_vals": tuple(m_vals) if code == IK_OK else None,
+            "robot_coords": (robot_x, robot_y, robot_z),
+            "status": STATUS_TEXT[code],
+            "center": (int(blob.x), int(blob.y))
+        })
+    return results
 
-# --- 시리얼 포트 연결 ---
-try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    time.sleep(2)
-    print(f"아두이노 연결 성공: {SERIAL_PORT}")
-except Exception as e:
-    print(f"아두이노 연결 실패: {e}")
-    print("가상 모드로 실행합니다.")
-    ser = None
-
-# --- 파일 로드 ---
-try:
-    with open(URL_FILE_PATH, 'r') as f:
-        base_url = f.read().strip().rstrip('/')
-        ESP32_URL = base_url + '/capture'
-except FileNotFoundError:
-    exit()
-
-try:
-    with open(MATRIX_FILE_PATH, 'r') as f:
-        matrix_list = json.load(f)
-        homography_matrix = np.array(matrix_list)
-except FileNotFoundError:
-    exit()
-
-# --- 역운동학 함수 ---
-def inverse_kinematics(x, y, z):
-    r_dist = math.sqrt(x**2 + y**2)
-    dist = math.sqrt(r_dist**2 + z**2)
-    
-    if dist > (L1 + L2): return None, "거리 초과"
-    
-    theta_base = math.degrees(math.atan2(y, x))
-    try:
-        cos_alpha = (L1**2 + dist**2 - L2**2) / (2 * L1 * dist)
-        cos_beta = (L1**2 + L2**2 - dist**2) / (2 * L1 * L2)
-        
-        if cos_alpha < -1 or cos_alpha > 1 or cos_beta < -1 or cos_beta > 1:
-             return None, "각도 불가"
-
-        alpha = math.acos(cos_alpha)
-        beta = math.acos(cos_beta)
-        target_elevation = math.atan2(z, r_dist)
-        
-        theta_shoulder = math.degrees(target_elevation + alpha)
-        theta_elbow = math.degrees(beta)
-        return (theta_base, theta_shoulder, theta_elbow), "성공"
-    except ValueError:
-        return None, "수학적 에러"
-
-# 오프셋 보정
-def calculate_motor_angles(angles):
-    if not angles: return None
-    b, s, e = angles
-
-    final_base = int(b + 74)
-    final_shoulder = int(s + 105)
-    final_elbow = int(e - 42)
-    
-    final_base = max(29, min(160, final_base))
-    final_shoulder = max(10, min(160, final_shoulder))
-    final_elbow = max(10, min(120, final_elbow))
-    
-    return (final_base, final_shoulder, final_elbow)
 
-# --- P-제어 기반 부드러운 이동 함수 ---
-def move_smoothly_pid(target_b, target_s, target_e, target_c, arrival_delay=0.5):
-    global g_current_angles
-    
-    targets = [target_b, target_s, target_e, target_c]
-    
+# --- 한 프레임에서 모든 물체 감지 ---
+detect_timer = StageTimer()   # 단계별 감지 시간 (ms)
+
+def detect_objects(image):
+    # image: 디코딩된 영상 또는 JpegFrame (decode_scale 적용)
+    # 모든 색상을 한 번의 LUT 분류 + 한 번의 연결 요소 분석으로 감지
+    s = settings
+    roi = get_roi(s.homography, image.shape) if s.detect_roi else None
+    if isinstance(image, JpegFrame):
+        blobs = detect_frame(image, s.colors, roi, s.decode_scale, s.pyramid_levels, detect_timer)
+    else:
+        blobs = detect_blobs(image, s.colors, roi, s.pyramid_levels, detect_timer)
+
+    with detect_timer.stage("ik"):
+        objs = find_objects(image, blobs, s.homography)
+    metrics.observe('detect_seconds', sum(detect_timer.last.values()) / 1000.0)
+    metrics.gauge('objects_detected', len(objs))
+    return objs
+
+def first_reachable(objs):
+    # 분류 위치가 정해진 색상만 집기
+    for obj in objs:
+        if obj['status'] == "성공" and obj['color'] in settings.drop_zones:
+            return obj
+    return None
+
+# --- 일괄 모드: 한 프레임의 모든 물체를 이동 비용 순서로 처리 ---
+# frame: 호출한 쪽에서 이미 읽은 프레임 (없으면 새로 읽음, 다시 계획할 때도 새로 읽음)
+def run_batch(camera, frame=None):
     while True:
-        all_arrived = True
-        
-        # 각 관절별로 P제어 계산
-        for i in range(4):
-            error = targets[i] - g_current_angles[i]
-            
-            # 오차가 허용 범위보다 크면 이동 필요
-            if abs(error) > THRESHOLD:
-                all_arrived = False
-                
-                # P 제어: 오차에 비례하여 이동량 결정
-                delta = error * Kp
-                
-                # 속도 제한
-                if delta > MAX_SPEED: 
-                    delta = MAX_SPEED
-                if delta < -MAX_SPEED: 
-                    delta = -MAX_SPEED
-                
-                g_current_angles[i] += delta
-            else:
-                # 거의 도달했으면 목표값으로 강제 고정
-                g_current_angles[i] = targets[i]
-
-        # 아두이노로 전송
-        send_base = int(g_current_angles[0])
-        send_shoulder = int(g_current_angles[1])
-        send_elbow = int(g_current_angles[2])
-        send_claw = int(g_current_angles[3])
-        
-        command = f"{send_base},{send_shoulder},{send_elbow},{send_claw}\n"
-        
-        if ser:
-            ser.write(command.encode())
-        
-        # 목표 도달 시 루프 종료
-        if all_arrived:
+        refresh_settings()
+        if frame is None:
+            frame = camera.read_frame(fresh=True)
+        if frame is None:
+            print(" >> 이미지를 가져오지 못했습니다.")
+            return
+        current, frame = frame, None
+
+        objs = [o for o in detect_objects(current) if o['status'] == "성공" and o['color'] in settings.drop_zones]
+        if not objs:
+            print(" >> 처리할 물체가 없습니다.")
             break
-            
-        # 제어 주기 대기
-        time.sleep(DT)
 
-    # 이동 완료 후 안정화 대기
-    if arrival_delay > 0:
-        time.sleep(arrival_delay)
-
-# --- 초기화나 급한 정지용 ---
-def send_raw(base, shoulder, elbow, claw, delay=1.0):
-    global g_current_angles
-    # 현재 상태 즉시 업데이트
-    g_current_angles = [float(base), float(shoulder), float(elbow), float(claw)]
-    
-    command = f"{base},{shoulder},{elbow},{claw}\n"
-    print(f" >> 즉시 이동: {command.strip()}")
-    if ser:
-        ser.write(command.encode())
-        time.sleep(delay)
-
-# --- Pick and Place ---
-def pick_and_place(color_name, target_coords):
-    if not target_coords: return
-    
-    tx, ty, tz = target_coords
-    
-    # 접근 준비 위치 계산
-    approach_dist = 50.0 
-    start_x = tx - approach_dist
-    
-    angles_start, status_start = inverse_kinematics(start_x, ty, tz)
-    
-    if status_start != "성공":
-        print(" >> [경고] 접근 위치 오류.")
-        return
+        order, est = plan_pick_order([o['motor_vals'] for o in objs],
+                                     [settings.drop_zones[o['color']] for o in objs],
+                                     settings.home[:3], settings.max_vel, settings.max_acc)
+        print(f" >> {len(objs)}개 물체 작업 계획 (예상 이동 시간 {est:.1f}s)")
+
+        replan = False
+        for n, idx in enumerate(order):
+            obj = objs[idx]
+            print(f" >> [{n + 1}/{len(order)}] {obj['color']} ({obj['robot_coords']})")
+            pick_and_place(obj['color'], obj['robot_coords'], via_home=False)
+
+            # 남은 물체 위치가 그대로인지 가볍게 확인 (바뀌었으면 다시 감지/계획)
+            remaining = [objs[i]['center'] for i in order[n + 1:]]
+            if remaining:
+                check, _ = camera.read(fresh=True)
+                if not targets_unchanged(current.image, check, remaining):
+                    print(" >> 장면 변화 감지: 다시 계획합니다.")
+                    replan = True
+                    break
+        if not replan:
+            break
 
-    motor_start = calculate_motor_angles(angles_start)
-    motor_target = calculate_motor_angles(inverse_kinematics(tx, ty, tz)[0])
+    move_smoothly_pid(*settings.home, arrival_delay=0.5)
+
+# --- 장면 변화 확인용 영상 (작업 영역만, 디코딩된 영상이 없으면 축소 디코딩) ---
+def gate_view(frame):
+    roi = get_roi(settings.homography, frame.shape) if settings.detect_roi else None
+    if frame.decoded:
+        return roi.crop(frame.image) if roi is not None else frame.image
+    small = decode_jpeg(frame.jpeg, GATE_DECODE_SCALE)
+    if small is None or roi is None:
+        return small
+    return roi.crop_reduced(small, GATE_DECODE_SCALE)
+
+# --- 파이프라인 모드: 촬영 / 감지 / 이동을 동시에 실행 ---
+def run_pipeline(camera):
+    """
+    capture -> frame_q -> detect -> target_q -> motion(메인 스레드)
+    로봇이 움직이는 동안 다음 물체를 미리 감지/검증해 둔다. input() 없이 연속 동작.
+    """
+    stop_event = threading.Event()
+    gate = SceneGate()
+    frame_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    target_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    tracker = ObjectTracker(max_dist=CONFIRM_DIST)
+    motion = MotionGate()
+    tracker_lock = threading.Lock()
+    skipped = {'frames': 0}
+
+    # 녹화 재생(최대 속도)에서는 프레임을 버리지 않고 각 단계를 기다림
+    replaying = not getattr(camera, 'realtime', True)
+
+    def capture_step():
+        if replaying and not gate.wait_open(timeout=0.1): return
+        # 디코딩은 감지 단계에서 필요한 만큼만 (decode_scale 적용)
+        frame = camera.read_frame(fresh=True)
+        if frame is None: return
+        stamp = frame.stamp
+        # 집기 동작 중(팔/물체가 화면을 가림) 촬영된 프레임은 버림
+        if not gate.accepts(stamp): return
+        if not replaying:
+            put_latest(frame_q, (frame, stamp))
+            return
+        while not stop_event.is_set():
+            try:
+                frame_q.put((frame, stamp), timeout=0.1)
+                return
+            except queue.Full:
+                continue
 
-    # 1. 홈 포지션
-    print(" >> 홈으로 이동")
-    move_smoothly_pid(89, 134, 42, 30, arrival_delay=0.2)
+    def detect_step():
+        try:
+            frame, stamp = frame_q.get(timeout=0.5)
+        except queue.Empty:
+            return
+        if not gate.accepts(stamp): return
+
+        # 작업 영역이 그대로면 감지를 건너뛰고 기존 추적 결과 사용
+        view = gate_view(frame)
+        if view is None: return
+        with tracker_lock:
+            if motion.changed(view):
+                tracker.update(detect_objects(frame))
+                motion.accept(view)
+            else:
+                tracker.hold()
+                skipped['frames'] += 1
 
-    # 2. 물체 왼쪽 측면 이동
-    print(f" >> {color_name} 접근 준비...")
-    move_smoothly_pid(*motor_start, 30, arrival_delay=0.5)
+            for track in tracker.pop_failed():
+                print(f" >> 집기 실패: {track.color} 물체가 그대로 있습니다. 다시 시도합니다.")
 
-    # 3. 수평 진입
-    print(" >> 수평 접근 중...")
-    steps_slide = 20
-    
-    for i in range(1, steps_slide + 1):
-        current_x = start_x + (approach_dist * (i / steps_slide))
-        ik_angles, st = inverse_kinematics(current_x, ty, tz)
-        
-        if st == "성공":
-            m_vals = calculate_motor_angles(ik_angles)
-            move_smoothly_pid(*m_vals, 30, arrival_delay=0.0) 
-    
-    # 4. 물체 잡기 (최종 위치 확정)
-    print(" >> 잡기")
-    move_smoothly_pid(*motor_target, 0, arrival_delay=0.5)
-
-    # 5. 들어올리기
-    angles_lift, _ = inverse_kinematics(tx, ty, tz + 40)
-    if angles_lift:
-        motor_lift = calculate_motor_angles(angles_lift)
-        move_smoothly_pid(*motor_lift, 0, arrival_delay=0.3)
-    else:
-        mb, ms, me = motor_target
-        move_smoothly_pid(mb, ms - 25, me, 0, arrival_delay=0.3)
-
-    # 6. 분류 위치로 이동
-    if color_name == "Green":
-        drop_coords = DROP_GREEN
-    elif color_name == "Black":
-        drop_coords = DROP_BLACK
-    else:
-        return
+            # 연속 두 프레임 이상 같은 위치에서 보인 물체만 확정 (한 프레임 오검출 제거)
+            targets = [t for t in tracker.confirmed() if first_reachable([t.obj])]
+        if targets:
+            put_latest(target_q, (targets[0], stamp))
 
-    db, ds, de = drop_coords
-    
-    print(f" >> {color_name} 분류 위치로 이동")
-    move_smoothly_pid(db, ds, de, 0, arrival_delay=0.5)
-    
-    # 놓기
-    move_smoothly_pid(db, ds, de, 30, arrival_delay=0.5)
-    
-    # 복귀
-    move_smoothly_pid(89, 134, 42, 30, arrival_delay=0.5) 
-    print(" >> 작업 완료!\n")
+    def on_release():
+        motion.reset()
+        gate.open()
 
-# --- 객체 감지 함수 ---
-def find_objects(image, mask, color_name, matrix, min_area, min_circularity):
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    results = []
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > min_area:
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0: continue
-            circularity = (4 * np.pi * area) / (perimeter * perimeter)
-            
-            if circularity > min_circularity:
-                M = cv2.moments(cnt)
-                if M["m00"] != 0:
-                    cX = int(M["m10"] / M["m00"])
-                    cY = int(M["m01"] / M["m00"])
-                    
-                    pixel_point = np.array([[[cX, cY]]], dtype=np.float32)
-                    real_point = cv2.perspectiveTransform(pixel_point, matrix)
-                    paper_x = float(real_point[0][0][0])
-                    paper_y = float(real_point[0][0][1])
-                    
-                    robot_x = paper_x + ROBOT_OFFSET_X
-                    robot_y = -(paper_y + ROBOT_OFFSET_Y)
-                    robot_z = catch_z_axis
-                    
-                    angles, status = inverse_kinematics(robot_x, robot_y, robot_z)
-                    motor_vals = calculate_motor_angles(angles)
-                    
-                    results.append({
-                        "color": color_name,
-                        "motor_vals": motor_vals,
-                        "robot_coords": (robot_x, robot_y, robot_z),
-                        "status": status,
-                        "center": (cX, cY)
-                    })
-    return results
+    stages = [Stage("capture", capture_step, stop_event),
+              Stage("detect", detect_step, stop_event)]
+    for stage in stages:
+        stage.start()
 
+    print("\n[파이프라인 모드] Ctrl+C: 종료")
+    picks = 0
+    started = time.time()
+    try:
+        while True:
+            # 새 설정은 집기 동작 사이에만 적용 (감지 스레드는 다음 프레임부터 사용)
+            refresh_settings()
+            try:
+                track, stamp = target_q.get(timeout=1.0)
+            except queue.Empty:
+                # 녹화 재생이 끝나면 종료
+                if getattr(camera, 'finished', False) and frame_q.empty(): break
+                continue
+            # 마지막 놓기 이전 장면에서 나온 목표는 폐기
+            if not gate.accepts(stamp): continue
+
+            print(f" >> 발견: {track.color} ({track.robot_coords})")
+            gate.close()
+            with tracker_lock:
+                tracker.picked(track)
+            try:
+                pick_and_place(track.color, track.robot_coords, on_release=on_release)
+            finally:
+                gate.open()
+            picks += 1
+            elapsed = time.time() - started
+            print(f" >> 처리량: {picks}개 / {elapsed:.1f}s ({picks / elapsed * 60:.1f}개/분)")
+            print(f" >> 평균 감지 시간: {detect_timer.format(detect_timer.means())}"
+                  f" (변화 없는 프레임 {skipped['frames']}개 감지 생략)")
+    except KeyboardInterrupt:
+        print("\n >> 파이프라인 종료")
+    finally:
+        stop_event.set()
+        for stage in stages:
+            stage.join(timeout=2.0)
+
+# --- 종료 처리 ---
+def shutdown(camera, recorder=None, exporters=()):
+    camera.stop()
+    if settings_store is not None:
+        settings_store.stop()
+    if arm.mean_rtt is not None:
+        print(f" >> 시리얼 응답 지연 평균: {arm.mean_rtt * 1000:.1f} ms (응답 {arm.acked}/{arm.sent})")
+    arm.close()
+    if recorder is not None:
+        recorder.close()
+        print(f" >> 녹화 저장: {recorder.path} (프레임 {recorder.frames}, 명령 {recorder.commands})")
+    for exporter in exporters:
+        exporter.stop()
+
+# --- 명령행 옵션 값 (예: --record session.rec) ---
+def arg_value(name):
+    args = sys.argv[1:]
+    if name in args[:-1]:
+        return args[args.index(name) + 1]
+    return None
 
 # --- 메인 실행 루프 ---
 def main():
+    global settings_store
+
+    # --replay: 녹화된 프레임으로 카메라/아두이노 없이 최대 속도 실행
+    # --record: 사용한 프레임과 보낸 명령을 파일에 기록
+    replay_path = arg_value('--replay')
+    record_path = arg_value('--record')
+
+    # 설정 / 보정 파일 (재생 모드는 url.txt 불필요)
+    try:
+        settings_store = SettingsStore()
+        apply_settings(settings_store.current)
+        config = make_config(camera=not replay_path)
+    except FileNotFoundError as e:
+        print(f"[에러] '{e.filename}' 파일을 찾을 수 없습니다.")
+        return
+    except (KeyError, ValueError) as e:
+        print(f"[에러] 설정 파일 오류: {e}")
+        return
+    # 실행 중 settings.json / colors.json / homography_matrix.json 변경 감시
+    settings_store.start()
+
+    # --metrics-port 9100: Prometheus 형식 /metrics, --metrics-log metrics.jsonl: 주기적 기록
+    # 기본은 이 PC에서만 접속 가능, 다른 PC에서 수집하려면 --metrics-host 0.0.0.0
+    exporters = []
+    metrics_port = arg_value('--metrics-port')
+    metrics_host = arg_value('--metrics-host') or '127.0.0.1'
+    metrics_log = arg_value('--metrics-log')
+    if metrics_port or metrics_log:
+        metrics.enable()
+    if metrics_port:
+        exporters.append(PrometheusExporter(metrics, int(metrics_port), host=metrics_host).start())
+        print(f" >> 메트릭: http://{metrics_host}:{metrics_port}/metrics")
+    if metrics_log:
+        exporters.append(JsonlExporter(metrics, metrics_log).start())
+        print(f" >> 메트릭 기록: {metrics_log}")
+    recorder = None
+    if record_path:
+        recorder = Recorder(record_path, meta={'script': 'final_com_with_P', 'argv': sys.argv[1:],
+                                               'protocol': settings.protocol, 'profile': settings.profile})
+
+    # 아두이노 연결(리셋 후 READY 대기)을 카메라 연결 / 첫 프레임 준비와 동시에 진행
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=1) as startup:
+        arm_ready = None if replay_path else startup.submit(connect_arm, config)
+
+        # 카메라 스트림 시작 (백그라운드에서 최신 프레임 유지)
+        if replay_path:
+            print(f" >> 녹화 재생: {replay_path}")
+            camera = ReplaySource(replay_path).start()
+        else:
+            # 축소 디코딩 시 스트림 스레드에서는 디코딩하지 않음
+            camera = FrameSource(config.camera_url, decode=settings.decode_scale == 1, recorder=recorder).start()
+
+        # 첫 프레임 해상도로 픽셀→로봇 좌표 테이블 미리 생성
+        first_frame = camera.read_frame()
+        if first_frame is not None:
+            get_remap(settings.homography, first_frame.shape, settings.offset_x, settings.offset_y)
+            get_roi(settings.homography, first_frame.shape)
+
+        attach_arm(arm_ready.result() if arm_ready else LoopbackTransport(realtime=False))
+    arm.recorder = recorder
+
     # 초기화: 홈 위치 이동
-    send_raw(89, 134, 42, 30, delay=1.0)
+    send_raw(*settings.home, delay=1.0)
+    print(f" >> 시작 준비 완료 ({time.time() - started:.1f}s)")
+
+    # --pipeline: 입력 대기 없이 연속 동작
+    if '--pipeline' in sys.argv[1:]:
+        run_pipeline(camera)
+        shutdown(camera, recorder, exporters)
+        return
+    batch_mode = '--batch' in sys.argv[1:]
     
     while True:
-        print("\n[대기 중] Enter: 작업 시작 ('q': 종료)")
-        key = input()
-        if key == 'q': break
+        if replay_path:
+            # 재생 모드: Enter 없이 녹화가 끝날 때까지 반복
+            if camera.finished: break
+        else:
+            print("\n[대기 중] Enter: 작업 시작 ('q': 종료)")
+            key = input()
+            if key == 'q': break
+        refresh_settings()
 
         try:
-            response = requests.get(ESP32_URL, timeout=5)
-            if response.status_code != 200: continue
-            img_array = np.frombuffer(response.content, dtype=np.uint8)
-            image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            if image is None: continue
+            # 로봇 이동 이후의 새 프레임 사용 (스트림 연결 재사용)
+            frame = camera.read_frame(fresh=True)
+            if frame is None: continue
             
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            
-            lower_green = np.array([49, 101, 35])
-            upper_green = np.array([85, 255, 255])
-            green_mask = cv2.inRange(hsv, lower_green, upper_green)
-            
-            lower_black = np.array([0, 0, 0])
-            upper_black = np.array([180, 255, 50])
-            black_mask = cv2.inRange(hsv, lower_black, upper_black)
-            
-            green_objs = find_objects(image, green_mask, "Green", homography_matrix, 300, 0.7)
-            black_objs = find_objects(image, black_mask, "Black", homography_matrix, 200, 0.6)
-            
-            all_objs = green_objs + black_objs
+            # --batch: 보이는 물체를 모두 이동 비용 순서로 분류
+            if batch_mode:
+                started = time.time()
+                run_batch(camera, frame)
+                print(f" >> 일괄 작업 완료 ({time.time() - started:.1f}s)")
+                continue
+
+            all_objs = detect_objects(frame)
+            print(f" >> 감지 시간: {detect_timer.format()}")
             
             if not all_objs:
                 print(" >> 감지된 물체가 없습니다.")
                 continue
             
-            target_processed = False
-            for obj in all_objs:
-                if obj['status'] == "성공":
-                    print(f" >> 발견: {obj['color']} ({obj['robot_coords']})")
-                    pick_and_place(obj['color'], obj['robot_coords'])
-                    target_processed = True
-                    break 
-            
-            if not target_processed:
+            obj = first_reachable(all_objs)
+            if obj:
+                print(f" >> 발견: {obj['color']} ({obj['robot_coords']})")
+                pick_and_place(obj['color'], obj['robot_coords'])
+            else:
                 print(" >> 물체는 있으나 도달 불가합니다.")
 
         except Exception as e:
@@ -334,5 +469,7 @@ def main():
             # 에러 발생 시 잠시 대기
             time.sleep(1)
 
+    shutdown(camera, recorder, exporters)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,397 @@
+'''Shared ESP32-CAM frame source (persistent MJPEG stream, /capture fallback)'''
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import cv2
+import numpy as np
+import requests
+
+from metrics import metrics
+
+
+# --- CameraWebServer settings (see app_httpd.cpp) ---
+# The stream server runs on server_port + 1 and uses a fixed part boundary.
+HTTP_PORT = 80
+STREAM_PATH = '/stream'
+CAPTURE_PATH = '/capture'
+URL_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'url.txt')
+
+# --- Reader settings ---
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 5.0
+CHUNK_SIZE = 4096
+RECONNECT_DELAY = 0.5
+MAX_STREAM_FAILURES = 3         # connections in a row without a frame before falling back to /capture
+STREAM_RETRY_INTERVAL = 10.0    # s between stream probes while on /capture
+
+
+def stream_url_from_base(base_url):
+    """ http://192.168.x.xx -> http://192.168.x.xx:81/stream (http://host:8080 -> :8081) """
+    parts = urlsplit(base_url)
+    host = parts.hostname or ''
+    port = (parts.port or HTTP_PORT) + 1
+    return urlunsplit((parts.scheme or 'http', f"{host}:{port}", STREAM_PATH, '', ''))
+
+
+def read_base_url(path=URL_FILE_PATH):
+    """ Camera address saved in url.txt, e.g. http://192.168.0.10 """
+    with open(path, 'r') as f:
+        return f.read().strip().rstrip('/')
+
+
+# --- JPEG decode ---
+# libjpeg-turbo can scale by 1/2, 1/4, 1/8 inside the IDCT (most coefficients
+# are never transformed), which is far cheaper than a full decode + resize.
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Optional: PyTurboJPEG decodes straight into a caller buffer (pip install PyTurboJPEG)
+try:
+    from turbojpeg import TurboJPEG
+    _turbo = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbo = None
+
+# SOFn markers (not DHT / JPG / DAC, which share the 0xC4..0xCC range)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def decode_jpeg(jpeg_bytes, scale=1):
+    img_array = np.frombuffer(jpeg_bytes, dtype=np.uint8)
+    return cv2.imdecode(img_array, DECODE_FLAGS[scale])
+
+
+def jpeg_size(jpeg_bytes):
+    """ (width, height) from the SOF header without decoding, None if not found. """
+    data = memoryview(jpeg_bytes)
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+class JpegDecoder:
+    """
+    Reduced-resolution decoder for the detection hot path.
+    With PyTurboJPEG installed each scale decodes into one reused buffer, so
+    the returned image is only valid until the next decode() at that scale;
+    otherwise cv2.IMREAD_REDUCED_COLOR_* is used (new array every call).
+    """
+
+    def __init__(self, backend='auto'):
+        if backend == 'turbojpeg' and _turbo is None:
+            raise RuntimeError("PyTurboJPEG / libturbojpeg not found")
+        self.backend = 'turbojpeg' if backend != 'opencv' and _turbo is not None else 'opencv'
+        self._buffers = {}
+
+    def decode(self, jpeg_bytes, scale=1):
+        if self.backend == 'opencv':
+            return decode_jpeg(jpeg_bytes, scale)
+
+        width, height, _, _ = _turbo.decode_header(jpeg_bytes)
+        shape = (-(-height // scale), -(-width // scale), 3)
+        buf = self._buffers.get(scale)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[scale] = np.empty(shape, dtype=np.uint8)
+        try:
+            return _turbo.decode(jpeg_bytes, scaling_factor=(1, scale), dst=buf)
+        except TypeError:
+            # PyTurboJPEG < 1.7 has no dst argument
+            return _turbo.decode(jpeg_bytes, scaling_factor=(1, scale))
+
+
+class JpegFrame:
+    """
+    One camera JPEG whose full-resolution decode happens on first use of
+    .image (or is handed over by a source that already decoded it).
+    shape comes from the JPEG header, so pixel->robot tables and the ROI can
+    be looked up without decoding.
+    """
+
+    def __init__(self, jpeg, stamp=0.0, image=None):
+        self.jpeg = jpeg
+        self.stamp = stamp
+        self._image = image
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                with metrics.span('frame_decode_seconds'):
+                    self._image = decode_jpeg(self.jpeg)
+            return self._image
+
+    @property
+    def decoded(self):
+        return self._image is not None
+
+    @property
+    def shape(self):
+        if self._image is not None:
+            return self._image.shape
+        size = jpeg_size(self.jpeg)
+        if size is None:
+            return self.image.shape
+        return size[1], size[0], 3
+
+
+def iter_mjpeg_parts(chunks):
+    """ Yields the JPEG payload of every part of a multipart/x-mixed-replace body. """
+    buf = bytearray()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        while True:
+            header_end = buf.find(b'\r\n\r\n')
+            if header_end < 0:
+                break
+
+            length = None
+            for line in bytes(buf[:header_end]).split(b'\r\n'):
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value.strip())
+                    break
+
+            if length is None:
+                # Boundary line or junk before the first part: drop the header block
+                del buf[:header_end + 4]
+                continue
+
+            body_start = header_end + 4
+            if len(buf) < body_start + length:
+                break
+
+            yield bytes(buf[body_start:body_start + length])
+            del buf[:body_start + length]
+
+
+class FrameSource:
+    """
+    Keeps the latest camera frame in memory.
+    A background thread reads the /stream endpoint over one connection.
+    If streaming is unavailable, read() falls back to a pooled GET /capture
+    until a periodic probe finds the stream working again.
+    decode=False: frames are decoded on first read() instead of in the
+    stream thread (read_jpeg / read_frame hand out the JPEG undecoded).
+    recorder: optional recording.Recorder; every frame handed out by read()
+    is appended to it once.
+    """
+
+    def __init__(self, base_url, use_stream=True, decode=True, recorder=None):
+        self.base_url = base_url.strip().rstrip('/')
+        self.capture_url = self.base_url + CAPTURE_PATH
+        self.stream_url = stream_url_from_base(self.base_url)
+        self.use_stream = use_stream
+        self.decode = decode
+
+        # requests.Session is not thread-safe: one for the stream thread, one for /capture
+        self.session = requests.Session()
+        self.capture_session = requests.Session()
+        self._cond = threading.Condition()
+        self._frame = None      # latest JpegFrame
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self._gave_up = False
+        self.streaming = False
+        self.recorder = recorder
+        self._recorded_seq = 0
+
+    # --- lifecycle ---
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        if self.use_stream:
+            self._thread = threading.Thread(target=self._stream_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=CONNECT_TIMEOUT)
+            self._thread = None
+        self.session.close()
+        self.capture_session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- background stream reader ---
+    def _stream_loop(self):
+        """
+        Reconnects after RECONNECT_DELAY; after MAX_STREAM_FAILURES
+        connections in a row without a frame, reads fall back to /capture and
+        the stream is probed again every STREAM_RETRY_INTERVAL seconds.
+        """
+        failures = 0
+        while self._running:
+            got_frame = False
+            error = None
+            try:
+                with self.session.get(self.stream_url, stream=True,
+                                      timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as resp:
+                    if resp.status_code != 200:
+                        raise requests.exceptions.HTTPError(f"stream status {resp.status_code}")
+                    self.streaming = True
+                    for jpeg in iter_mjpeg_parts(resp.iter_content(CHUNK_SIZE)):
+                        if not self._running:
+                            break
+                        metrics.count('frames_total', source='stream')
+                        if self._publish(jpeg) is not None and not got_frame:
+                            got_frame = True
+                            failures = 0
+                            self._stream_recovered()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+            finally:
+                self.streaming = False
+
+            if not self._running:
+                break
+            if error is not None or not got_frame:
+                failures += 1
+                metrics.count('frame_stream_errors_total')
+                if not self._gave_up:
+                    print(f"[FrameSource] stream error ({failures}/{MAX_STREAM_FAILURES}): "
+                          f"{error or 'no frame received'}")
+            if failures >= MAX_STREAM_FAILURES and not self._gave_up:
+                print("[FrameSource] stream unavailable, falling back to /capture")
+                with self._cond:
+                    self._gave_up = True
+                    self._cond.notify_all()
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running,
+                                    STREAM_RETRY_INTERVAL if self._gave_up else RECONNECT_DELAY)
+
+    def _stream_recovered(self):
+        with self._cond:
+            if not self._gave_up:
+                return
+            self._gave_up = False
+        print("[FrameSource] stream is back, leaving /capture")
+
+    def _publish(self, jpeg):
+        """ The new JpegFrame, or None when decode=True and the JPEG does not decode. """
+        image = None
+        if self.decode:
+            with metrics.span('frame_decode_seconds'):
+                image = decode_jpeg(jpeg)
+            if image is None:
+                return None
+        frame = JpegFrame(jpeg, time.time(), image)
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+        return frame
+
+    def _stream_alive(self):
+        return self._thread is not None and self._thread.is_alive() and not self._gave_up
+
+    # --- /capture fallback ---
+    def _capture_once(self, timeout):
+        """ The captured JpegFrame, or None on a bad status or a JPEG that does not decode. """
+        with metrics.span('frame_capture_seconds'):
+            response = self.capture_session.get(self.capture_url, timeout=timeout)
+        if response.status_code != 200:
+            return None
+        metrics.count('frames_total', source='capture')
+        return self._publish(response.content)
+
+    def _record(self):
+        with self._cond:
+            if self._seq == self._recorded_seq or self._frame is None:
+                return
+            self._recorded_seq = self._seq
+            frame = self._frame
+        self.recorder.add_frame(frame.jpeg, frame.stamp)
+
+    # --- public API ---
+    @property
+    def seq(self):
+        return self._seq
+
+    def read(self, fresh=False, timeout=CONNECT_TIMEOUT):
+        """
+        Returns (image, timestamp) of the latest frame, or (None, 0.0).
+        fresh=True waits for a frame newer than the one held at call time
+        (use after the arm moved so the scene is not stale).
+        """
+        frame = self.read_frame(fresh, timeout)
+        if frame is None:
+            return None, 0.0
+        return frame.image, frame.stamp
+
+    def _read(self, fresh, timeout):
+        if not self._running:
+            self.start()
+
+        if not self._stream_alive():
+            try:
+                return self._capture_once(timeout)
+            except requests.exceptions.RequestException as e:
+                metrics.count('frame_capture_errors_total')
+                print(f"[FrameSource] capture error: {e}")
+                return None
+
+        deadline = time.time() + timeout
+        with self._cond:
+            start_seq = self._seq
+            while self._stream_alive():
+                if self._seq > 0 and not (fresh and self._seq == start_seq):
+                    return self._frame
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+        # Stream fell back to /capture while waiting
+        return self._read(fresh, max(0.1, deadline - time.time()))
+
+    def read_jpeg(self, fresh=False, timeout=CONNECT_TIMEOUT):
+        """ Same as read() but returns the raw JPEG bytes. """
+        frame = self.read_frame(fresh, timeout)
+        if frame is None:
+            return None, 0.0
+        return frame.jpeg, frame.stamp
+
+    def read_frame(self, fresh=False, timeout=CONNECT_TIMEOUT):
+        """
+        Same as read() but returns the JpegFrame (None on failure); with
+        decode=False nothing is decoded until the caller needs pixels.
+        """
+        with metrics.span('frame_read_seconds'):
+            frame = self._read(fresh, timeout)
+        if self.recorder is not None and frame is not None:
+            self._record()
+        return frame
@@ -0,0 +1,283 @@
+'''Automatic pixel -> paper homography: paper corners, ArUco markers or a chessboard, averaged over frames
+
+    fit = calibrate(frames, 'aruco')     # frames: BGR images of the same view
+    print(fit.format())                  # points, inliers, reprojection error in mm
+    if fit.error_mm < 2.0:               # per-frame spread for an exact 4-point fit
+        save_matrix(fit.matrix, path)    # atomic, running scripts reload it
+
+Every detector returns {key: (pixel xy, paper xy mm)}. A key is one physical
+point (a paper corner, a marker corner, a chessboard corner), so points are
+averaged per key across frames before one RANSAC fit.
+'''
+import json
+import os
+
+import cv2
+import numpy as np
+
+from pixel_remap import PAPER_HEIGHT, PAPER_WIDTH
+
+
+# --- ArUco target: ids 0..3 in the click order (top-left, top-right, bottom-left, bottom-right) ---
+ARUCO_DICT = cv2.aruco.DICT_4X4_50 if hasattr(cv2, 'aruco') else None
+MARKER_SIZE_MM = 40.0
+MARKER_INSET_MM = 10.0         # paper edge -> marker edge
+
+# --- Chessboard target: inner corners (cols, rows), centred on the sheet ---
+CHESSBOARD_CORNERS = (9, 6)
+CHESSBOARD_SQUARE_MM = 25.0
+
+# --- Fit ---
+RANSAC_THRESHOLD_MM = 3.0
+MIN_SEEN_FRACTION = 0.5        # a point must be found in this share of the usable frames
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+MIN_PAPER_AREA = 0.1           # paper contour must cover this share of the frame
+
+# Drift is measured over this grid of paper points (mm)
+DRIFT_GRID = (5, 4)
+
+
+# --- Target layout (paper mm) ---
+def marker_origins(paper_width=PAPER_WIDTH, paper_height=PAPER_HEIGHT):
+    """ Top-left corner of markers 0..3. """
+    far_x = paper_width - MARKER_INSET_MM - MARKER_SIZE_MM
+    far_y = paper_height - MARKER_INSET_MM - MARKER_SIZE_MM
+    return {0: (MARKER_INSET_MM, MARKER_INSET_MM), 1: (far_x, MARKER_INSET_MM),
+            2: (MARKER_INSET_MM, far_y), 3: (far_x, far_y)}
+
+
+def marker_corners_mm(origin):
+    """ Marker corners in ArUco order: top-left, top-right, bottom-right, bottom-left. """
+    x, y = origin
+    s = MARKER_SIZE_MM
+    return np.array([(x, y), (x + s, y), (x + s, y + s), (x, y + s)], dtype=np.float64)
+
+
+def chessboard_corners_mm(paper_width=PAPER_WIDTH, paper_height=PAPER_HEIGHT):
+    """ Inner corners row by row from the top-left, as findChessboardCorners orders them. """
+    cols, rows = CHESSBOARD_CORNERS
+    s = CHESSBOARD_SQUARE_MM
+    x0 = (paper_width - (cols + 1) * s) / 2.0 + s
+    y0 = (paper_height - (rows + 1) * s) / 2.0 + s
+    xs, ys = np.meshgrid(x0 + s * np.arange(cols), y0 + s * np.arange(rows))
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
+def render_target(method, px_per_mm=4.0, paper_width=PAPER_WIDTH, paper_height=PAPER_HEIGHT):
+    """ Printable target sheet (grey image, 1 px = 1 / px_per_mm mm). """
+    sheet = np.full((int(round(paper_height * px_per_mm)), int(round(paper_width * px_per_mm))), 255, np.uint8)
+    if method == 'aruco':
+        dictionary = _aruco_dictionary()
+        side = int(round(MARKER_SIZE_MM * px_per_mm))
+        for marker_id, (x, y) in marker_origins(paper_width, paper_height).items():
+            if hasattr(cv2.aruco, 'generateImageMarker'):
+                marker = cv2.aruco.generateImageMarker(dictionary, marker_id, side)
+            else:
+                marker = cv2.aruco.drawMarker(dictionary, marker_id, side)
+            px, py = int(round(x * px_per_mm)), int(round(y * px_per_mm))
+            sheet[py:py + side, px:px + side] = marker
+    elif method == 'chessboard':
+        cols, rows = CHESSBOARD_CORNERS
+        s = CHESSBOARD_SQUARE_MM
+        x0, y0 = chessboard_corners_mm(paper_width, paper_height)[0] - s
+        for r in range(rows + 1):
+            for c in range(cols + 1):
+                if (r + c) % 2 == 0:
+                    p0 = (int(round((x0 + c * s) * px_per_mm)), int(round((y0 + r * s) * px_per_mm)))
+                    p1 = (int(round((x0 + (c + 1) * s) * px_per_mm)) - 1, int(round((y0 + (r + 1) * s) * px_per_mm)) - 1)
+                    cv2.rectangle(sheet, p0, p1, 0, -1)
+    else:
+        raise ValueError(f"no printable target for '{method}'")
+    return sheet
+
+
+# --- Detectors: gray image -> {key: (pixel xy, paper xy)} ---
+def _aruco_dictionary():
+    if ARUCO_DICT is None:
+        raise RuntimeError("cv2.aruco not available (OpenCV >= 4.7 or opencv-contrib-python needed)")
+    return cv2.aruco.getPredefinedDictionary(ARUCO_DICT)
+
+
+def detect_aruco(gray):
+    dictionary = _aruco_dictionary()
+    if hasattr(cv2.aruco, 'ArucoDetector'):
+        corners, ids, _ = cv2.aruco.ArucoDetector(dictionary, cv2.aruco.DetectorParameters()).detectMarkers(gray)
+    else:
+        corners, ids, _ = cv2.aruco.detectMarkers(gray, dictionary)
+    points = {}
+    if ids is None:
+        return points
+    origins = marker_origins()
+    for quad, marker_id in zip(corners, ids.ravel()):
+        marker_id = int(marker_id)
+        if marker_id not in origins:
+            continue
+        for k, (pixel, paper) in enumerate(zip(quad.reshape(4, 2), marker_corners_mm(origins[marker_id]))):
+            points[('aruco', marker_id, k)] = (pixel, paper)
+    return points
+
+
+def detect_chessboard(gray):
+    found, corners = cv2.findChessboardCorners(gray, CHESSBOARD_CORNERS,
+                                               cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return {}
+    corners = cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), SUBPIX_CRITERIA).reshape(-1, 2)
+    # The board is symmetric under a half turn: start from the corner nearest the image top-left
+    if corners[0].sum() > corners[-1].sum():
+        corners = corners[::-1]
+    return {('chessboard', i): (pixel, paper) for i, (pixel, paper) in enumerate(zip(corners, chessboard_corners_mm()))}
+
+
+def detect_paper(gray):
+    """ The sheet as the largest bright quadrilateral; its corners in the click order. """
+    _, bright = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(bright, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return {}
+    contour = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(contour) < MIN_PAPER_AREA * gray.shape[0] * gray.shape[1]:
+        return {}
+    quad = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True).reshape(-1, 2)
+    if len(quad) != 4:
+        return {}        # an edge is covered (arm, object over the border)
+
+    s, d = quad.sum(axis=1), quad[:, 1] - quad[:, 0]
+    ordered = np.array([quad[np.argmin(s)], quad[np.argmin(d)], quad[np.argmax(d)], quad[np.argmax(s)]],
+                       dtype=np.float32)
+    ordered = cv2.cornerSubPix(gray, ordered.reshape(-1, 1, 2), (5, 5), (-1, -1), SUBPIX_CRITERIA).reshape(-1, 2)
+    paper = [(0, 0), (PAPER_WIDTH, 0), (0, PAPER_HEIGHT), (PAPER_WIDTH, PAPER_HEIGHT)]
+    return {('paper', i): (pixel, np.array(mm, dtype=np.float64)) for i, (pixel, mm) in enumerate(zip(ordered, paper))}
+
+
+DETECTORS = {
+    'paper': detect_paper,
+    'aruco': detect_aruco,
+    'chessboard': detect_chessboard,
+}
+
+
+# --- Fit ---
+class Calibration:
+    """
+    One RANSAC fit of the per-point medians. Errors are paper-mm distances
+    of every single-frame observation of an inlier point, so they include
+    frame-to-frame jitter.
+
+    An exact 4-point fit (paper) passes through every point, so its
+    reprojection error says little; spread_mm, the largest drift between
+    the fit and a fit of each single frame, is then the figure to gate on
+    (error_mm). It measures how stable the corners are, not whether they
+    are the right corners.
+    """
+
+    def __init__(self, matrix, pixels, paper, inliers, frames, samples, spread_mm=None):
+        self.matrix = matrix
+        self.pixels = pixels
+        self.paper = paper
+        self.inliers = inliers
+        self.frames = frames
+        index, observed, _ = samples
+        keep = inliers[index]
+        errors = np.linalg.norm(to_paper(matrix, observed[keep]) - paper[index[keep]], axis=1)
+        self.errors = errors
+        self.mean_error_mm = float(errors.mean())
+        self.max_error_mm = float(errors.max())
+        self.spread_mm = spread_mm
+        self.error_mm = self.mean_error_mm if spread_mm is None else spread_mm
+
+    def format(self):
+        text = (f"{len(self.pixels)} points from {self.frames} frames, {int(self.inliers.sum())} inliers, "
+                f"reprojection error mean {self.mean_error_mm:.2f} mm / max {self.max_error_mm:.2f} mm")
+        if self.spread_mm is not None:
+            text += (f"\nExact 4-point fit: checked on the per-frame fit spread, {self.spread_mm:.2f} mm "
+                     f"(corner stability only, not corner accuracy)")
+        return text
+
+
+def to_paper(matrix, pixels):
+    pts = np.asarray(pixels, dtype=np.float64).reshape(1, -1, 2)
+    return cv2.perspectiveTransform(pts, np.asarray(matrix, dtype=np.float64))[0]
+
+
+def collect_points(images, method):
+    """
+    Median pixel position of every point found in enough frames. Returns
+    (pixels, paper, frames used, (point index, pixel, frame) of every observation).
+    """
+    detect = DETECTORS[method]
+    seen = {}
+    frames = 0
+    for image in images:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        points = detect(gray)
+        if not points:
+            continue
+        for key, (pixel, paper) in points.items():
+            entry = seen.setdefault(key, (paper, [], []))
+            entry[1].append(pixel)
+            entry[2].append(frames)
+        frames += 1
+
+    keep = [entry for entry in seen.values() if len(entry[1]) >= MIN_SEEN_FRACTION * frames]
+    if not keep:
+        return np.empty((0, 2)), np.empty((0, 2)), frames, (np.empty(0, int), np.empty((0, 2)), np.empty(0, int))
+    paper = np.array([p for p, _, _ in keep], dtype=np.float64)
+    pixels = np.array([np.median(obs, axis=0) for _, obs, _ in keep], dtype=np.float64)
+    index = np.concatenate([np.full(len(obs), i) for i, (_, obs, _) in enumerate(keep)])
+    observed = np.concatenate([np.asarray(obs, dtype=np.float64).reshape(-1, 2) for _, obs, _ in keep])
+    frame_ids = np.concatenate([ids for _, _, ids in keep])
+    return pixels, paper, frames, (index, observed, frame_ids)
+
+
+def frame_spread_mm(matrix, paper, samples):
+    """ Largest drift_mm between matrix and an exact fit of each single frame that saw every point. """
+    index, observed, frame_ids = samples
+    spread = 0.0
+    for frame in np.unique(frame_ids):
+        rows = frame_ids == frame
+        if rows.sum() != len(paper):
+            continue
+        single, _ = cv2.findHomography(observed[rows], paper[index[rows]])
+        if single is not None:
+            spread = max(spread, drift_mm(matrix, single))
+    return spread
+
+
+def calibrate(images, method, threshold=RANSAC_THRESHOLD_MM):
+    """ Calibration from several frames of one view; ValueError when the target is not found. """
+    pixels, paper, frames, samples = collect_points(images, method)
+    if len(pixels) < 4:
+        raise ValueError(f"{method}: target not found ({len(pixels)} points in {frames} frames)")
+    if len(pixels) == 4:
+        matrix, _ = cv2.findHomography(pixels, paper)
+        inliers = np.ones(4, dtype=bool)
+    else:
+        matrix, mask = cv2.findHomography(pixels, paper, cv2.RANSAC, threshold)
+        inliers = mask.ravel().astype(bool) if mask is not None else None
+    if matrix is None or inliers is None or not inliers.any():
+        raise ValueError(f"{method}: no homography fits the {len(pixels)} points")
+    spread = frame_spread_mm(matrix, paper, samples) if len(pixels) == 4 else None
+    return Calibration(matrix, pixels, paper, inliers, frames, samples, spread)
+
+
+def drift_mm(old, new, paper_width=PAPER_WIDTH, paper_height=PAPER_HEIGHT):
+    """ Largest distance (mm) between where old and new put the same pixel, over the sheet. """
+    xs, ys = np.meshgrid(np.linspace(0, paper_width, DRIFT_GRID[0]), np.linspace(0, paper_height, DRIFT_GRID[1]))
+    grid = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    pixels = to_paper(np.linalg.inv(np.asarray(old, dtype=np.float64)), grid)
+    return float(np.linalg.norm(to_paper(new, pixels) - grid, axis=1).max())
+
+
+# --- File ---
+def load_matrix(path):
+    with open(path, 'r') as f:
+        return np.array(json.load(f), dtype=np.float64)
+
+
+def save_matrix(matrix, path):
+    """ Write to a temp file and rename, so a reader never sees half a matrix. """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(np.asarray(matrix).tolist(), f, indent=4)
+    os.replace(tmp, path)
@@ -0,0 +1,104 @@
+'''Vectorized inverse kinematics over N x 3 target arrays'''
+import numpy as np
+
+
+# Link lengths, motor offsets and limits are passed in from settings.json
+# (settings.Settings: l1, l2, motor_offsets, motor_min, motor_max)
+
+# --- Per-row status codes ---
+IK_OK = 0
+IK_OUT_OF_RANGE = 1
+IK_NO_ANGLE = 2
+IK_MATH_ERROR = 3
+
+# Same strings the scalar inverse_kinematics() returns
+STATUS_TEXT = {
+    IK_OK: "성공",
+    IK_OUT_OF_RANGE: "거리 초과",
+    IK_NO_ANGLE: "각도 불가",
+    IK_MATH_ERROR: "수학적 에러",
+}
+
+# ASCII names for metric labels
+STATUS_LABEL = {
+    IK_OK: "ok",
+    IK_OUT_OF_RANGE: "out_of_range",
+    IK_NO_ANGLE: "no_angle",
+    IK_MATH_ERROR: "math_error",
+}
+
+
+def inverse_kinematics_batch(points, l1, l2):
+    """
+    points: (N, 3) array of (x, y, z) in robot mm.
+    Returns (angles, status): (N, 3) float64 degrees (NaN where unsolved)
+    and (N,) int8 status codes.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    x, y, z = pts[:, 0], pts[:, 1], pts[:, 2]
+
+    r_dist = np.hypot(x, y)
+    dist = np.hypot(r_dist, z)
+
+    status = np.full(len(pts), IK_OK, dtype=np.int8)
+    out_of_range = dist > (l1 + l2)
+    degenerate = (dist == 0) & ~out_of_range
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_alpha = (l1**2 + dist**2 - l2**2) / (2 * l1 * dist)
+        cos_beta = (l1**2 + l2**2 - dist**2) / (2 * l1 * l2)
+
+    no_angle = ((np.abs(cos_alpha) > 1) | (np.abs(cos_beta) > 1)) & ~out_of_range & ~degenerate
+    status[no_angle] = IK_NO_ANGLE
+    status[degenerate] = IK_MATH_ERROR
+    status[out_of_range] = IK_OUT_OF_RANGE
+    ok = status == IK_OK
+
+    angles = np.full((len(pts), 3), np.nan)
+    alpha = np.arccos(cos_alpha[ok])
+    beta = np.arccos(cos_beta[ok])
+    elevation = np.arctan2(z[ok], r_dist[ok])
+
+    angles[ok, 0] = np.degrees(np.arctan2(y[ok], x[ok]))
+    angles[ok, 1] = np.degrees(elevation + alpha)
+    angles[ok, 2] = np.degrees(beta)
+    return angles, status
+
+
+def calculate_motor_angles_batch(angles, offsets, motor_min, motor_max):
+    """ (N, 3) IK angles -> (N, 3) int motor angles. NaN rows become 0. """
+    angles = np.asarray(angles, dtype=np.float64).reshape(-1, 3)
+    # int() in calculate_motor_angles truncates toward zero
+    motor = np.trunc(angles + np.asarray(offsets, dtype=np.float64))
+    motor = np.clip(motor, motor_min, motor_max)
+    motor[np.isnan(motor)] = 0
+    return motor.astype(np.int32)
+
+
+def solve_motor_angles(points, l1, l2, offsets, motor_min, motor_max):
+    """
+    IK + offset + clamp in one pass.
+    Returns ((N, 3) int32 motor angles, (N,) int8 status).
+    Rows whose status is not IK_OK hold zeros.
+    """
+    angles, status = inverse_kinematics_batch(points, l1, l2)
+    motor = calculate_motor_angles_batch(angles, offsets, motor_min, motor_max)
+    motor[status != IK_OK] = 0
+    return motor, status
+
+
+def forward_kinematics_batch(angles, l1, l2):
+    """ (N, 3) IK angles (base, shoulder, elbow in degrees) -> (N, 3) x, y, z. """
+    angles = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1, 3))
+    base, shoulder, elbow = angles[:, 0], angles[:, 1], angles[:, 2]
+    # elbow is the inner angle between the links (beta in inverse_kinematics)
+    forearm = shoulder - np.pi + elbow
+    r = l1 * np.cos(shoulder) + l2 * np.cos(forearm)
+    z = l1 * np.sin(shoulder) + l2 * np.sin(forearm)
+    return np.column_stack([r * np.cos(base), r * np.sin(base), z])
+
+
+def motor_to_cartesian(motor, l1, l2, offsets):
+    """ Motor angles (e.g. a drop zone) -> robot x, y, z. Inverse of the offset step. """
+    motor = np.asarray(motor, dtype=np.float64).reshape(-1, 3)
+    return forward_kinematics_batch(motor - np.asarray(offsets, dtype=np.float64), l1, l2)
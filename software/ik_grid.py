@@ -0,0 +1,247 @@
+'''Precomputed reachability / motor-angle grid over the paper workspace'''
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import ik_batch
+from pixel_remap import PAPER_HEIGHT, PAPER_WIDTH
+
+
+# --- Grid defaults (geometry and z levels come from settings.ik_params()) ---
+GRID_RESOLUTION = 5.0          # mm between grid nodes
+GRID_MARGIN = 60.0             # mm around the sheet (slide approach starts 50 mm left of the object)
+MAX_CORNER_SPREAD = 15.0       # deg; corners further apart than this are a jump (base wrap, near the base)
+MAX_CENTRE_ERROR = 1.0         # deg; interpolated vs exact angle at the cell centre
+GRID_FORMAT = 2                # bump when the stored arrays change meaning
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GRID_FILE_PATH = os.path.join(BASE_DIR, 'ik_grid.npz')
+
+
+def paper_to_robot(paper_x, paper_y, offset_x, offset_y):
+    """ Same conversion as find_objects: paper mm -> robot mm. """
+    return paper_x + offset_x, -(paper_y + offset_y)
+
+
+def robot_to_paper(robot_x, robot_y, offset_x, offset_y):
+    return robot_x - offset_x, -robot_y - offset_y
+
+
+def raw_motor_angles(points, l1, l2, offsets):
+    """ IK angles + motor offsets as floats, before truncation and clamping (NaN where unsolved). """
+    angles, status = ik_batch.inverse_kinematics_batch(points, l1, l2)
+    return angles + np.asarray(offsets, dtype=np.float64), status
+
+
+def smooth_cells(raw, status, centre, centre_status, motor_min, motor_max,
+                 max_spread=MAX_CORNER_SPREAD, max_error=MAX_CENTRE_ERROR):
+    """
+    (ny - 1, nx - 1) mask of cells that can be interpolated: all four corners
+    solved, no joint crossing a motor limit, corners of every joint within
+    max_spread degrees (catches the base atan2 wrap), and the bilinear value
+    at the cell centre within max_error of the exact centre solve.
+    """
+    corners = np.stack([raw[:-1, :-1], raw[:-1, 1:], raw[1:, :-1], raw[1:, 1:]])
+    ok = status == ik_batch.IK_OK
+    solved = ok[:-1, :-1] & ok[:-1, 1:] & ok[1:, :-1] & ok[1:, 1:] & (centre_status == ik_batch.IK_OK)
+    with np.errstate(invalid='ignore'):
+        spread = corners.max(axis=0) - corners.min(axis=0)
+        error = np.abs(corners.mean(axis=0) - centre)
+        low = corners < np.asarray(motor_min, dtype=np.float64)
+        high = corners > np.asarray(motor_max, dtype=np.float64)
+        smooth = (spread <= max_spread) & (error <= max_error)
+    # a joint either stays inside its limits on all corners or sits past the same limit on all
+    straddle = (low.any(axis=0) & ~low.all(axis=0)) | (high.any(axis=0) & ~high.all(axis=0))
+    return solved & smooth.all(axis=-1) & ~straddle.any(axis=-1)
+
+
+class IKGrid:
+    """
+    raw[k, j, i]   : float motor angles (IK + offsets, unclamped) at z_levels[k], paper (xs[i], ys[j])
+    status[k, j, i]: ik_batch status code at that node
+    smooth[k, j, i]: the cell between nodes (i, j) and (i + 1, j + 1) is safe to interpolate;
+                     points in other cells are solved exactly
+    """
+
+    def __init__(self, params, xs, ys, z_levels, raw, status, smooth):
+        self.params = params
+        self.xs = xs
+        self.ys = ys
+        self.z_levels = z_levels
+        self.raw = raw
+        self.status = status
+        self.smooth = smooth
+        self.resolution = params['resolution']
+
+    # --- build / cache ---
+    @staticmethod
+    def make_params(l1, l2, z_levels, offset_x, offset_y, motor_offsets, motor_min, motor_max,
+                    resolution=GRID_RESOLUTION, margin=GRID_MARGIN):
+        return {
+            'resolution': float(resolution),
+            'margin': float(margin),
+            'z_levels': [float(z) for z in z_levels],
+            'l1': float(l1),
+            'l2': float(l2),
+            'offset_x': float(offset_x),
+            'offset_y': float(offset_y),
+            'motor_offsets': [int(v) for v in motor_offsets],
+            'motor_min': [int(v) for v in motor_min],
+            'motor_max': [int(v) for v in motor_max],
+            'paper': [float(PAPER_WIDTH), float(PAPER_HEIGHT)],
+            'max_spread': MAX_CORNER_SPREAD,
+            'max_error': MAX_CENTRE_ERROR,
+            'format': GRID_FORMAT,
+        }
+
+    @staticmethod
+    def params_hash(params):
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def build(cls, params):
+        res = params['resolution']
+        margin = params['margin']
+        xs = np.arange(-margin, PAPER_WIDTH + margin + res, res)
+        ys = np.arange(-margin, PAPER_HEIGHT + margin + res, res)
+        z_levels = np.asarray(params['z_levels'], dtype=np.float64)
+
+        px, py = np.meshgrid(xs, ys)
+        rx, ry = paper_to_robot(px, py, params['offset_x'], params['offset_y'])
+        cx, cy = paper_to_robot(px[:-1, :-1] + res / 2, py[:-1, :-1] + res / 2,
+                                params['offset_x'], params['offset_y'])
+
+        raw = np.zeros((len(z_levels), len(ys), len(xs), 3), dtype=np.float64)
+        status = np.zeros((len(z_levels), len(ys), len(xs)), dtype=np.int8)
+        smooth = np.zeros((len(z_levels), len(ys) - 1, len(xs) - 1), dtype=bool)
+        for k, z in enumerate(z_levels):
+            pts = np.column_stack([rx.ravel(), ry.ravel(), np.full(rx.size, z)])
+            r, st = raw_motor_angles(pts, params['l1'], params['l2'], params['motor_offsets'])
+            raw[k] = r.reshape(len(ys), len(xs), 3)
+            status[k] = st.reshape(len(ys), len(xs))
+            centre, centre_st = raw_motor_angles(np.column_stack([cx.ravel(), cy.ravel(), np.full(cx.size, z)]),
+                                                 params['l1'], params['l2'], params['motor_offsets'])
+            smooth[k] = smooth_cells(raw[k], status[k], centre.reshape(cx.shape + (3,)),
+                                     centre_st.reshape(cx.shape), params['motor_min'], params['motor_max'],
+                                     params['max_spread'], params['max_error'])
+        return cls(params, xs, ys, z_levels, raw, status, smooth)
+
+    def save(self, path=GRID_FILE_PATH):
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(tmp_path, xs=self.xs, ys=self.ys, z_levels=self.z_levels,
+                            raw=self.raw, status=self.status, smooth=self.smooth,
+                            params=json.dumps(self.params, sort_keys=True),
+                            params_hash=self.params_hash(self.params))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, path=GRID_FILE_PATH, **kwargs):
+        """
+        kwargs: make_params() arguments, normally settings.ik_params().
+        Loads the cached grid; rebuilds it when link lengths / offsets / resolution changed.
+        """
+        params = cls.make_params(**kwargs)
+        wanted = cls.params_hash(params)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if str(data['params_hash']) == wanted:
+                        return cls(params, data['xs'], data['ys'], data['z_levels'],
+                                   data['raw'], data['status'], data['smooth'])
+            except (OSError, KeyError, ValueError) as e:
+                print(f"[IKGrid] cache unreadable, rebuilding: {e}")
+
+        grid = cls.build(params)
+        try:
+            grid.save(path)
+        except OSError as e:
+            print(f"[IKGrid] cache not saved: {e}")
+        return grid
+
+    # --- lookup ---
+    def _z_index(self, z):
+        hits = np.flatnonzero(np.abs(self.z_levels - z) < 1e-6)
+        return int(hits[0]) if len(hits) else None
+
+    def _cell(self, robot_x, robot_y):
+        px, py = robot_to_paper(np.asarray(robot_x, dtype=np.float64),
+                                np.asarray(robot_y, dtype=np.float64),
+                                self.params['offset_x'], self.params['offset_y'])
+        fx = (px - self.xs[0]) / self.resolution
+        fy = (py - self.ys[0]) / self.resolution
+        inside = (fx >= 0) & (fy >= 0) & (fx <= len(self.xs) - 1) & (fy <= len(self.ys) - 1)
+        i0 = np.clip(np.floor(fx).astype(np.int64), 0, len(self.xs) - 2)
+        j0 = np.clip(np.floor(fy).astype(np.int64), 0, len(self.ys) - 2)
+        return fx - i0, fy - j0, i0, j0, inside
+
+    def is_reachable(self, robot_x, robot_y, z, strict=True):
+        """
+        strict=True : the surrounding cell is safe to interpolate (smooth_cells)
+        strict=False: at least one node reachable (worth an exact IK solve)
+        Accepts scalars or arrays. z must be one of the grid levels.
+        """
+        k = self._z_index(z)
+        if k is None:
+            raise ValueError(f"z={z} is not a grid level {self.z_levels.tolist()}")
+        _, _, i0, j0, inside = self._cell(robot_x, robot_y)
+        if strict:
+            return self.smooth[k][j0, i0] & inside
+        ok = self.status[k] == ik_batch.IK_OK
+        hit = ok[j0, i0] | ok[j0, i0 + 1] | ok[j0 + 1, i0] | ok[j0 + 1, i0 + 1]
+        return hit & inside
+
+    def motor_angles(self, robot_x, robot_y, z):
+        """
+        Bilinear interpolation of the unclamped angles, then the same
+        truncation and clamp as calculate_motor_angles.
+        Returns ((..., 3) int motor angles, strict reachable mask); rows
+        outside the mask are not meaningful.
+        """
+        k = self._z_index(z)
+        if k is None:
+            raise ValueError(f"z={z} is not a grid level {self.z_levels.tolist()}")
+        tx, ty, i0, j0, _ = self._cell(robot_x, robot_y)
+        m = self.raw[k]
+        tx = np.asarray(tx)[..., None]
+        ty = np.asarray(ty)[..., None]
+        top = m[j0, i0] * (1 - tx) + m[j0, i0 + 1] * tx
+        bottom = m[j0 + 1, i0] * (1 - tx) + m[j0 + 1, i0 + 1] * tx
+        motor = np.trunc(top * (1 - ty) + bottom * ty)
+        motor = np.clip(np.nan_to_num(motor), self.params['motor_min'], self.params['motor_max'])
+        return motor.astype(np.int32), self.is_reachable(robot_x, robot_y, z)
+
+    def solve_motor_angles(self, points):
+        """
+        Drop-in for ik_batch.solve_motor_angles.
+        Rows on a grid z level in a smooth cell are read from the table,
+        rows whose cell is fully unreachable are rejected without solving,
+        everything else (reach edge, motor limits, base wrap, other z) is solved exactly.
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        motor = np.zeros((len(pts), 3), dtype=np.int32)
+        codes = np.full(len(pts), ik_batch.IK_OUT_OF_RANGE, dtype=np.int8)
+        exact = np.ones(len(pts), dtype=bool)
+
+        for z in np.unique(pts[:, 2]):
+            k = self._z_index(z)
+            if k is None:
+                continue
+            rows = np.flatnonzero(pts[:, 2] == z)
+            rx, ry = pts[rows, 0], pts[rows, 1]
+            m, full = self.motor_angles(rx, ry, z)
+            _, _, i0, j0, inside = self._cell(rx, ry)
+            reject = inside & ~self.is_reachable(rx, ry, z, strict=False)
+
+            motor[rows[full]] = m[full]
+            codes[rows[full]] = ik_batch.IK_OK
+            codes[rows[reject]] = self.status[k][j0[reject], i0[reject]]
+            exact[rows[full | reject]] = False
+
+        if exact.any():
+            params = self.params
+            motor[exact], codes[exact] = ik_batch.solve_motor_angles(
+                pts[exact], params['l1'], params['l2'], params['motor_offsets'],
+                params['motor_min'], params['motor_max'])
+        return motor, codes
@@ -0,0 +1,284 @@
+'''Hot-path instrumentation: span timers, counters and histograms, exported as Prometheus text or JSONL
+
+Disabled by default; every call then returns after one attribute check, so
+the hooks can stay in the frame / detection / serial paths:
+
+    from metrics import metrics
+    with metrics.span('detect_seconds'):
+        ...
+    metrics.count('ik_results_total', status='ok')
+
+    metrics.enable()
+    PrometheusExporter(metrics, port=9100).start()     # http://127.0.0.1:9100/metrics
+    JsonlExporter(metrics, 'metrics.jsonl').start()    # one snapshot line per interval
+'''
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Seconds; covers a 0.1 ms LUT pass up to a multi-second pick cycle
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+JSONL_INTERVAL = 10.0            # s between snapshot lines
+JSONL_MAX_BYTES = 5 * 1024 * 1024
+JSONL_BACKUPS = 3
+
+
+class _NoSpan:
+    """ Shared do-nothing context manager returned while disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)     # last one: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bucket bound containing quantile q (Prometheus-style estimate). """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """ Process-wide registry. Series are (name, sorted label pairs). """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.kinds = {}         # name -> 'counter' / 'gauge' / 'histogram'
+
+    def enable(self, on=True):
+        self.enabled = on
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+            self.kinds.clear()
+
+    def _claim(self, name, kind):
+        """ Caller holds the lock. A name is one metric type, as Prometheus requires. """
+        known = self.kinds.setdefault(name, kind)
+        if known != kind:
+            raise ValueError(f"metric '{name}' is already a {known}, not a {kind}")
+
+    # --- recording ---
+    def span(self, name, **labels):
+        """ Times the with-block into histogram name (seconds). """
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, labels)
+
+    def count(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._claim(name, 'counter')
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._claim(name, 'histogram')
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    def gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._claim(name, 'gauge')
+            self.gauges[_key(name, labels)] = value
+
+    # --- export ---
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                    typed.add(name)
+                lines.append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, n in zip(hist.bounds + (float('inf'),), hist.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_label_text(labels)} {hist.count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """ JSON-friendly dict: counters, gauges and histogram count/sum/p50/p95/p99. """
+        def series(name, labels):
+            return name + _label_text(labels)
+
+        with self._lock:
+            return {
+                'time': time.time(),
+                'counters': {series(*k): v for k, v in self.counters.items()},
+                'gauges': {series(*k): v for k, v in self.gauges.items()},
+                'histograms': {series(*k): {'count': h.count, 'sum': h.sum, 'p50': h.quantile(0.5),
+                                            'p95': h.quantile(0.95), 'p99': h.quantile(0.99)}
+                               for k, h in self.histograms.items()},
+            }
+
+
+class PrometheusExporter:
+    """
+    GET /metrics (text exposition format 0.0.4). Listens on localhost only
+    unless another host (e.g. '0.0.0.0' for a scraper on another machine) is given.
+    """
+
+    def __init__(self, registry, port=9100, host='127.0.0.1'):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonlExporter:
+    """
+    Appends registry.snapshot() every interval seconds; the file is rotated
+    to path.1 .. path.N when it grows past max_bytes.
+    """
+
+    def __init__(self, registry, path, interval=JSONL_INTERVAL,
+                 max_bytes=JSONL_MAX_BYTES, backups=JSONL_BACKUPS):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def write(self):
+        line = json.dumps(self.registry.snapshot(), ensure_ascii=False) + '\n'
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self.write()     # final snapshot
+
+
+metrics = Metrics()
@@ -0,0 +1,97 @@
+'''Multi-object pick ordering by joint-space travel time'''
+import cv2
+import numpy as np
+
+import trajectory
+
+
+# --- Recheck settings ---
+PATCH_RADIUS = 12        # px around each remaining target compared between frames
+PATCH_THRESHOLD = 25.0   # mean abs grey difference that counts as "changed"
+
+
+def travel_time(a, b, max_vel, max_acc):
+    """
+    Synchronised joint move time between motor poses; broadcasts over leading axes.
+    max_vel / max_acc: motion.max_vel / max_acc of settings.json (the claw entry is ignored).
+    """
+    delta = np.abs(np.asarray(b, dtype=np.float64) - np.asarray(a, dtype=np.float64))
+    n = delta.shape[-1]
+    return np.max(trajectory.trapezoid_time(delta, np.asarray(max_vel)[:n], np.asarray(max_acc)[:n]), axis=-1)
+
+
+def sequence_cost(order, start, trans, finish):
+    if not order:
+        return 0.0
+    cost = start[order[0]] + finish[order[-1]]
+    for i, j in zip(order[:-1], order[1:]):
+        cost += trans[i, j]
+    return float(cost)
+
+
+def plan_pick_order(poses, drops, home, max_vel, max_acc):
+    """
+    poses: (N, 3) motor angles of each object, drops: (N, 3) drop zone of its colour,
+    max_vel / max_acc: joint limits of the trajectory planner (settings.json).
+    A pick goes home/previous drop -> object -> its drop zone, and the last
+    one returns home. Nearest-neighbour tour improved with 2-opt and single
+    pick relocation on the asymmetric cost (fine for trays of a few dozen pieces).
+    Returns (order, estimated travel seconds).
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+    drops = np.asarray(drops, dtype=np.float64).reshape(-1, 3)
+    n = len(poses)
+    if n == 0:
+        return [], 0.0
+
+    limits = (max_vel, max_acc)
+    carry = travel_time(poses, drops, *limits)                       # object -> own drop zone
+    start = travel_time(home, poses, *limits) + carry                # home -> j -> drop_j
+    trans = travel_time(drops[:, None, :], poses[None, :, :], *limits) + carry[None, :]
+    finish = travel_time(drops, home, *limits)                       # drop_i -> home
+
+    # Nearest neighbour
+    order = [int(np.argmin(start))]
+    left = set(range(n)) - {order[0]}
+    while left:
+        i = order[-1]
+        j = min(left, key=lambda k: trans[i, k])
+        order.append(j)
+        left.remove(j)
+
+    # 2-opt (segment reversal) + relocation of single picks
+    best = sequence_cost(order, start, trans, finish)
+    improved = True
+    while improved:
+        improved = False
+        for a in range(n - 1):
+            for b in range(a + 1, n):
+                reversed_ = order[:a] + order[a:b + 1][::-1] + order[b + 1:]
+                rest = order[:a] + order[a + 1:]
+                for candidate in (reversed_, rest[:b] + [order[a]] + rest[b:],
+                                  order[:a] + [order[b]] + order[a:b] + order[b + 1:]):
+                    cost = sequence_cost(candidate, start, trans, finish)
+                    if cost < best - 1e-9:
+                        order, best = candidate, cost
+                        improved = True
+    return order, best
+
+
+def targets_unchanged(ref_image, image, centers, radius=PATCH_RADIUS, threshold=PATCH_THRESHOLD):
+    """
+    Cheap recheck after a pick: compares small grey patches around the
+    remaining targets between the planning frame and a new frame.
+    False as soon as one target moved, vanished or got covered.
+    """
+    if ref_image is None or image is None or ref_image.shape != image.shape:
+        return False
+    ref_grey = cv2.cvtColor(ref_image, cv2.COLOR_BGR2GRAY)
+    grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = grey.shape
+    for cx, cy in centers:
+        x0, x1 = max(0, cx - radius), min(w, cx + radius + 1)
+        y0, y1 = max(0, cy - radius), min(h, cy + radius + 1)
+        diff = cv2.absdiff(ref_grey[y0:y1, x0:x1], grey[y0:y1, x0:x1])
+        if diff.size and float(diff.mean()) > threshold:
+            return False
+    return True
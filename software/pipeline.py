@@ -0,0 +1,72 @@
+'''Small helpers for running capture / detection / motion as concurrent stages'''
+import queue
+import threading
+import time
+
+
+def put_latest(q, item):
+    """ Puts item into a bounded queue, dropping the oldest entry when full. """
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class Stage(threading.Thread):
+    """
+    Calls step() in a loop until stop_event is set.
+    Exceptions are printed and the loop keeps going after a short pause,
+    same as the main loops of the control scripts.
+    """
+
+    def __init__(self, name, step, stop_event, error_delay=1.0):
+        super().__init__(name=name, daemon=True)
+        self.step = step
+        self.stop_event = stop_event
+        self.error_delay = error_delay
+        self.iterations = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.step()
+                self.iterations += 1
+            except Exception as e:
+                print(f"[{self.name}] error: {e}")
+                self.stop_event.wait(self.error_delay)
+
+
+class SceneGate:
+    """
+    Tells the detection stage which frames show a settled scene.
+    The motion stage closes the gate when it starts a pick (arm over the sheet,
+    object in the gripper) and reopens it once the object has been released.
+    Frames captured before the last reopen are stale.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._valid_after = 0.0
+
+    def close(self):
+        with self._cond:
+            self._valid_after = float('inf')
+
+    def open(self, stamp=None):
+        with self._cond:
+            self._valid_after = time.time() if stamp is None else stamp
+            self._cond.notify_all()
+
+    def accepts(self, stamp):
+        with self._cond:
+            return stamp >= self._valid_after
+
+    def wait_open(self, timeout=None):
+        """ Blocks while a pick is in progress (replays pause their capture meanwhile). """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._valid_after != float('inf'), timeout)
@@ -0,0 +1,121 @@
+'''Precomputed pixel -> robot-mm remap table built once from the homography'''
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+
+# --- Workspace (real_pts in a_calibrate_homography.py, mm) ---
+# The robot offsets of the sheet are workspace.offset_x / offset_y in settings.json
+PAPER_WIDTH = 388
+PAPER_HEIGHT = 297
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'remap_cache')
+
+
+def matrix_key(matrix, width, height, *extra):
+    h = hashlib.sha1(np.ascontiguousarray(matrix, dtype=np.float64).tobytes())
+    h.update(repr((int(width), int(height)) + tuple(float(v) for v in extra)).encode())
+    return h.hexdigest()[:16]
+
+
+def _apply_homography(matrix, xs, ys):
+    """ Vectorized cv2.perspectiveTransform over coordinate arrays. """
+    m = np.asarray(matrix, dtype=np.float64)
+    w = m[2, 0] * xs + m[2, 1] * ys + m[2, 2]
+    out_x = (m[0, 0] * xs + m[0, 1] * ys + m[0, 2]) / w
+    out_y = (m[1, 0] * xs + m[1, 1] * ys + m[1, 2]) / w
+    return out_x, out_y
+
+
+def _open_cached(path, shape, fill):
+    """ Memory-maps a cached .npy table, building it with fill(array) on a miss. """
+    if os.path.exists(path):
+        try:
+            table = np.load(path, mmap_mode='r')
+            if table.shape == shape and table.dtype == np.float32:
+                return table
+        except (OSError, ValueError) as e:
+            print(f"[PixelRemap] cache unreadable, rebuilding: {e}")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=shape)
+    fill(table)
+    table.flush()
+    del table
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+class PixelRemap:
+    """
+    robot_xy[v, u] : (robot_x, robot_y) in mm for camera pixel (u, v)
+    top-down maps  : camera pixel sampled by every cell of a paper-plane image
+    """
+
+    def __init__(self, matrix, width, height, offset_x, offset_y, px_per_mm=1.0, cache_dir=CACHE_DIR):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.width = int(width)
+        self.height = int(height)
+        self.offset_x = float(offset_x)
+        self.offset_y = float(offset_y)
+        self.px_per_mm = float(px_per_mm)
+
+        key = matrix_key(self.matrix, self.width, self.height, self.offset_x, self.offset_y)
+        self.robot_xy = _open_cached(os.path.join(cache_dir, f"robot_{key}.npy"),
+                                     (self.height, self.width, 2), self._fill_robot_xy)
+
+        self.topdown_size = (int(round(PAPER_WIDTH * self.px_per_mm)),
+                             int(round(PAPER_HEIGHT * self.px_per_mm)))
+        td_key = matrix_key(self.matrix, self.width, self.height, self.px_per_mm)
+        topdown = _open_cached(os.path.join(cache_dir, f"topdown_{td_key}.npy"),
+                               (self.topdown_size[1], self.topdown_size[0], 2), self._fill_topdown)
+        # Fixed-point maps make cv2.remap noticeably cheaper than float maps
+        self._map1, self._map2 = cv2.convertMaps(np.asarray(topdown), None, cv2.CV_16SC2)
+
+    def _fill_robot_xy(self, table):
+        us = np.arange(self.width, dtype=np.float64)
+        # Row by row keeps the temporary arrays small at high resolutions
+        for v in range(self.height):
+            paper_x, paper_y = _apply_homography(self.matrix, us, np.full_like(us, v))
+            table[v, :, 0] = paper_x + self.offset_x
+            table[v, :, 1] = -(paper_y + self.offset_y)
+
+    def _fill_topdown(self, table):
+        inv = np.linalg.inv(self.matrix)
+        out_w, out_h = self.topdown_size
+        paper_x = np.arange(out_w, dtype=np.float64) / self.px_per_mm
+        for row in range(out_h):
+            paper_y = np.full_like(paper_x, row / self.px_per_mm)
+            src_x, src_y = _apply_homography(inv, paper_x, paper_y)
+            table[row, :, 0] = src_x
+            table[row, :, 1] = src_y
+
+    # --- lookup ---
+    def to_robot(self, us, vs):
+        """ Gathers robot (x, y) mm for integer pixel arrays. Returns (N, 2) float32. """
+        us = np.clip(np.asarray(us, dtype=np.intp), 0, self.width - 1)
+        vs = np.clip(np.asarray(vs, dtype=np.intp), 0, self.height - 1)
+        return np.asarray(self.robot_xy[vs, us])
+
+    def warp_topdown(self, image, interpolation=cv2.INTER_NEAREST):
+        """ Paper-plane view (1 px = 1/px_per_mm mm) without warpPerspective. """
+        return cv2.remap(image, self._map1, self._map2, interpolation,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+_remaps = {}
+
+
+def get_remap(matrix, shape, offset_x, offset_y, px_per_mm=1.0):
+    """ One PixelRemap per (matrix, frame size, offsets, px_per_mm) for the life of the process. """
+    height, width = shape[:2]
+    key = matrix_key(matrix, width, height, offset_x, offset_y, px_per_mm)
+    remap = _remaps.get(key)
+    if remap is None:
+        remap = PixelRemap(matrix, width, height, offset_x, offset_y, px_per_mm)
+        _remaps[key] = remap
+    return remap
@@ -0,0 +1,268 @@
+'''Session recordings (camera frames + serial commands) and a replay frame source'''
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from frame_source import JpegFrame, decode_jpeg
+
+
+# --- File layout ---
+# MAGIC, then append-only records: [type u8][stamp f64][length u32][payload].
+# close() appends an index record (offsets of every record) and a footer that
+# points to it; a file without footer (crash) is indexed by scanning.
+MAGIC = b'VRAREC1\n'
+FOOTER_MAGIC = b'VRAIDX1\n'
+
+REC_FRAME = 1      # payload: JPEG bytes
+REC_COMMAND = 2    # payload: COMMAND_STRUCT
+REC_META = 3       # payload: UTF-8 JSON object
+REC_INDEX = 4      # payload: INDEX_DTYPE array
+
+RECORD_HEADER = struct.Struct('<BdI')
+COMMAND_STRUCT = struct.Struct('<4hH')     # base, shoulder, elbow, claw, hold_ms
+FOOTER = struct.Struct('<8sQ')             # FOOTER_MAGIC, offset of the index record
+
+INDEX_DTYPE = np.dtype([('type', np.uint8), ('stamp', np.float64),
+                        ('offset', np.uint64), ('length', np.uint32)])
+
+
+class Recorder:
+    """
+    Thread-safe writer: the frame reader and the serial sender append from
+    different threads. Payload offsets are kept in memory for the index.
+    """
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._index = []
+        self.frames = 0
+        self.commands = 0
+        if meta:
+            self.add_meta(meta)
+
+    def _append(self, kind, payload, stamp=None):
+        stamp = time.time() if stamp is None else stamp
+        with self._lock:
+            if self._file is None:
+                return
+            offset = self._file.tell() + RECORD_HEADER.size
+            self._file.write(RECORD_HEADER.pack(kind, stamp, len(payload)))
+            self._file.write(payload)
+            self._index.append((kind, stamp, offset, len(payload)))
+            # Counted under the lock: frames and commands arrive from different threads
+            if kind == REC_FRAME:
+                self.frames += 1
+            elif kind == REC_COMMAND:
+                self.commands += 1
+
+    def add_frame(self, jpeg, stamp=None):
+        self._append(REC_FRAME, bytes(jpeg), stamp)
+
+    def add_command(self, angles, hold_ms=0, stamp=None):
+        self._append(REC_COMMAND, COMMAND_STRUCT.pack(*(int(a) for a in angles), int(hold_ms)), stamp)
+
+    def add_meta(self, meta, stamp=None):
+        self._append(REC_META, json.dumps(meta).encode(), stamp)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            index = np.array(self._index, dtype=INDEX_DTYPE)
+            index_offset = self._file.tell()
+            self._file.write(RECORD_HEADER.pack(REC_INDEX, time.time(), index.nbytes))
+            self._file.write(index.tobytes())
+            self._file.write(FOOTER.pack(FOOTER_MAGIC, index_offset))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """ Read side: index of every record, JPEGs are read on demand. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a recording")
+            self.index = self._read_index(f)
+
+        self.frames = self.index[self.index['type'] == REC_FRAME]
+        self.meta = {}
+        self._commands = self.index[self.index['type'] == REC_COMMAND]
+        with open(path, 'rb') as f:
+            for entry in self.index[self.index['type'] == REC_META]:
+                f.seek(int(entry['offset']))
+                self.meta.update(json.loads(f.read(int(entry['length']))))
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_index(f):
+        size = f.seek(0, os.SEEK_END)
+        if size >= len(MAGIC) + FOOTER.size:
+            f.seek(size - FOOTER.size)
+            magic, index_offset = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == FOOTER_MAGIC:
+                f.seek(index_offset)
+                kind, _, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                if kind == REC_INDEX:
+                    return np.frombuffer(f.read(length), dtype=INDEX_DTYPE)
+
+        # No footer (recording was not closed): scan the records
+        entries = []
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            f.seek(offset)
+            kind, stamp, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            payload_offset = offset + RECORD_HEADER.size
+            if payload_offset + length > size:
+                break      # truncated last record
+            if kind != REC_INDEX:
+                entries.append((kind, stamp, payload_offset, length))
+            offset = payload_offset + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return float(self.frames['stamp'][-1] - self.frames['stamp'][0]) if len(self.frames) else 0.0
+
+    def read_jpeg(self, i):
+        entry = self.frames[i]
+        with self._lock:
+            self._file.seek(int(entry['offset']))
+            return self._file.read(int(entry['length']))
+
+    def commands(self):
+        """ [(stamp, (b, s, e, c), hold_ms)] in send order. """
+        out = []
+        with self._lock:
+            for entry in self._commands:
+                self._file.seek(int(entry['offset']))
+                *angles, hold_ms = COMMAND_STRUCT.unpack(self._file.read(int(entry['length'])))
+                out.append((float(entry['stamp']), tuple(angles), hold_ms))
+        return out
+
+    def close(self):
+        self._file.close()
+
+
+class ReplaySource:
+    """
+    Same interface as FrameSource, fed from a recording.
+    realtime=False: every read() returns the next recorded frame (as fast as
+    the caller consumes them). realtime=True: frames follow the recorded
+    timing and read() returns the one due now (fresh=True waits for the next).
+    Frames are re-stamped with the current time so SceneGate and the
+    pipeline's timing logic work unchanged; recorded_stamp keeps the original.
+    """
+
+    def __init__(self, path, realtime=False, loop=False, decode=True):
+        self.recording = Recording(path)
+        self.realtime = realtime
+        self.loop = loop
+        self.decode = decode
+        self.recorded_stamp = 0.0
+        self.streaming = False
+        self._lock = threading.Lock()
+        self._pos = -1
+        self._seq = 0
+        self._started_at = None
+        self._jpeg = None
+        self._image = None
+        self._stamp = 0.0
+
+    # --- lifecycle ---
+    def start(self):
+        if self._started_at is None:
+            self._started_at = time.time()
+        return self
+
+    def stop(self):
+        self.recording.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def finished(self):
+        return not self.loop and self._pos >= len(self.recording) - 1
+
+    def _due_index(self):
+        stamps = self.recording.frames['stamp']
+        elapsed = time.time() - self._started_at
+        span = self.recording.duration
+        if self.loop and span > 0:
+            elapsed %= span
+        return max(0, int(np.searchsorted(stamps - stamps[0], elapsed, side='right')) - 1)
+
+    def _load(self, pos):
+        self._pos = pos
+        self._seq += 1
+        self._jpeg = self.recording.read_jpeg(pos)
+        self._image = decode_jpeg(self._jpeg) if self.decode else None
+        self._stamp = time.time()
+        self.recorded_stamp = float(self.recording.frames['stamp'][pos])
+
+    def read(self, fresh=False, timeout=5.0):
+        self.start()
+        count = len(self.recording)
+        if count == 0:
+            return None, 0.0
+
+        with self._lock:
+            if not self.realtime:
+                pos = self._pos + 1
+                if pos >= count:
+                    if not self.loop:
+                        return None, 0.0
+                    pos = 0
+                self._load(pos)
+                return self._image, self._stamp
+
+            deadline = time.time() + timeout
+            while True:
+                pos = self._due_index()
+                if pos != self._pos or (not fresh and self._image is not None):
+                    break
+                if self.finished or time.time() >= deadline:
+                    return None, 0.0
+                time.sleep(0.005)
+            if pos != self._pos:
+                self._load(pos)
+            return self._image, self._stamp
+
+    def read_jpeg(self, fresh=False, timeout=5.0):
+        image, stamp = self.read(fresh=fresh, timeout=timeout)
+        if not stamp:
+            return None, 0.0
+        return self._jpeg, stamp
+
+    def read_frame(self, fresh=False, timeout=5.0):
+        image, stamp = self.read(fresh=fresh, timeout=timeout)
+        if not stamp:
+            return None
+        return JpegFrame(self._jpeg, stamp, image)
@@ -0,0 +1,515 @@
+'''Serial transport for final_arm.ino with acknowledgement tracking'''
+import collections
+import itertools
+import queue
+import threading
+import time
+
+from metrics import metrics
+
+
+# --- Firmware protocol (final_arm.ino) ---
+READY_LINE = 'READY'
+ACK_PREFIX = 'Moved:'
+BINARY_CAPABILITY = 'BIN1'
+SEQ_CAPABILITY = 'SEQ'    # binary acks end in " #<seq>", rejects name the packet
+LAST_SEQ_PREFIX = 'LAST=' # READY ... LAST=<seq>: last seq the board queued, the host continues after it
+SYNC_LINE = 'SYNC'        # asks the firmware to repeat READY (board not reset on port open)
+
+# Binary packet: [0xA5][seq][b][s][e][c][hold_ms][checksum], bytes after the header sum to 0
+PKT_SYNC = 0xA5
+PKT_SIZE = 8
+RING_SIZE = 16            # RING_SIZE in final_arm.ino
+MAX_HOLD_MS = 255         # one byte; longer holds are split into repeated setpoints
+
+# Firmware replies to a binary packet it did not queue
+NAK_LINE = 'NAK'          # bad checksum; "NAK <expected seq>" with SEQ
+FULL_LINE = 'FULL'        # ring buffer full; "FULL <seq>" with SEQ
+DUP_LINE = 'DUP'          # same seq as the previous packet, dropped
+
+# Hardware limits applied by the firmware (constrain() in loop())
+FIRMWARE_LIMITS = ((15, 160), (10, 160), (10, 120), (0, 30))
+
+# --- Transport settings ---
+DEFAULT_WINDOW = 3        # commands in flight (UNO RX buffer is 64 bytes, one command is <= 16)
+ACK_TIMEOUT = 1.0         # s before an unacknowledged command is treated as lost
+NAK_RETRIES = 2           # resends of a packet the firmware rejected with NAK
+READY_TIMEOUT = 2.5       # s to wait for READY after the UNO resets on port open
+SYNC_TIMEOUT = 0.5        # s to wait for READY after SYNC
+RTT_HISTORY = 200
+
+
+def format_command(base, shoulder, elbow, claw):
+    return f"{int(base)},{int(shoulder)},{int(elbow)},{int(claw)}\n"
+
+
+def encode_packet(seq, angles, hold_ms=0):
+    """ Angles are clipped to a byte (the firmware constrains them further); hold_ms must fit one. """
+    hold_ms = int(hold_ms)
+    if not 0 <= hold_ms <= MAX_HOLD_MS:
+        raise ValueError(f"hold_ms {hold_ms} outside 0..{MAX_HOLD_MS}")
+    body = bytes([seq & 0xFF] + [max(0, min(255, int(a))) for a in angles] + [hold_ms])
+    return bytes([PKT_SYNC]) + body + bytes([(-sum(body)) & 0xFF])
+
+
+def decode_packet(packet):
+    """ -> (seq, (b, s, e, c), hold_ms), or None when the header/checksum is wrong """
+    if len(packet) != PKT_SIZE or packet[0] != PKT_SYNC or sum(packet[1:]) & 0xFF:
+        return None
+    return packet[1], tuple(packet[2:6]), packet[6]
+
+
+def parse_ack(line):
+    """
+    'Moved: 89,134,42,30'     -> ((89, 134, 42, 30), None)
+    'Moved: 89,134,42,30 #17' -> ((89, 134, 42, 30), 17)
+    anything else -> None
+    """
+    if not line.startswith(ACK_PREFIX):
+        return None
+    body, _, seq = line[len(ACK_PREFIX):].partition('#')
+    try:
+        values = tuple(int(v) for v in body.split(','))
+        seq = int(seq) if seq.strip() else None
+    except ValueError:
+        return None
+    return (values, seq) if len(values) == 4 else None
+
+
+def parse_reject(line):
+    """ 'NAK 5' -> ('NAK', 5), 'NAK' -> ('NAK', None), anything else -> None """
+    parts = line.split()
+    if not parts or parts[0] not in (NAK_LINE, FULL_LINE, DUP_LINE) or len(parts) > 2:
+        return None
+    try:
+        return parts[0], int(parts[1]) if len(parts) == 2 else None
+    except ValueError:
+        return None
+
+
+class Command:
+    """ One command in flight. wait() blocks until the firmware acknowledged it. """
+
+    __slots__ = ('seq', 'angles', 'hold', 'hold_ms', 'sent_at', 'acked_at', 'ack', 'retries', 'error', '_event')
+
+    def __init__(self, seq, angles, hold=0.0, hold_ms=0):
+        self.seq = seq
+        self.angles = angles
+        self.hold = hold
+        self.hold_ms = hold_ms
+        self.sent_at = time.time()
+        self.acked_at = None
+        self.ack = None
+        self.retries = 0
+        self.error = None       # 'lost', 'NAK', 'FULL' or 'DUP' when it was given up on
+        self._event = threading.Event()
+
+    def _complete(self, ack):
+        self.ack = ack
+        self.acked_at = time.time()
+        self._event.set()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    @property
+    def rtt(self):
+        if self.acked_at is None:
+            return None
+        return self.acked_at - self.sent_at
+
+    def wait(self, timeout=ACK_TIMEOUT):
+        return self._event.wait(timeout)
+
+
+class SerialTransport:
+    """
+    Writes "b,s,e,c" commands and reads the firmware's "Moved: ..." feedback
+    on a background thread. Acks arrive in order, so they are matched FIFO;
+    binary acks carrying a seq are matched by it, and older commands still
+    pending were skipped by the firmware. A packet rejected with NAK is sent
+    again when nothing was queued after it, otherwise (and on FULL) it is
+    failed, as is a packet sent once and answered with DUP. At most `window` commands are in flight; send() blocks when the
+    window is full.
+
+    protocol: 'auto' uses the binary packets when the firmware advertises
+    READY BIN1, 'text' always sends "b,s,e,c\n", 'binary' requires BIN1.
+    In binary mode the window grows to the firmware ring buffer size.
+    """
+
+    is_loopback = False
+    realtime = True     # False: simulated sink, callers skip their settle delays
+
+    def __init__(self, ser, window=DEFAULT_WINDOW, ack_timeout=ACK_TIMEOUT, protocol='auto'):
+        self.ser = ser
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.protocol = protocol
+        self.binary = False
+        self.capabilities = ()
+
+        self.ready = threading.Event()
+        self.rtts = collections.deque(maxlen=RTT_HISTORY)
+        self.sent = 0
+        self.acked = 0
+        self.lost = 0
+        self.paced_time = 0.0   # s slept between text-mode trajectory lines, summed
+        self.recorder = None    # recording.Recorder: logs every command sent
+
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(window)
+        self._seq = 0
+        self._pending_hold = 0.0
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def open(cls, port, baud, **kwargs):
+        """
+        Opens the port and waits for READY instead of a fixed sleep. A board
+        that did not reset (DTR auto-reset off) is asked with SYNC, so the
+        sequence numbers continue after the ones it already has.
+        """
+        import serial
+        ser = serial.Serial(port, baud, timeout=0.1)
+        transport = cls(ser, **kwargs)
+        if not transport.ready.wait(READY_TIMEOUT):
+            ser.write(f"{SYNC_LINE}\n".encode())
+            if not transport.ready.wait(SYNC_TIMEOUT):
+                # Old firmware: continue anyway
+                print(f"[SerialTransport] no {READY_LINE} within {READY_TIMEOUT}s")
+        return transport
+
+    # --- reader thread ---
+    def _read_loop(self):
+        partial = b''
+        while self._running:
+            try:
+                raw = self.ser.readline()
+            except Exception as e:
+                if self._running:
+                    print(f"[SerialTransport] read error: {e}")
+                    time.sleep(0.1)
+                continue
+            if not raw:
+                continue
+            # pyserial returns a partial line when the read timeout hits mid-line
+            partial += raw
+            if not partial.endswith(b'\n'):
+                continue
+            line = partial.decode(errors='replace').strip()
+            partial = b''
+            if line.split()[:1] == [READY_LINE]:
+                self._negotiate(line.split()[1:])
+                continue
+            ack = parse_ack(line)
+            if ack is not None:
+                self._on_ack(*ack)
+                continue
+            reject = parse_reject(line)
+            if reject is not None:
+                self._on_reject(*reject)
+
+    def _negotiate(self, tokens):
+        self.capabilities = tuple(t for t in tokens if not t.startswith(LAST_SEQ_PREFIX))
+        for token in tokens:
+            if token.startswith(LAST_SEQ_PREFIX):
+                with self._lock:
+                    # The board drops its queue on a reset, so only between moves
+                    if not self._pending:
+                        try:
+                            self._seq = int(token[len(LAST_SEQ_PREFIX):])
+                        except ValueError:
+                            pass
+        supported = BINARY_CAPABILITY in self.capabilities
+        if self.protocol == 'binary' and not supported:
+            print("[SerialTransport] firmware has no binary protocol, using text")
+        if self.protocol != 'text' and supported and not self.binary:
+            self.binary = True
+            for _ in range(RING_SIZE - self.window):
+                self._slots.release()
+            self.window = max(self.window, RING_SIZE)
+        self.ready.set()
+
+    def _find(self, seq):
+        """ Pending command whose packet carried seq (caller holds the lock). """
+        for cmd in self._pending:
+            if cmd.seq & 0xFF == seq:
+                return cmd
+        return None
+
+    def _on_ack(self, ack, seq=None):
+        with self._lock:
+            if not self._pending:
+                return
+            if seq is not None:
+                cmd = self._find(seq)
+                if cmd is None:
+                    return
+                # FIFO playback: anything sent before it will never be acknowledged
+                skipped = []
+                while self._pending[0] is not cmd:
+                    skipped.append(self._pending.popleft())
+                    self._pending_hold -= skipped[-1].hold
+            else:
+                skipped = []
+            cmd = self._pending.popleft()
+            self._pending_hold -= cmd.hold
+        for old in skipped:
+            self._give_up(old, 'lost')
+        cmd._complete(ack)
+        self.acked += 1
+        self.rtts.append(cmd.rtt)
+        metrics.observe('serial_rtt_seconds', cmd.rtt)
+        self._slots.release()
+
+    def _on_reject(self, kind, seq):
+        if kind == DUP_LINE:
+            with self._lock:
+                cmd = self._find(seq) if seq is not None else None
+                if cmd is None or cmd.retries:
+                    return      # a resend: the first copy was queued and will be acknowledged
+                # Sent once and still a DUP: the board's last seq is left from an earlier session
+                self._pending.remove(cmd)
+                self._pending_hold -= cmd.hold
+            self._give_up(cmd, kind)
+            return
+        with self._lock:
+            if not self._pending:
+                return
+            # Without SEQ a NAK comes right after the bad packet arrived: the newest one
+            cmd = self._pending[-1] if seq is None else self._find(seq)
+            if cmd is None:
+                return
+            if kind == NAK_LINE and cmd is self._pending[-1] and cmd.retries < NAK_RETRIES:
+                # Nothing queued behind it, so a resend keeps the order
+                cmd.retries += 1
+                self.ser.write(encode_packet(cmd.seq, cmd.angles, cmd.hold_ms))
+                metrics.count('serial_retries_total')
+                return
+            self._pending.remove(cmd)
+            self._pending_hold -= cmd.hold
+        self._give_up(cmd, kind)
+
+    def _give_up(self, cmd, reason):
+        """ cmd will never be acknowledged: wake its waiters and free its slot. """
+        cmd.error = reason
+        self.lost += 1
+        metrics.count('serial_lost_total', reason=reason.lower())
+        print(f"[SerialTransport] command #{cmd.seq} {cmd.angles} {reason}")
+        cmd._event.set()
+        self._slots.release()
+
+    def _drop_oldest(self):
+        """ The oldest command was never acknowledged (garbled line): free its slot. """
+        with self._lock:
+            if not self._pending:
+                return
+            cmd = self._pending.popleft()
+            self._pending_hold -= cmd.hold
+        self._give_up(cmd, 'lost')
+
+    # --- public API ---
+    def send(self, base, shoulder, elbow, claw, wait=False, hold_ms=0):
+        """
+        hold_ms (binary mode only): how long the firmware holds this setpoint
+        before playing the next queued one. Above MAX_HOLD_MS the setpoint is
+        repeated to make up the time; the last copy's Command is returned.
+        """
+        angles = (int(base), int(shoulder), int(elbow), int(claw))
+        hold_ms = int(hold_ms)
+        if hold_ms < 0:
+            raise ValueError(f"hold_ms {hold_ms} < 0")
+        if self.binary:
+            while hold_ms > MAX_HOLD_MS:
+                self.send(*angles, hold_ms=MAX_HOLD_MS)
+                hold_ms -= MAX_HOLD_MS
+        # Queued setpoints ahead of this one delay its ack by their hold times
+        while not self._slots.acquire(timeout=self.ack_timeout + self._pending_hold):
+            self._drop_oldest()
+
+        hold = hold_ms / 1000.0 if self.binary else 0.0
+        with self._lock:
+            self._seq += 1
+            cmd = Command(self._seq, angles, hold, hold_ms)
+            self._pending.append(cmd)
+            self._pending_hold += hold
+            if self.binary:
+                self.ser.write(encode_packet(self._seq, angles, hold_ms))
+            else:
+                self.ser.write(format_command(*angles).encode())
+        self.sent += 1
+        metrics.count('serial_commands_total', protocol='binary' if self.binary else 'text')
+        if self.recorder is not None:
+            self.recorder.add_command(angles, hold_ms)
+
+        if wait:
+            cmd.wait(self.ack_timeout + self._pending_hold)
+        return cmd
+
+    def send_trajectory(self, setpoints, hold_ms):
+        """
+        Streams a list of (b, s, e, c) setpoints. In binary mode they are queued
+        on the UNO and played back every hold_ms; in text mode the host paces them.
+        Returns the last Command (wait on it, or call wait_idle()).
+        """
+        cmd = None
+        for i, angles in enumerate(setpoints):
+            if i and not self.binary and self.realtime:
+                time.sleep(hold_ms / 1000.0)
+                self.paced_time += hold_ms / 1000.0
+            cmd = self.send(*angles, hold_ms=hold_ms)
+        return cmd
+
+    def wait_idle(self, timeout=None):
+        """ Blocks until every command sent so far has been acknowledged (or given up on). """
+        if timeout is None:
+            timeout = self.ack_timeout * max(1, len(self._pending)) + self._pending_hold
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                last = self._pending[-1] if self._pending else None
+            if last is None:
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                while self._pending:
+                    self._drop_oldest()
+                return False
+            last.wait(remaining)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    @property
+    def last_rtt(self):
+        return self.rtts[-1] if self.rtts else None
+
+    @property
+    def mean_rtt(self):
+        return sum(self.rtts) / len(self.rtts) if self.rtts else None
+
+    def close(self):
+        self._running = False
+        self._reader.join(timeout=1.0)
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+
+
+class LoopbackSerial:
+    """
+    In-process stand-in for the UNO: applies the firmware limits and
+    answers every command with the same "Moved: ..." line after `latency` s.
+    With binary=True it advertises BIN1 SEQ LAST=, plays packets back at their
+    hold times, and answers NAK / FULL / DUP / SYNC like the firmware.
+    realtime=False acks everything immediately (hold times ignored).
+    """
+
+    def __init__(self, latency=0.0, binary=True, realtime=True):
+        self.latency = latency
+        self.binary = binary
+        self.realtime = realtime
+        self.angles = (89, 134, 42, 30)
+        self.written = []
+        self._lines = queue.PriorityQueue()     # (due, order, line): rejects overtake queued acks
+        self._order = itertools.count()
+        self._buf = b''
+        self._next_free = 0.0
+        self._queued = collections.deque()     # due times of packets not yet played
+        self._last_seq = 0
+        self._put(0.0, self._ready_line())
+
+    def _ready_line(self):
+        if not self.binary:
+            return READY_LINE
+        return f"{READY_LINE} {BINARY_CAPABILITY} {SEQ_CAPABILITY} {LAST_SEQ_PREFIX}{self._last_seq}"
+
+    def _put(self, due, line):
+        self._lines.put((due, next(self._order), line))
+
+    def _execute(self, values, due, seq=None):
+        self.angles = tuple(max(lo, min(hi, v)) for v, (lo, hi) in zip(values, FIRMWARE_LIMITS))
+        ack = f"{ACK_PREFIX} " + ",".join(str(v) for v in self.angles)
+        if seq is not None:
+            ack += f" #{seq}"
+        self._put(due, ack)
+
+    def write(self, data):
+        self.written.append(data)
+        self._buf += data
+        while self._buf:
+            if self.binary and self._buf[0] == PKT_SYNC:
+                if len(self._buf) < PKT_SIZE:
+                    break
+                packet, self._buf = self._buf[:PKT_SIZE], self._buf[PKT_SIZE:]
+                decoded = decode_packet(packet)
+                now = time.time()
+                if decoded is None:
+                    self._put(now, f"{NAK_LINE} {(self._last_seq + 1) & 0xFF}")
+                    continue
+                seq, values, hold_ms = decoded
+                if seq == self._last_seq:
+                    self._put(now, f"{DUP_LINE} {seq}")
+                    continue
+                while self._queued and self._queued[0] <= now:
+                    self._queued.popleft()
+                if len(self._queued) >= RING_SIZE:
+                    self._put(now, f"{FULL_LINE} {seq}")
+                    continue
+                self._last_seq = seq
+                due = max(now + self.latency, self._next_free)
+                if self.realtime:
+                    self._next_free = due + hold_ms / 1000.0
+                    self._queued.append(due)
+                self._execute(values, due, seq)
+                continue
+
+            if b'\n' not in self._buf:
+                break
+            line, self._buf = self._buf.split(b'\n', 1)
+            if line.strip() == SYNC_LINE.encode():
+                self._put(time.time(), self._ready_line())
+                continue
+            parts = line.decode(errors='replace').split(',')
+            if len(parts) != 4:
+                continue
+            try:
+                values = [int(v) for v in parts]
+            except ValueError:
+                continue
+            self._execute(values, time.time() + self.latency)
+        return len(data)
+
+    def readline(self):
+        try:
+            due, _, line = self._lines.get(timeout=0.1)
+        except queue.Empty:
+            return b''
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return (line + '\r\n').encode()
+
+    def close(self):
+        pass
+
+
+class LoopbackTransport(SerialTransport):
+    """
+    Virtual mode: same API and ack flow as SerialTransport, no hardware.
+    realtime=False is the simulated sink for replays: instant acks and no
+    host-side pacing, so a recorded session runs as fast as the CPU allows.
+    """
+
+    is_loopback = True
+
+    def __init__(self, latency=0.0, binary=True, realtime=True, **kwargs):
+        self.realtime = realtime
+        super().__init__(LoopbackSerial(latency, binary, realtime), **kwargs)
+        self.ready.wait(1.0)
@@ -0,0 +1,191 @@
+'''One versioned settings file (settings.json) for every script, watched and reloaded while running
+
+settings.json holds the values the control scripts used to copy between
+them: link lengths, motor offsets and limits, robot offsets, drop zones,
+motion gains, detection options and the serial port. Its "files" section
+names the colour classes (a_hsv_tuner.py) and the homography
+(a_calibrate_homography.py), which are watched together with it.
+
+    from settings import SettingsStore, load_settings
+    s = load_settings()                  # one snapshot, no watching
+    store = SettingsStore().start()      # background watcher
+    s = store.current                    # newest snapshot; no file access
+'''
+import json
+import os
+import threading
+
+import numpy as np
+
+from color_registry import ColorRegistry
+
+
+SETTINGS_VERSION = 1
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE_PATH = os.path.join(BASE_DIR, 'settings.json')
+
+WATCH_INTERVAL = 1.0       # s between mtime checks
+SECTIONS = ('robot', 'workspace', 'drop_zones', 'motion', 'detection', 'serial', 'files')
+
+
+class Settings:
+    """
+    One parsed settings.json plus the colour table and homography it names.
+    A snapshot: never modified after loading, a reload builds a new one.
+    """
+
+    def __init__(self, data, base_dir=BASE_DIR):
+        version = data.get('version')
+        if version != SETTINGS_VERSION:
+            raise ValueError(f"settings version {version}, expected {SETTINGS_VERSION}")
+        self.data = data
+
+        robot = data['robot']
+        self.l1 = float(robot['l1'])
+        self.l2 = float(robot['l2'])
+        self.motor_offsets = tuple(int(v) for v in robot['motor_offsets'])
+        self.motor_min = tuple(int(v) for v in robot['motor_min'])
+        self.motor_max = tuple(int(v) for v in robot['motor_max'])
+        self.home = tuple(int(v) for v in robot['home'])
+
+        workspace = data['workspace']
+        self.offset_x = float(workspace['offset_x'])
+        self.offset_y = float(workspace['offset_y'])
+        self.catch_z = float(workspace['catch_z'])
+
+        # keyed by colour class name (colors.json)
+        self.drop_zones = {name: tuple(int(a) for a in angles) for name, angles in data['drop_zones'].items()}
+
+        motion = data['motion']
+        self.profile = motion['profile']
+        self.kp = float(motion['kp'])
+        self.max_speed = float(motion['max_speed'])
+        self.dt = float(motion['dt'])
+        self.max_vel = tuple(float(v) for v in motion['max_vel'])     # deg/s per joint (trapezoid)
+        self.max_acc = tuple(float(v) for v in motion['max_acc'])     # deg/s^2 per joint
+        self.threshold = float(motion['threshold'])
+        self.path_tolerance = float(motion['path_tolerance'])
+        self.linear_step_deg = float(motion['linear_step_deg'])
+        self.linear_step_delay = float(motion['linear_step_delay'])
+
+        detection = data['detection']
+        self.detect_roi = bool(detection['roi'])
+        self.pyramid_levels = int(detection['pyramid_levels'])
+        self.decode_scale = int(detection['decode_scale'])
+
+        serial = data['serial']
+        self.serial_port = serial['port']
+        self.baud = int(serial['baud'])
+        self.protocol = serial['protocol']
+
+        files = data['files']
+        self.colors_path = os.path.join(base_dir, files['colors'])
+        self.homography_path = os.path.join(base_dir, files['homography'])
+        self.colors = ColorRegistry.load(self.colors_path)
+        with open(self.homography_path, 'r') as f:
+            self.homography = np.array(json.load(f), dtype=np.float64)
+
+    @classmethod
+    def load(cls, path=SETTINGS_FILE_PATH):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data, os.path.dirname(os.path.abspath(path)))
+
+    @property
+    def files(self):
+        return self.colors_path, self.homography_path
+
+    def ik_params(self):
+        """ IKGrid.load_or_build() arguments; the grid only needs rebuilding when these change. """
+        return {'l1': self.l1, 'l2': self.l2, 'z_levels': (self.catch_z,),
+                'offset_x': self.offset_x, 'offset_y': self.offset_y,
+                'motor_offsets': self.motor_offsets, 'motor_min': self.motor_min,
+                'motor_max': self.motor_max}
+
+    def changed(self, other):
+        """ Names of the sections (and 'colors' / 'homography') that differ from other. """
+        names = [name for name in SECTIONS if self.data.get(name) != other.data.get(name)]
+        if [(c.name, c.to_dict()) for c in self.colors] != [(c.name, c.to_dict()) for c in other.colors]:
+            names.append('colors')
+        if not np.array_equal(self.homography, other.homography):
+            names.append('homography')
+        return names
+
+
+def load_settings(path=SETTINGS_FILE_PATH):
+    return Settings.load(path)
+
+
+def settings_file(name, path=SETTINGS_FILE_PATH):
+    """
+    Path of a file named in the "files" section ('colors' / 'homography')
+    without loading it, for the tools that write it in the first place.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return os.path.join(os.path.dirname(os.path.abspath(path)), data['files'][name])
+
+
+class SettingsStore:
+    """
+    Keeps the newest Settings in .current. A watcher thread stats
+    settings.json and its colour / homography files every interval seconds
+    and swaps in a new snapshot when one of them changed, so readers never
+    touch the files. A file that does not parse (e.g. caught mid-save)
+    leaves the previous snapshot in place until the next change.
+    """
+
+    def __init__(self, path=SETTINGS_FILE_PATH, interval=WATCH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.current = Settings.load(path)
+        self.generation = 0
+        self._stamps = self._stat()
+        self._failed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        stamps = []
+        for path in (self.path,) + self.current.files:
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def check(self):
+        """ Reloads if a watched file changed; True when a new snapshot was published. """
+        stamps = self._stat()
+        if stamps == self._stamps:
+            return False
+        try:
+            new = Settings.load(self.path)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            if stamps != self._failed:
+                print(f"[Settings] reload failed, keeping the previous settings: {e}")
+                self._failed = stamps
+            return False
+
+        changed = new.changed(self.current)
+        self.current = new
+        self.generation += 1
+        self._stamps = self._stat()
+        self._failed = None
+        print(f"[Settings] reloaded ({', '.join(changed) or 'no value changed'})")
+        return True
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
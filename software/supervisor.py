@@ -0,0 +1,231 @@
+'''Runs several arm cells from one host: perception in a process pool, one shared pick scheduler
+
+    python supervisor.py cells.json
+    python supervisor.py cells.json --duration 600 --json throughput.json
+
+cells.json lists every cell's camera URL, serial port, homography, drop
+zones and robot offsets (see cells.example.json). Each cell's camera is read
+and detected in its own worker process; detections come back on one queue
+and the scheduler here tracks objects per cell and hands picks to that
+cell's arm thread.
+'''
+import argparse
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cell import CellArm, Perception, load_cells
+from frame_source import FrameSource
+from pick_scheduler import plan_pick_order
+from tracker import ObjectTracker
+
+
+REPORT_INTERVAL = 10.0     # s between throughput lines
+RESULT_TIMEOUT = 0.5
+
+# --- Worker process side ---
+_results = None
+_stop = None
+
+
+def _init_worker(results, stop):
+    global _results, _stop
+    _results, _stop = results, stop
+
+
+def perception_loop(config):
+    """ One cell's camera -> detections, until the supervisor sets stop. """
+    perception = Perception(config)
+    camera = FrameSource(config.camera_url, decode=config.decode_scale == 1).start()
+    frames = 0
+    try:
+        while not _stop.is_set():
+            frame = camera.read_frame(fresh=True, timeout=2.0)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            objs = perception.detect(frame)
+            _results.put((config.name, frame.stamp, objs, (time.perf_counter() - started) * 1000.0))
+            frames += 1
+    finally:
+        camera.stop()
+    return config.name, frames
+
+
+# --- Scheduler side ---
+class CellState:
+    def __init__(self, config):
+        self.config = config
+        self.arm = CellArm(config)
+        self.tracker = ObjectTracker()
+        self.busy = False
+        self.idle_since = 0.0        # frames older than this were shot while the arm moved
+        self.frames = 0
+        self.detect_ms = 0.0
+        self.picks = 0
+        self.failed = 0
+
+
+def start_cell(config):
+    """ Opens the cell's arm and homes it; frames from before that are ignored. """
+    cell = CellState(config)
+    cell.arm.home(arrival_delay=1.0)
+    cell.idle_since = time.time()
+    return cell
+
+
+class Supervisor:
+    """
+    Single scheduler for all cells. A cell is given its next pick (cheapest
+    first, pick_scheduler) only when its arm is idle and the object has been
+    confirmed on frames taken after the arm stopped moving.
+    """
+
+    def __init__(self, configs):
+        # In parallel: each serial open waits for its Arduino's READY after the reset
+        with ThreadPoolExecutor(max_workers=len(configs)) as pool:
+            self.cells = {cell.config.name: cell for cell in pool.map(start_cell, configs)}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.started = time.time()
+
+    def on_result(self, name, stamp, objs, detect_ms):
+        cell = self.cells[name]
+        with self._lock:
+            cell.frames += 1
+            cell.detect_ms += detect_ms
+            if cell.busy or stamp < cell.idle_since:
+                return
+        cell.tracker.update(objs)
+        cell.failed += len(cell.tracker.pop_failed())
+
+        targets = [t for t in cell.tracker.confirmed()
+                   if t.obj['status'] == "성공" and t.obj['color'] in cell.config.drop_zones]
+        if not targets:
+            return
+        s = cell.config.settings
+        order, _ = plan_pick_order([t.obj['motor_vals'] for t in targets],
+                                   [cell.config.drop_zones[t.color] for t in targets],
+                                   s.home[:3], s.max_vel, s.max_acc)
+        track = targets[order[0]]
+        cell.tracker.picked(track)
+        with self._lock:
+            cell.busy = True
+        thread = threading.Thread(target=self._pick, args=(cell, track), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _pick(self, cell, track):
+        try:
+            done = cell.arm.pick_and_place(track.color, track.robot_coords)
+        except Exception as e:
+            print(f"[{cell.config.name}] pick error: {e}")
+            done = False
+        with self._lock:
+            cell.picks += int(done)
+            cell.busy = False
+            cell.idle_since = time.time()
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        rows = {}
+        with self._lock:
+            for name, cell in self.cells.items():
+                rows[name] = {
+                    'frames': cell.frames,
+                    'fps': cell.frames / elapsed,
+                    'detect_ms': cell.detect_ms / max(cell.frames, 1),
+                    'picks': cell.picks,
+                    'picks_per_min': 60.0 * cell.picks / elapsed,
+                    'failed_picks': cell.failed,
+                    'idle_s': cell.arm.idle_time,
+                }
+        total = {
+            'elapsed_s': elapsed,
+            'cells': len(rows),
+            'frames': sum(r['frames'] for r in rows.values()),
+            'fps': sum(r['fps'] for r in rows.values()),
+            'picks': sum(r['picks'] for r in rows.values()),
+            'picks_per_min': sum(r['picks_per_min'] for r in rows.values()),
+        }
+        return {'cells': rows, 'total': total}
+
+    def close(self):
+        for thread in self._threads:
+            thread.join(timeout=30.0)
+        for cell in self.cells.values():
+            cell.arm.close()
+
+
+def format_report(report):
+    lines = [f"{'cell':<12} {'fps':>6} {'det ms':>7} {'picks':>6} {'pick/min':>8} {'failed':>6}"]
+    for name, r in report['cells'].items():
+        lines.append(f"{name:<12} {r['fps']:>6.1f} {r['detect_ms']:>7.2f} {r['picks']:>6} "
+                     f"{r['picks_per_min']:>8.2f} {r['failed_picks']:>6}")
+    t = report['total']
+    lines.append(f"{'total':<12} {t['fps']:>6.1f} {'':>7} {t['picks']:>6} {t['picks_per_min']:>8.2f}"
+                 f"   ({t['cells']} cells, {t['elapsed_s']:.0f}s)")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config')
+    parser.add_argument('--duration', type=float, default=0.0, help='s to run (0: until Ctrl+C)')
+    parser.add_argument('--json', help='write the final throughput report here')
+    args = parser.parse_args()
+
+    configs = load_cells(args.config)
+
+    # Workers start first (spawn, imports, camera connect) while the arms open and home.
+    # spawn: same behaviour on Windows (COM ports) and Linux
+    ctx = multiprocessing.get_context('spawn')
+    results, stop = ctx.Queue(), ctx.Event()
+    pool = ctx.Pool(len(configs), initializer=_init_worker, initargs=(results, stop))
+    workers = pool.map_async(perception_loop, configs)
+    supervisor = None
+    try:
+        supervisor = Supervisor(configs)
+        print(f"[Supervisor] {len(configs)} cells: {', '.join(c.name for c in configs)}")
+        next_report = time.time() + REPORT_INTERVAL
+        deadline = time.time() + args.duration if args.duration else None
+        while deadline is None or time.time() < deadline:
+            if workers.ready():
+                workers.get()      # re-raises a worker crash
+                break
+            try:
+                supervisor.on_result(*results.get(timeout=RESULT_TIMEOUT))
+            except queue.Empty:
+                pass
+            if time.time() >= next_report:
+                print(format_report(supervisor.report()))
+                next_report += REPORT_INTERVAL
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        pool.close()
+        # Keep draining: a worker cannot exit while its queued results are unsent
+        while not workers.ready():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        pool.join()
+        if supervisor is not None:
+            supervisor.close()
+    if supervisor is None:
+        return
+
+    report = supervisor.report()
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+'''Synthetic camera frames with ground truth: the paper sheet seen through the calibrated homography, with coloured discs
+
+    python synthetic_scene.py --out scenes/ --count 50 --objects 6 --framesize 8
+    (scene_0000.jpg + scene_0000.json with every object in paper, pixel and robot coordinates)
+'''
+import argparse
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+from pixel_remap import PAPER_HEIGHT, PAPER_WIDTH
+from settings import load_settings
+
+
+# --- Scene look (BGR) ---
+BACKGROUND_COLOR = (70, 90, 110)
+PAPER_COLOR = (215, 220, 220)
+OBJECT_COLORS = {
+    "Green": (60, 170, 50),
+    "Black": (25, 25, 25),
+}
+OBJECT_RADIUS_MM = (18.0, 25.0)       # large enough for min_area at VGA
+PAPER_MARGIN_MM = 25.0
+CANVAS_PX_PER_MM = 2.0
+NOISE_SIGMA = 3.0
+
+# --- Lighting variation per scene (make_scene) ---
+GAIN_RANGE = (0.85, 1.15)         # overall brightness
+GRADIENT_RANGE = (0.0, 0.25)      # brightness drop across the frame (lamp on one side)
+TINT_RANGE = 0.06                 # per-channel gain spread (white balance drift)
+NOISE_RANGE = (1.0, 5.0)          # sensor noise sigma
+JPEG_QUALITY = 90
+
+# --- Camera frame sizes (framesize_t in esp_camera) ---
+FRAMESIZES = {
+    5: (320, 240),     # QVGA
+    6: (400, 296),     # CIF
+    7: (480, 320),     # HVGA
+    8: (640, 480),     # VGA
+    9: (800, 600),     # SVGA
+    10: (1024, 768),   # XGA
+    11: (1280, 720),   # HD
+    12: (1280, 1024),  # SXGA
+    13: (1600, 1200),  # UXGA
+}
+CALIBRATION_SIZE = (640, 480)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MATRIX_FILE_PATH = os.path.join(BASE_DIR, 'homography_matrix.json')
+
+
+def scale_homography(matrix, size, calibrated_size=CALIBRATION_SIZE):
+    """ Pixel->paper homography for another frame size of the same camera view. """
+    sx = size[0] / calibrated_size[0]
+    sy = size[1] / calibrated_size[1]
+    return np.asarray(matrix, dtype=np.float64) @ np.diag([1.0 / sx, 1.0 / sy, 1.0])
+
+
+def paper_to_pixel(matrix, points_mm):
+    """ (N, 2) paper mm -> (N, 2) frame pixels (inverse of the calibration homography). """
+    pts = np.asarray(points_mm, dtype=np.float64).reshape(1, -1, 2)
+    return cv2.perspectiveTransform(pts, np.linalg.inv(np.asarray(matrix, dtype=np.float64)))[0]
+
+
+def paper_to_robot(points_mm, offset_x, offset_y):
+    """ Paper mm -> robot (x, y) mm, same convention as PixelRemap. """
+    pts = np.asarray(points_mm, dtype=np.float64).reshape(-1, 2)
+    return np.stack([pts[:, 0] + offset_x, -(pts[:, 1] + offset_y)], axis=1)
+
+
+def workspace_offsets():
+    """ (offset_x, offset_y) of the sheet in settings.json, for the robot mm ground truth. """
+    s = load_settings()
+    return s.offset_x, s.offset_y
+
+
+def load_matrix(path=MATRIX_FILE_PATH):
+    with open(path, 'r') as f:
+        return np.array(json.load(f), dtype=np.float64)
+
+
+def random_objects(rng, count, colors=tuple(OBJECT_COLORS), radius=OBJECT_RADIUS_MM,
+                   margin=PAPER_MARGIN_MM, min_gap=10.0, max_tries=200):
+    """ [(color name, x_mm, y_mm, radius_mm)] on the sheet, not touching each other. """
+    objects = []
+    for _ in range(max_tries):
+        if len(objects) == count:
+            break
+        r = rng.uniform(*radius)
+        x = rng.uniform(margin + r, PAPER_WIDTH - margin - r)
+        y = rng.uniform(margin + r, PAPER_HEIGHT - margin - r)
+        if all(np.hypot(x - ox, y - oy) > r + orad + min_gap for _, ox, oy, orad in objects):
+            objects.append((colors[int(rng.integers(len(colors)))], x, y, r))
+    return objects
+
+
+def render_scene(matrix, size, objects, rng=None, noise=NOISE_SIGMA, px_per_mm=CANVAS_PX_PER_MM):
+    """
+    matrix: pixel->paper homography for this frame size, size: (width, height).
+    Objects are drawn top-down on a paper canvas and warped into the camera
+    view, so they get the same perspective as real ones.
+    """
+    width, height = size
+    canvas = np.empty((int(PAPER_HEIGHT * px_per_mm), int(PAPER_WIDTH * px_per_mm), 3), dtype=np.uint8)
+    canvas[:] = PAPER_COLOR
+    for name, x, y, r in objects:
+        cv2.circle(canvas, (int(round(x * px_per_mm)), int(round(y * px_per_mm))),
+                   int(round(r * px_per_mm)), OBJECT_COLORS.get(name, (0, 0, 255)), -1, cv2.LINE_AA)
+
+    # canvas px -> paper mm -> frame px
+    canvas_to_frame = np.linalg.inv(np.asarray(matrix, dtype=np.float64)) @ np.diag(
+        [1.0 / px_per_mm, 1.0 / px_per_mm, 1.0])
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = BACKGROUND_COLOR
+    cv2.warpPerspective(canvas, canvas_to_frame, (width, height), dst=frame,
+                        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_TRANSPARENT)
+
+    if noise and rng is not None:
+        grain = rng.normal(0.0, noise, frame.shape)
+        frame = np.clip(frame + grain, 0, 255).astype(np.uint8)
+    return frame
+
+
+def apply_lighting(frame, rng, gain=1.0, gradient=0.0, angle=0.0, tint=(1.0, 1.0, 1.0), noise=0.0):
+    """ Brightness gain, a linear falloff across the frame in direction angle, channel tint and noise. """
+    height, width = frame.shape[:2]
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    along = (np.cos(angle) * (xs / width - 0.5) + np.sin(angle) * (ys / height - 0.5)) + 0.5
+    shade = gain * (1.0 - gradient * np.clip(along, 0.0, 1.0))
+    out = frame.astype(np.float32) * shade[..., None] * np.asarray(tint, dtype=np.float32)
+    if noise:
+        out += rng.normal(0.0, noise, frame.shape).astype(np.float32)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def make_scene(rng, matrix, size, count, colors=tuple(OBJECT_COLORS), offsets=None):
+    """
+    One labelled scene at frame size (width, height); matrix is the
+    calibration homography (scaled here). Returns (image, truth) where truth
+    lists every object with paper mm, frame pixel and robot mm centres
+    (offsets: robot offsets of the sheet, default workspace_offsets()).
+    """
+    scaled = scale_homography(matrix, size)
+    objects = random_objects(rng, count, colors)
+    lighting = {
+        'gain': float(rng.uniform(*GAIN_RANGE)),
+        'gradient': float(rng.uniform(*GRADIENT_RANGE)),
+        'angle': float(rng.uniform(0, 2 * np.pi)),
+        'tint': [float(t) for t in 1.0 + rng.uniform(-TINT_RANGE, TINT_RANGE, 3)],
+        'noise': float(rng.uniform(*NOISE_RANGE)),
+    }
+    image = apply_lighting(render_scene(scaled, size, objects, noise=0.0), rng, **lighting)
+
+    truth = {'size': list(size), 'lighting': lighting, 'objects': []}
+    if objects:
+        paper = np.array([(x, y) for _, x, y, _ in objects])
+        pixels = paper_to_pixel(scaled, paper)
+        robot = paper_to_robot(paper, *(offsets or workspace_offsets()))
+        for (name, _, _, r), p, px, rb in zip(objects, paper, pixels, robot):
+            truth['objects'].append({'color': name, 'radius_mm': float(r),
+                                     'paper_mm': p.tolist(), 'pixel': px.tolist(), 'robot_mm': rb.tolist()})
+    return image, truth
+
+
+def write_dataset(out_dir, count, objects, sizes, seed=0, matrix=None):
+    """ scene_NNNN.jpg + scene_NNNN.json per scene, cycling through sizes. """
+    matrix = load_matrix() if matrix is None else matrix
+    rng = np.random.default_rng(seed)
+    offsets = workspace_offsets()
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(count):
+        image, truth = make_scene(rng, matrix, sizes[i % len(sizes)], objects, offsets=offsets)
+        stem = os.path.join(out_dir, f"scene_{i:04d}")
+        cv2.imwrite(stem + '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        with open(stem + '.json', 'w') as f:
+            json.dump(truth, f, indent=2)
+
+
+def load_dataset(path):
+    """ [(image, truth)] for every scene_NNNN.jpg with its .json. """
+    scenes = []
+    for json_path in sorted(glob.glob(os.path.join(path, 'scene_*.json'))):
+        image = cv2.imread(json_path[:-5] + '.jpg', cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        with open(json_path, 'r') as f:
+            scenes.append((image, json.load(f)))
+    return scenes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes labelled synthetic workspace images')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--objects', type=int, default=6)
+    parser.add_argument('--framesize', type=int, nargs='+', default=[8], choices=sorted(FRAMESIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_dataset(args.out, args.count, args.objects, [FRAMESIZES[k] for k in args.framesize], args.seed)
+    print(f"{args.count} scenes -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
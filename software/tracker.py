@@ -0,0 +1,172 @@
+'''Frame-to-frame object tracks in robot mm, plus a cheap "did the scene change" gate'''
+import itertools
+
+import cv2
+import numpy as np
+
+
+# --- Tracking ---
+MATCH_DIST = 10.0        # mm: same object in consecutive frames (CONFIRM_DIST in final_com_with_P.py)
+SMOOTHING = 0.5          # weight of the new measurement in the smoothed centre
+CONFIRM_HITS = 2         # frames a track must be seen before it is a pick target
+MAX_MISSES = 2           # frames a track survives without a match
+
+# --- Frame-difference gate ---
+GATE_SIZE = 80           # px width of the grey thumbnail that is compared
+GATE_PIXEL_DELTA = 20    # grey-level change that counts as a changed thumbnail pixel
+GATE_CHANGED_FRACTION = 0.001   # ~5 thumbnail pixels: a small object appearing or leaving
+
+
+class Track:
+    """ One object seen over several frames. obj is the latest find_objects() dict. """
+
+    def __init__(self, track_id, obj):
+        self.id = track_id
+        self.color = obj['color']
+        self.xy = np.array(obj['robot_coords'][:2], dtype=np.float64)
+        self.obj = obj
+        self.hits = 1
+        self.misses = 0
+
+    def update(self, obj, alpha=SMOOTHING):
+        self.xy += alpha * (np.asarray(obj['robot_coords'][:2], dtype=np.float64) - self.xy)
+        self.obj = obj
+        self.hits += 1
+        self.misses = 0
+
+    @property
+    def robot_coords(self):
+        """ Smoothed (x, y) with the detected z. """
+        return (float(self.xy[0]), float(self.xy[1]), self.obj['robot_coords'][2])
+
+    def confirmed(self, confirm_hits=CONFIRM_HITS):
+        return self.hits >= confirm_hits and self.misses == 0
+
+
+def associate(tracks_xy, dets_xy, max_dist=MATCH_DIST):
+    """
+    Greedy global nearest neighbour: closest (track, detection) pair first,
+    each used once, pairs further than max_dist are left unmatched.
+    With a handful of well separated objects this gives the same answer as
+    the Hungarian assignment.
+    Returns [(track index, detection index)].
+    """
+    if len(tracks_xy) == 0 or len(dets_xy) == 0:
+        return []
+    dist = np.linalg.norm(np.asarray(tracks_xy)[:, None, :] - np.asarray(dets_xy)[None, :, :], axis=2)
+    pairs = []
+    used_t, used_d = set(), set()
+    for flat in np.argsort(dist, axis=None):
+        t, d = np.unravel_index(flat, dist.shape)
+        if dist[t, d] > max_dist:
+            break
+        if t in used_t or d in used_d:
+            continue
+        pairs.append((int(t), int(d)))
+        used_t.add(t)
+        used_d.add(d)
+    return pairs
+
+
+class ObjectTracker:
+    """
+    Keeps tracks across frames (per colour). A detection only becomes a pick
+    target after CONFIRM_HITS consecutive frames, so one-frame false positives
+    never reach the arm. Picked tracks are remembered for one more update:
+    if something is still detected there, the pick is reported as failed.
+    """
+
+    def __init__(self, max_dist=MATCH_DIST, alpha=SMOOTHING,
+                 confirm_hits=CONFIRM_HITS, max_misses=MAX_MISSES):
+        self.max_dist = max_dist
+        self.alpha = alpha
+        self.confirm_hits = confirm_hits
+        self.max_misses = max_misses
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._picked = []
+        self.failed_picks = []
+
+    def update(self, objs):
+        """ New detections of a changed frame. Returns the live tracks. """
+        unmatched = list(range(len(objs)))
+        for color in {t.color for t in self.tracks} | {o['color'] for o in objs}:
+            tracks = [t for t in self.tracks if t.color == color]
+            dets = [i for i in unmatched if objs[i]['color'] == color]
+            pairs = associate([t.xy for t in tracks],
+                              [objs[i]['robot_coords'][:2] for i in dets], self.max_dist)
+            matched = set()
+            for t, d in pairs:
+                tracks[t].update(objs[dets[d]], self.alpha)
+                matched.add(t)
+                unmatched.remove(dets[d])
+            for t, track in enumerate(tracks):
+                if t not in matched:
+                    track.misses += 1
+
+        # Something is still where the arm just picked: the pick missed
+        for picked in self._picked:
+            for i in unmatched:
+                obj = objs[i]
+                if obj['color'] == picked.color and \
+                        np.hypot(*(np.asarray(obj['robot_coords'][:2]) - picked.xy)) <= self.max_dist:
+                    self.failed_picks.append(picked)
+                    break
+        self._picked = []
+
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        self.tracks += [Track(next(self._ids), objs[i]) for i in unmatched]
+        return self.tracks
+
+    def hold(self):
+        """ Frame unchanged (MotionGate): every live track counts as seen again. """
+        for track in self.tracks:
+            if track.misses == 0:
+                track.hits += 1
+
+    def confirmed(self):
+        return [t for t in self.tracks if t.confirmed(self.confirm_hits)]
+
+    def picked(self, track):
+        """ The arm took this track's object; verified on the next update(). """
+        self.tracks = [t for t in self.tracks if t is not track]
+        self._picked.append(track)
+
+    def pop_failed(self):
+        failed, self.failed_picks = self.failed_picks, []
+        return failed
+
+
+class MotionGate:
+    """
+    Compares a small grey thumbnail of each frame (optionally only the ROI)
+    with the one from the last full detection; detection is needed only when
+    enough thumbnail pixels changed.
+    """
+
+    def __init__(self, size=GATE_SIZE, pixel_delta=GATE_PIXEL_DELTA,
+                 changed_fraction=GATE_CHANGED_FRACTION):
+        self.size = size
+        self.pixel_delta = pixel_delta
+        self.changed_fraction = changed_fraction
+        self.reference = None
+
+    def thumbnail(self, image):
+        height, width = image.shape[:2]
+        small = cv2.resize(image, (self.size, max(1, round(self.size * height / width))),
+                           interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def changed(self, image):
+        thumb = self.thumbnail(image)
+        if self.reference is None or self.reference.shape != thumb.shape:
+            return True
+        diff = cv2.absdiff(thumb, self.reference)
+        return np.count_nonzero(diff > self.pixel_delta) > self.changed_fraction * diff.size
+
+    def accept(self, image):
+        """ Makes this frame the reference (call after a full detection). """
+        self.reference = self.thumbnail(image)
+
+    def reset(self):
+        self.reference = None
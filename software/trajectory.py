@@ -0,0 +1,118 @@
+'''Time-optimal joint trajectories with per-joint speed / acceleration limits'''
+import numpy as np
+
+
+# Joint limits (deg/s, deg/s^2 for Base, Shoulder, Elbow, Claw) and the
+# setpoint period are motion.max_vel / max_acc / dt in settings.json
+
+
+def trapezoid_time(distance, v_max, a_max):
+    """ Minimum time to cover `distance` from rest to rest (trapezoid or triangle profile). """
+    distance = np.abs(np.asarray(distance, dtype=np.float64))
+    v_max = np.asarray(v_max, dtype=np.float64)
+    a_max = np.asarray(a_max, dtype=np.float64)
+    d_ramp = v_max ** 2 / a_max
+    return np.where(distance < d_ramp,
+                    2.0 * np.sqrt(distance / a_max),
+                    distance / v_max + v_max / a_max)
+
+
+def _trapezoid_position(t, duration, distance, a_max):
+    """
+    Position along a rest-to-rest profile that covers `distance` in exactly `duration`
+    with acceleration a_max (cruise speed solved for the given duration).
+    """
+    distance = np.abs(distance)
+    if duration <= 0 or distance == 0:
+        return np.full_like(t, distance)
+    # Cruise speed v for duration T: v^2/a - v*T + d = 0 (smaller root)
+    disc = max(duration ** 2 - 4.0 * distance / a_max, 0.0)
+    v = a_max * (duration - np.sqrt(disc)) / 2.0
+    t_acc = v / a_max
+    t = np.clip(t, 0.0, duration)
+    return np.where(
+        t < t_acc, 0.5 * a_max * t ** 2,
+        np.where(t <= duration - t_acc,
+                 0.5 * a_max * t_acc ** 2 + v * (t - t_acc),
+                 distance - 0.5 * a_max * (duration - t) ** 2))
+
+
+def plan_segment(start, goal, max_vel, max_acc):
+    """
+    Duration of a synchronised rest-to-rest move: the slowest joint sets it,
+    and sample_segment() stretches the other joints (lower cruise speed, same
+    max_acc ramps) to finish at the same time.
+    """
+    start = np.asarray(start, dtype=np.float64)
+    goal = np.asarray(goal, dtype=np.float64)
+    delta = np.abs(goal - start)
+    return float(np.max(trapezoid_time(delta, max_vel, max_acc)))
+
+
+def sample_segment(start, goal, duration, max_acc, dt):
+    """ (N, J) setpoints every dt from start (exclusive) to goal (inclusive). """
+    start = np.asarray(start, dtype=np.float64)
+    goal = np.asarray(goal, dtype=np.float64)
+    n = max(1, int(np.ceil(duration / dt)))
+    t = np.arange(1, n + 1) * (duration / n)
+    delta = goal - start
+    out = np.empty((n, len(start)))
+    for j in range(len(start)):
+        s = _trapezoid_position(t, duration, delta[j], max_acc[j])
+        out[:, j] = start[j] + np.sign(delta[j]) * s
+    return out
+
+
+class Trajectory:
+    """ Precomputed setpoint sequence plus its planned duration. """
+
+    def __init__(self, setpoints, dt, duration):
+        self.setpoints = setpoints
+        self.dt = dt
+        self.duration = duration
+
+    def __len__(self):
+        return len(self.setpoints)
+
+    def as_commands(self):
+        """ int tuples ready for SerialTransport.send_trajectory() """
+        return [tuple(int(round(a)) for a in row) for row in self.setpoints]
+
+
+def plan(waypoints, max_vel, max_acc, dt):
+    """
+    waypoints: (K, J) joint angles, the first row is the current position.
+    Two waypoints give a synchronised trapezoidal move; with more waypoints
+    the arm passes through the intermediate points without stopping.
+    Everything is computed in one pass.
+    """
+    w = np.asarray(waypoints, dtype=np.float64)
+    max_vel = np.asarray(max_vel, dtype=np.float64)[:w.shape[1]]
+    max_acc = np.asarray(max_acc, dtype=np.float64)[:w.shape[1]]
+
+    # Drop repeated waypoints (zero-length segments)
+    keep = np.ones(len(w), dtype=bool)
+    keep[1:] = np.any(np.abs(np.diff(w, axis=0)) > 1e-9, axis=1)
+    w = w[keep]
+    if len(w) < 2:
+        return Trajectory(w[-1:].copy(), dt, 0.0)
+
+    if len(w) == 2:
+        duration = plan_segment(w[0], w[1], max_vel, max_acc)
+        setpoints = sample_segment(w[0], w[1], duration, max_acc, dt)
+        return Trajectory(setpoints, dt, len(setpoints) * dt)
+
+    # Multi-waypoint: one trapezoid along the whole piecewise-linear path.
+    # Path parameter = time each segment takes with its slowest joint at full
+    # speed, so ds/dt <= 1 keeps every joint under max_vel; the acceleration
+    # bound follows the same way. Corners are passed at speed (dense,
+    # nearly collinear waypoints such as the slide approach).
+    seg_len = np.max(np.abs(np.diff(w, axis=0)) / max_vel, axis=1)
+    s_knots = np.concatenate([[0.0], np.cumsum(seg_len)])
+    s_acc = float(np.min(max_acc / max_vel))
+    duration = float(trapezoid_time(s_knots[-1], 1.0, s_acc))
+    n = max(1, int(np.ceil(duration / dt)))
+    t = np.arange(1, n + 1) * (duration / n)
+    s_t = _trapezoid_position(t, duration, s_knots[-1], s_acc)
+    setpoints = np.column_stack([np.interp(s_t, s_knots, w[:, j]) for j in range(w.shape[1])])
+    return Trajectory(setpoints, dt, len(setpoints) * dt)